@@ -18,10 +18,10 @@ COMPILE_ARGS = ("-Wall -g -O2 -shared -fPIC"
 SSE_FLAGS = "-mfpmath=sse -msse2"
 SOURCE_FILES = [
     'pyhelper.c', 'serialqueue.c', 'stepcompress.c', 'itersolve.c', 'trapq.c',
-    'pollreactor.c', 'msgblock.c', 'trdispatch.c',
+    'pollreactor.c', 'msgblock.c', 'trdispatch.c', 'steppool.c',
     'kin_cartesian.c', 'kin_corexy.c', 'kin_corexz.c', 'kin_delta.c',
     'kin_deltesian.c', 'kin_polar.c', 'kin_rotary_delta.c', 'kin_winch.c',
-    'kin_extruder.c', 'kin_shaper.c', 'kin_idex.c',
+    'kin_extruder.c', 'kin_shaper.c', 'kin_idex.c', 'kin_bedmesh.c',
 ]
 DEST_LIB = "c_helper.so"
 OTHER_FILES = [
@@ -39,6 +39,8 @@ defs_stepcompress = """
     struct stepcompress *stepcompress_alloc(uint32_t oid);
     void stepcompress_fill(struct stepcompress *sc, uint32_t max_error
         , int32_t queue_step_msgtag, int32_t set_next_step_dir_msgtag);
+    void stepcompress_set_high_ratio(struct stepcompress *sc
+        , uint32_t high_ratio);
     void stepcompress_set_invert_sdir(struct stepcompress *sc
         , uint32_t invert_sdir);
     void stepcompress_free(struct stepcompress *sc);
@@ -95,6 +97,7 @@ defs_trapq = """
         , double start_pos_x, double start_pos_y, double start_pos_z
         , double axes_r_x, double axes_r_y, double axes_r_z
         , double start_v, double cruise_v, double accel);
+    void trapq_append_batch(struct trapq *tq, double *data, int data_len);
     void trapq_finalize_moves(struct trapq *tq, double print_time
         , double clear_history_time);
     void trapq_set_position(struct trapq *tq, double print_time
@@ -103,6 +106,13 @@ defs_trapq = """
         , double start_time, double end_time);
 """
 
+defs_steppool = """
+    struct steppool *steppool_alloc(int num_threads);
+    void steppool_free(struct steppool *sp);
+    int32_t steppool_generate_steps(struct steppool *sp
+        , struct stepper_kinematics **sks, int count, double flush_time);
+"""
+
 defs_kin_cartesian = """
     struct stepper_kinematics *cartesian_stepper_alloc(char axis);
 """
@@ -157,6 +167,22 @@ defs_kin_shaper = """
     struct stepper_kinematics * input_shaper_alloc(void);
 """
 
+defs_kin_bedmesh = """
+    void bed_mesh_set_sk(struct stepper_kinematics *sk
+        , struct stepper_kinematics *orig_sk);
+    int bed_mesh_set_table(struct stepper_kinematics *sk
+        , double x_min, double x_dist, int x_count
+        , double y_min, double y_dist, int y_count, double z[]);
+    void bed_mesh_set_offsets(struct stepper_kinematics *sk, double x_offs
+        , double y_offs);
+    void bed_mesh_set_fade(struct stepper_kinematics *sk, double fade_start
+        , double fade_end, double fade_target);
+    double bed_mesh_calc_offset(struct stepper_kinematics *sk, double x
+        , double y, double z);
+    struct stepper_kinematics *bed_mesh_alloc(void);
+    void bed_mesh_free(struct stepper_kinematics *sk);
+"""
+
 defs_kin_idex = """
     void dual_carriage_set_sk(struct stepper_kinematics *sk
         , struct stepper_kinematics *orig_sk);
@@ -185,6 +211,8 @@ defs_serialqueue = """
         , uint64_t notify_id);
     void serialqueue_pull(struct serialqueue *sq
         , struct pull_queue_message *pqm);
+    int serialqueue_pull_batch(struct serialqueue *sq
+        , struct pull_queue_message *q, int max);
     void serialqueue_set_wire_frequency(struct serialqueue *sq
         , double frequency);
     void serialqueue_set_receive_window(struct serialqueue *sq
@@ -220,10 +248,10 @@ defs_std = """
 
 defs_all = [
     defs_pyhelper, defs_serialqueue, defs_std, defs_stepcompress,
-    defs_itersolve, defs_trapq, defs_trdispatch,
+    defs_itersolve, defs_trapq, defs_trdispatch, defs_steppool,
     defs_kin_cartesian, defs_kin_corexy, defs_kin_corexz, defs_kin_delta,
     defs_kin_deltesian, defs_kin_polar, defs_kin_rotary_delta, defs_kin_winch,
-    defs_kin_extruder, defs_kin_shaper, defs_kin_idex,
+    defs_kin_extruder, defs_kin_shaper, defs_kin_idex, defs_kin_bedmesh,
 ]
 
 # Update filenames to an absolute path
@@ -139,7 +139,9 @@ check_active(struct stepper_kinematics *sk, struct move *m)
     int af = sk->active_flags;
     return ((af & AF_X && m->axes_r.x != 0.)
             || (af & AF_Y && m->axes_r.y != 0.)
-            || (af & AF_Z && m->axes_r.z != 0.));
+            || (af & AF_Z && m->axes_r.z != 0.)
+            || (af & AF_XY_ADJUST && (m->axes_r.x != 0.
+                                      || m->axes_r.y != 0.)));
 }
 
 // Generate step times for a range of moves on the trapq
@@ -5,6 +5,8 @@
 
 enum {
     AF_X = 1 << 0, AF_Y = 1 << 1, AF_Z = 1 << 2,
+    // Stepper also moves on xy moves (without being an x or y axis)
+    AF_XY_ADJUST = 1 << 3,
 };
 
 struct stepper_kinematics;
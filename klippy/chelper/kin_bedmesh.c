@@ -0,0 +1,184 @@
+// Bed mesh z adjustment applied during step generation
+//
+// Copyright (C) 2026  agent <agent@local>
+//
+// This file may be distributed under the terms of the GNU GPLv3 license.
+
+#include <math.h> // floor
+#include <stddef.h> // offsetof
+#include <stdlib.h> // malloc
+#include <string.h> // memset
+#include "compiler.h" // __visible
+#include "itersolve.h" // struct stepper_kinematics
+#include "trapq.h" // struct move
+
+#define DUMMY_T 500.0
+
+struct bed_mesh_stepper {
+    struct stepper_kinematics sk;
+    struct stepper_kinematics *orig_sk;
+    struct move m;
+    // Mesh definition (z_table is y_count rows of x_count values)
+    double x_min, x_dist, y_min, y_dist;
+    int x_count, y_count;
+    double *z_table;
+    double x_offs, y_offs;
+    // Fade settings (fade_start/fade_end already include the tool offset)
+    double fade_start, fade_end, fade_target;
+};
+
+// Determine the cell index and the relative position within that cell
+static inline int
+calc_index(double coord, double min, double dist, int count, double *t)
+{
+    int idx = floor((coord - min) / dist);
+    if (idx < 0)
+        idx = 0;
+    else if (idx > count - 2)
+        idx = count - 2;
+    double rel = (coord - (min + dist * idx)) / dist;
+    *t = rel < 0. ? 0. : (rel > 1. ? 1. : rel);
+    return idx;
+}
+
+static inline double
+lerp(double t, double v0, double v1)
+{
+    return (1. - t) * v0 + t * v1;
+}
+
+// Bilinear interpolation of the mesh (matches ZMesh.calc_z)
+static double
+calc_mesh_z(struct bed_mesh_stepper *bm, double x, double y)
+{
+    double tx, ty;
+    int xi = calc_index(x + bm->x_offs, bm->x_min, bm->x_dist, bm->x_count
+                        , &tx);
+    int yi = calc_index(y + bm->y_offs, bm->y_min, bm->y_dist, bm->y_count
+                        , &ty);
+    double *row0 = &bm->z_table[yi * bm->x_count + xi];
+    double *row1 = row0 + bm->x_count;
+    double z0 = lerp(tx, row0[0], row0[1]);
+    double z1 = lerp(tx, row1[0], row1[1]);
+    return lerp(ty, z0, z1);
+}
+
+// Total z adjustment at the given (uncompensated) position
+static double
+calc_offset(struct bed_mesh_stepper *bm, double x, double y, double z)
+{
+    if (!bm->z_table)
+        return bm->fade_target;
+    if (z >= bm->fade_end)
+        return bm->fade_target;
+    double mesh_z = calc_mesh_z(bm, x, y) - bm->fade_target;
+    if (z >= bm->fade_start)
+        mesh_z *= (bm->fade_end - z) / (bm->fade_end - bm->fade_start);
+    return mesh_z + bm->fade_target;
+}
+
+static double
+bed_mesh_calc_position(struct stepper_kinematics *sk, struct move *m
+                       , double move_time)
+{
+    struct bed_mesh_stepper *bm = container_of(
+            sk, struct bed_mesh_stepper, sk);
+    struct coord pos = move_get_coord(m, move_time);
+    pos.z += calc_offset(bm, pos.x, pos.y, pos.z);
+    bm->m.start_pos = pos;
+    return bm->orig_sk->calc_position_cb(bm->orig_sk, &bm->m, DUMMY_T);
+}
+
+void __visible
+bed_mesh_set_sk(struct stepper_kinematics *sk
+                , struct stepper_kinematics *orig_sk)
+{
+    struct bed_mesh_stepper *bm = container_of(
+            sk, struct bed_mesh_stepper, sk);
+    bm->sk.calc_position_cb = bed_mesh_calc_position;
+    // The z adjustment depends on the xy position, so this stepper
+    // must be considered active on all xy moves (without reporting it
+    // as an x or y axis)
+    bm->sk.active_flags = orig_sk->active_flags | AF_XY_ADJUST;
+    bm->orig_sk = orig_sk;
+    bm->sk.commanded_pos = orig_sk->commanded_pos;
+    bm->sk.last_flush_time = orig_sk->last_flush_time;
+    bm->sk.last_move_time = orig_sk->last_move_time;
+}
+
+// Load a new mesh (a zero count removes the current mesh)
+int __visible
+bed_mesh_set_table(struct stepper_kinematics *sk
+                   , double x_min, double x_dist, int x_count
+                   , double y_min, double y_dist, int y_count, double z[])
+{
+    struct bed_mesh_stepper *bm = container_of(
+            sk, struct bed_mesh_stepper, sk);
+    free(bm->z_table);
+    bm->z_table = NULL;
+    if (!x_count && !y_count)
+        return 0;
+    if (x_count < 2 || y_count < 2 || x_dist <= 0. || y_dist <= 0.)
+        return -1;
+    int size = x_count * y_count * sizeof(bm->z_table[0]);
+    bm->z_table = malloc(size);
+    if (!bm->z_table)
+        return -1;
+    memcpy(bm->z_table, z, size);
+    bm->x_min = x_min;
+    bm->x_dist = x_dist;
+    bm->x_count = x_count;
+    bm->y_min = y_min;
+    bm->y_dist = y_dist;
+    bm->y_count = y_count;
+    return 0;
+}
+
+void __visible
+bed_mesh_set_offsets(struct stepper_kinematics *sk, double x_offs
+                     , double y_offs)
+{
+    struct bed_mesh_stepper *bm = container_of(
+            sk, struct bed_mesh_stepper, sk);
+    bm->x_offs = x_offs;
+    bm->y_offs = y_offs;
+}
+
+void __visible
+bed_mesh_set_fade(struct stepper_kinematics *sk, double fade_start
+                  , double fade_end, double fade_target)
+{
+    struct bed_mesh_stepper *bm = container_of(
+            sk, struct bed_mesh_stepper, sk);
+    bm->fade_start = fade_start;
+    bm->fade_end = fade_end;
+    bm->fade_target = fade_target;
+}
+
+// Report the z adjustment that is applied at the given position
+double __visible
+bed_mesh_calc_offset(struct stepper_kinematics *sk, double x, double y
+                     , double z)
+{
+    struct bed_mesh_stepper *bm = container_of(
+            sk, struct bed_mesh_stepper, sk);
+    return calc_offset(bm, x, y, z);
+}
+
+struct stepper_kinematics * __visible
+bed_mesh_alloc(void)
+{
+    struct bed_mesh_stepper *bm = malloc(sizeof(*bm));
+    memset(bm, 0, sizeof(*bm));
+    bm->m.move_t = 2. * DUMMY_T;
+    return &bm->sk;
+}
+
+void __visible
+bed_mesh_free(struct stepper_kinematics *sk)
+{
+    struct bed_mesh_stepper *bm = container_of(
+            sk, struct bed_mesh_stepper, sk);
+    free(bm->z_table);
+    free(bm);
+}
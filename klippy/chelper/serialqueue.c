@@ -835,44 +835,57 @@ serialqueue_send(struct serialqueue *sq, struct command_queue *cq, uint8_t *msg
     serialqueue_send_one(sq, cq, qm);
 }
 
-// Return a message read from the serial port (or wait for one if none
-// available)
-void __visible
-serialqueue_pull(struct serialqueue *sq, struct pull_queue_message *pqm)
+// Return up to 'max' messages read from the serial port (or wait for
+// one if none available).  Returns the number of messages copied or -1
+// if the serialqueue is exiting.
+int __visible
+serialqueue_pull_batch(struct serialqueue *sq, struct pull_queue_message *q
+                       , int max)
 {
     pthread_mutex_lock(&sq->lock);
     // Wait for message to be available
     while (list_empty(&sq->receive_queue)) {
-        if (pollreactor_is_exit(sq->pr))
-            goto exit;
+        if (pollreactor_is_exit(sq->pr)) {
+            pthread_mutex_unlock(&sq->lock);
+            return -1;
+        }
         sq->receive_waiting = 1;
         int ret = pthread_cond_wait(&sq->cond, &sq->lock);
         if (ret)
             report_errno("pthread_cond_wait", ret);
     }
 
-    // Remove message from queue
-    struct queue_message *qm = list_first_entry(
-        &sq->receive_queue, struct queue_message, node);
-    list_del(&qm->node);
-
-    // Copy message
-    memcpy(pqm->msg, qm->msg, qm->len);
-    pqm->len = qm->len;
-    pqm->sent_time = qm->sent_time;
-    pqm->receive_time = qm->receive_time;
-    pqm->notify_id = qm->notify_id;
-    if (qm->len)
-        debug_queue_add(&sq->old_receive, qm);
-    else
-        message_free(qm);
+    int count = 0;
+    while (count < max && !list_empty(&sq->receive_queue)) {
+        // Remove message from queue
+        struct queue_message *qm = list_first_entry(
+            &sq->receive_queue, struct queue_message, node);
+        list_del(&qm->node);
 
-    pthread_mutex_unlock(&sq->lock);
-    return;
+        // Copy message
+        struct pull_queue_message *pqm = &q[count++];
+        memcpy(pqm->msg, qm->msg, qm->len);
+        pqm->len = qm->len;
+        pqm->sent_time = qm->sent_time;
+        pqm->receive_time = qm->receive_time;
+        pqm->notify_id = qm->notify_id;
+        if (qm->len)
+            debug_queue_add(&sq->old_receive, qm);
+        else
+            message_free(qm);
+    }
 
-exit:
-    pqm->len = -1;
     pthread_mutex_unlock(&sq->lock);
+    return count;
+}
+
+// Return a message read from the serial port (or wait for one if none
+// available)
+void __visible
+serialqueue_pull(struct serialqueue *sq, struct pull_queue_message *pqm)
+{
+    if (serialqueue_pull_batch(sq, pqm, 1) < 0)
+        pqm->len = -1;
 }
 
 void __visible
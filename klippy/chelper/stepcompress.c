@@ -33,6 +33,7 @@ struct stepcompress {
     uint32_t *queue, *queue_end, *queue_pos, *queue_next;
     // Internal tracking
     uint32_t max_error;
+    int high_ratio;
     double mcu_time_offset, mcu_freq, last_step_print_time;
     // Message generation
     uint64_t last_step_clock;
@@ -196,6 +197,127 @@ compress_bisect_add(struct stepcompress *sc)
     return (struct step_move){ bestinterval, bestcount, bestadd };
 }
 
+// Find the longest valid sequence that uses the given 'add'
+static struct step_move
+compress_fixed_add(struct stepcompress *sc, uint32_t *qlast, int32_t add)
+{
+    struct points point = minmax_point(sc, sc->queue_pos);
+    int32_t mininterval = point.minp, maxinterval = point.maxp;
+    int32_t count = 1;
+    while (&sc->queue_pos[count] < qlast) {
+        struct points nextpoint = minmax_point(sc, sc->queue_pos + count);
+        int32_t nextcount = count + 1;
+        int64_t c64 = (int64_t)add * (nextcount*(int64_t)count/2);
+        if (c64 > 0x40000000 || c64 < -0x40000000)
+            break;
+        int32_t c = c64;
+        int32_t nextmininterval = mininterval, nextmaxinterval = maxinterval;
+        if (nextmininterval*nextcount < nextpoint.minp - c)
+            nextmininterval = idiv_up(nextpoint.minp - c, nextcount);
+        if (nextmaxinterval*nextcount > nextpoint.maxp - c)
+            nextmaxinterval = idiv_down(nextpoint.maxp - c, nextcount);
+        if (nextmininterval > nextmaxinterval)
+            break;
+        mininterval = nextmininterval;
+        maxinterval = nextmaxinterval;
+        count = nextcount;
+    }
+    return (struct step_move){ maxinterval, count, add };
+}
+
+// Check if a 'step_move' matches the step times (without reporting)
+static int
+compress_line_valid(struct stepcompress *sc, struct step_move move)
+{
+    if (!move.count || (!move.interval && !move.add && move.count > 1)
+        || move.interval >= 0x80000000)
+        return 0;
+    uint32_t interval = move.interval, p = 0;
+    uint16_t i;
+    for (i=0; i<move.count; i++) {
+        struct points point = minmax_point(sc, sc->queue_pos + i);
+        p += interval;
+        if (p < point.minp || p > point.maxp || interval >= 0x80000000)
+            return 0;
+        interval += move.add;
+    }
+    return 1;
+}
+
+// Number of alternative sequences considered by the high_ratio search
+#define HIGH_RATIO_ADD_RANGE 2
+#define HIGH_RATIO_TRIM 16
+
+// Return the number of steps the following 'step_move' would cover
+// if the given 'step_move' were selected
+static int32_t
+compress_next_count(struct stepcompress *sc, struct step_move move)
+{
+    uint32_t *queue_pos = sc->queue_pos;
+    if (queue_pos + move.count >= sc->queue_next)
+        return 0;
+    uint64_t last_step_clock = sc->last_step_clock;
+    int32_t addfactor = move.count*(move.count-1)/2;
+    uint32_t ticks = move.add*addfactor + move.interval*move.count;
+    sc->queue_pos = queue_pos + move.count;
+    sc->last_step_clock = last_step_clock + ticks;
+    struct step_move next = compress_bisect_add(sc);
+    sc->queue_pos = queue_pos;
+    sc->last_step_clock = last_step_clock;
+    return next.count;
+}
+
+// Find a 'step_move' by comparing several candidate sequences based
+// on how many steps they and the following sequence cover.  This uses
+// more host cpu time, but may result in fewer queue_step commands.
+// The standard compress_bisect_add() result is always a candidate and
+// is used unless another candidate is both better and valid.
+static struct step_move
+compress_search_add(struct stepcompress *sc)
+{
+    struct step_move best = compress_bisect_add(sc);
+    uint32_t *qlast = sc->queue_next;
+    if (qlast > sc->queue_pos + 65535)
+        qlast = sc->queue_pos + 65535;
+    if (best.count <= 1 || best.count > 0x200
+        || &sc->queue_pos[best.count] >= qlast)
+        // Sequence can't be improved (or already covers all steps)
+        return best;
+    struct step_move orig = best;
+    int32_t bestscore = best.count + compress_next_count(sc, best);
+    // Check sequences using a nearby 'add'
+    int32_t add;
+    for (add = orig.add - HIGH_RATIO_ADD_RANGE
+             ; add <= orig.add + HIGH_RATIO_ADD_RANGE; add++) {
+        if (add == orig.add || add < -0x8000 || add > 0x7fff)
+            continue;
+        struct step_move move = compress_fixed_add(sc, qlast, add);
+        if (move.count <= 1 || move.interval >= 0x80000000
+            || (!move.interval && !add))
+            continue;
+        int32_t score = move.count + compress_next_count(sc, move);
+        if ((score > bestscore
+             || (score == bestscore && move.count > best.count))
+            && compress_line_valid(sc, move)) {
+            best = move;
+            bestscore = score;
+        }
+    }
+    // Check shorter versions of the original sequence
+    int32_t i;
+    for (i=1; i<=HIGH_RATIO_TRIM && i<orig.count; i++) {
+        // A prefix of a valid sequence is also valid
+        struct step_move move = orig;
+        move.count -= i;
+        int32_t score = move.count + compress_next_count(sc, move);
+        if (score > bestscore) {
+            best = move;
+            bestscore = score;
+        }
+    }
+    return best;
+}
+
 
 /****************************************************************
  * Step compress checking
@@ -264,6 +386,13 @@ stepcompress_fill(struct stepcompress *sc, uint32_t max_error
     sc->set_next_step_dir_msgtag = set_next_step_dir_msgtag;
 }
 
+// Select the step compression search strategy
+void __visible
+stepcompress_set_high_ratio(struct stepcompress *sc, uint32_t high_ratio)
+{
+    sc->high_ratio = !!high_ratio;
+}
+
 // Set the inverted stepper direction flag
 void __visible
 stepcompress_set_invert_sdir(struct stepcompress *sc, uint32_t invert_sdir)
@@ -380,7 +509,8 @@ queue_flush(struct stepcompress *sc, uint64_t move_clock)
     if (sc->queue_pos >= sc->queue_next)
         return 0;
     while (sc->last_step_clock < move_clock) {
-        struct step_move move = compress_bisect_add(sc);
+        struct step_move move = (sc->high_ratio ? compress_search_add(sc)
+                                 : compress_bisect_add(sc));
         int ret = check_line(sc, move);
         if (ret)
             return ret;
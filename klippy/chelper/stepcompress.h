@@ -15,6 +15,8 @@ struct stepcompress *stepcompress_alloc(uint32_t oid);
 void stepcompress_fill(struct stepcompress *sc, uint32_t max_error
                        , int32_t queue_step_msgtag
                        , int32_t set_next_step_dir_msgtag);
+void stepcompress_set_high_ratio(struct stepcompress *sc
+                                 , uint32_t high_ratio);
 void stepcompress_set_invert_sdir(struct stepcompress *sc
                                   , uint32_t invert_sdir);
 void stepcompress_free(struct stepcompress *sc);
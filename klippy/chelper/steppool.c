@@ -0,0 +1,149 @@
+// Generate steps for multiple steppers using a pool of threads
+//
+// Copyright (C) 2026  agent <agent@local>
+//
+// This file may be distributed under the terms of the GNU GPLv3 license.
+
+// Each stepper has its own stepper_kinematics and stepcompress
+// objects and the trapq is not modified during step generation, so
+// the itersolve_generate_steps() calls for different steppers can be
+// run in parallel.  The caller's thread also generates steps, so a
+// pool with N threads uses N-1 background threads.
+
+#include <pthread.h> // pthread_mutex_lock
+#include <stdlib.h> // malloc
+#include <string.h> // memset
+#include "compiler.h" // __visible
+#include "itersolve.h" // itersolve_generate_steps
+#include "pyhelper.h" // report_errno
+
+struct steppool {
+    pthread_mutex_t lock;
+    pthread_cond_t cond, done_cond;
+    int num_threads, do_exit;
+    pthread_t *threads;
+    // Current request
+    struct stepper_kinematics **sks;
+    int count, next_index, active_threads;
+    int32_t result;
+    unsigned int generation;
+    double flush_time;
+};
+
+// Generate steps for steppers in the current request until none remain
+static void
+steppool_run(struct steppool *sp)
+{
+    for (;;) {
+        int idx = __atomic_fetch_add(&sp->next_index, 1, __ATOMIC_RELAXED);
+        if (idx >= sp->count)
+            break;
+        int32_t ret = itersolve_generate_steps(sp->sks[idx], sp->flush_time);
+        if (ret)
+            __atomic_store_n(&sp->result, ret, __ATOMIC_RELAXED);
+    }
+}
+
+// Main loop of the background threads
+static void *
+steppool_thread(void *data)
+{
+    struct steppool *sp = data;
+    // Threads are created before the first request, so they start at
+    // the initial generation (sp->generation may already have been
+    // advanced by the time this thread first runs)
+    unsigned int generation = 0;
+    pthread_mutex_lock(&sp->lock);
+    for (;;) {
+        while (sp->generation == generation && !sp->do_exit)
+            pthread_cond_wait(&sp->cond, &sp->lock);
+        if (sp->do_exit)
+            break;
+        generation = sp->generation;
+        pthread_mutex_unlock(&sp->lock);
+
+        steppool_run(sp);
+
+        pthread_mutex_lock(&sp->lock);
+        if (!--sp->active_threads)
+            pthread_cond_signal(&sp->done_cond);
+    }
+    pthread_mutex_unlock(&sp->lock);
+    return NULL;
+}
+
+// Create a new 'steppool' object
+struct steppool * __visible
+steppool_alloc(int num_threads)
+{
+    struct steppool *sp = malloc(sizeof(*sp));
+    memset(sp, 0, sizeof(*sp));
+    pthread_mutex_init(&sp->lock, NULL);
+    pthread_cond_init(&sp->cond, NULL);
+    pthread_cond_init(&sp->done_cond, NULL);
+    if (num_threads < 1)
+        num_threads = 1;
+    sp->threads = malloc(sizeof(sp->threads[0]) * num_threads);
+    int i;
+    for (i=0; i<num_threads-1; i++) {
+        int ret = pthread_create(&sp->threads[i], NULL, steppool_thread, sp);
+        if (ret) {
+            report_errno("pthread_create", ret);
+            break;
+        }
+    }
+    sp->num_threads = i + 1;
+    return sp;
+}
+
+// Stop the background threads and free memory
+void __visible
+steppool_free(struct steppool *sp)
+{
+    if (!sp)
+        return;
+    pthread_mutex_lock(&sp->lock);
+    sp->do_exit = 1;
+    pthread_cond_broadcast(&sp->cond);
+    pthread_mutex_unlock(&sp->lock);
+    int i;
+    for (i=0; i<sp->num_threads-1; i++)
+        pthread_join(sp->threads[i], NULL);
+    pthread_cond_destroy(&sp->done_cond);
+    pthread_cond_destroy(&sp->cond);
+    pthread_mutex_destroy(&sp->lock);
+    free(sp->threads);
+    free(sp);
+}
+
+// Generate steps for a list of steppers (returns non-zero on error)
+int32_t __visible
+steppool_generate_steps(struct steppool *sp, struct stepper_kinematics **sks
+                        , int count, double flush_time)
+{
+    sp->sks = sks;
+    sp->count = count;
+    sp->result = 0;
+    sp->next_index = 0;
+    sp->flush_time = flush_time;
+    int bg_threads = sp->num_threads - 1;
+    if (count > 1 && bg_threads) {
+        // Wake background threads
+        pthread_mutex_lock(&sp->lock);
+        sp->active_threads = bg_threads;
+        sp->generation++;
+        pthread_cond_broadcast(&sp->cond);
+        pthread_mutex_unlock(&sp->lock);
+
+        steppool_run(sp);
+
+        // Wait for background threads to complete
+        pthread_mutex_lock(&sp->lock);
+        while (sp->active_threads)
+            pthread_cond_wait(&sp->done_cond, &sp->lock);
+        pthread_mutex_unlock(&sp->lock);
+    } else {
+        steppool_run(sp);
+    }
+    return sp->result;
+}
@@ -163,6 +163,21 @@ trapq_append(struct trapq *tq, double print_time
     }
 }
 
+#define TRAPQ_APPEND_FIELDS 13
+
+// Add a series of moves to the trapezoid velocity queue.  The 'data'
+// array contains TRAPQ_APPEND_FIELDS doubles for each move (in the
+// same order as the parameters to trapq_append()).
+void __visible
+trapq_append_batch(struct trapq *tq, double *data, int data_len)
+{
+    for (; data_len >= TRAPQ_APPEND_FIELDS
+         ; data_len -= TRAPQ_APPEND_FIELDS, data += TRAPQ_APPEND_FIELDS)
+        trapq_append(tq, data[0], data[1], data[2], data[3]
+                     , data[4], data[5], data[6], data[7], data[8], data[9]
+                     , data[10], data[11], data[12]);
+}
+
 // Expire any moves older than `print_time` from the trapezoid velocity queue
 void __visible
 trapq_finalize_moves(struct trapq *tq, double print_time
@@ -43,6 +43,7 @@ void trapq_append(struct trapq *tq, double print_time
                   , double start_pos_x, double start_pos_y, double start_pos_z
                   , double axes_r_x, double axes_r_y, double axes_r_z
                   , double start_v, double cruise_v, double accel);
+void trapq_append_batch(struct trapq *tq, double *data, int data_len);
 void trapq_finalize_moves(struct trapq *tq, double print_time
                           , double clear_history_time);
 void trapq_set_position(struct trapq *tq, double print_time
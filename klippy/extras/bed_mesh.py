@@ -4,6 +4,7 @@
 #
 # This file may be distributed under the terms of the GNU GPLv3 license.
 import logging, math, json, collections
+import chelper
 from . import probe
 
 PROFILE_VERSION = 1
@@ -12,6 +13,7 @@ PROFILE_OPTIONS = {
     'x_count': int, 'y_count': int, 'mesh_x_pps': int, 'mesh_y_pps': int,
     'algo': str, 'tension': float
 }
+PROFILE_CACHE_SIZE = 8
 
 class BedMeshError(Exception):
     pass
@@ -105,6 +107,9 @@ class BedMesh:
         self.tool_offset = 0.
         self.gcode = self.printer.lookup_object('gcode')
         self.splitter = MoveSplitter(config, self.gcode)
+        self.native = None
+        if config.getboolean('native_compensation', False):
+            self.native = NativeCompensation(config)
         # setup persistent storage
         self.pmgr = ProfileManager(config, self)
         self.save_profile = self.pmgr.save_profile
@@ -148,6 +153,7 @@ class BedMesh:
                     err_target = self.fade_target
                     self.z_mesh = None
                     self.fade_target = 0.
+                    self._update_native()
                     raise self.gcode.error(
                         "bed_mesh: ERROR, fade_target lies outside of mesh z "
                         "range\nmin: %.4f, max: %.4f, fade_target: %.4f"
@@ -156,6 +162,7 @@ class BedMesh:
             if self.fade_dist <= max(abs(min_z), abs(max_z)):
                 self.z_mesh = None
                 self.fade_target = 0.
+                self._update_native()
                 raise self.gcode.error(
                     "bed_mesh:  Mesh extends outside of the fade range, "
                     "please see the fade_start and fade_end options in"
@@ -166,6 +173,7 @@ class BedMesh:
         self.tool_offset = 0.
         self.z_mesh = mesh
         self.splitter.initialize(mesh, self.fade_target)
+        self._update_native()
         # cache the current position before a transform takes place
         gcode_move = self.printer.lookup_object('gcode_move')
         gcode_move.reset_last_position()
@@ -178,9 +186,17 @@ class BedMesh:
             return (self.fade_end - z_pos) / self.fade_dist
         else:
             return 1.
+    def _update_native(self):
+        if self.native is not None:
+            self.native.update(self.z_mesh, self.fade_start - self.tool_offset,
+                               self.fade_end - self.tool_offset,
+                               self.fade_target)
     def get_position(self):
         # Return last, non-transformed position
-        if self.z_mesh is None:
+        if self.native is not None:
+            # Adjustment is applied during step generation
+            self.last_position[:] = self.toolhead.get_position()
+        elif self.z_mesh is None:
             # No mesh calibrated, so send toolhead position
             self.last_position[:] = self.toolhead.get_position()
             self.last_position[2] -= self.fade_target
@@ -205,6 +221,11 @@ class BedMesh:
             self.last_position[:] = [x, y, z - final_z_adj, e]
         return list(self.last_position)
     def move(self, newpos, speed):
+        if self.native is not None:
+            speed = self.native.limit_speed(self.last_position, newpos, speed)
+            self.toolhead.move(newpos, speed)
+            self.last_position[:] = newpos
+            return
         factor = self.get_z_factor(newpos[2])
         if self.z_mesh is None or not factor:
             # No mesh calibrated, or mesh leveling phased out.
@@ -280,9 +301,11 @@ class BedMesh:
             for i, axis in enumerate(['X', 'Y']):
                 offsets[i] = gcmd.get_float(axis, None)
             self.z_mesh.set_mesh_offsets(offsets)
+            self.splitter.initialize(self.z_mesh, self.fade_target)
             tool_offset = gcmd.get_float("ZFADE", None)
             if tool_offset is not None:
                 self.tool_offset = tool_offset
+            self._update_native()
             gcode_move = self.printer.lookup_object('gcode_move')
             gcode_move.reset_last_position()
         else:
@@ -1260,65 +1283,239 @@ class MoveSplitter:
         self.z_mesh = None
         self.fade_offset = 0.
         self.gcode = gcode
+        self.last_xy = self.last_z = None
     def initialize(self, mesh, fade_offset):
         self.z_mesh = mesh
         self.fade_offset = fade_offset
+        self.last_xy = self.last_z = None
     def build_move(self, prev_pos, next_pos, factor):
         self.prev_pos = tuple(prev_pos)
         self.next_pos = tuple(next_pos)
-        self.current_pos = list(prev_pos)
         self.z_factor = factor
-        self.z_offset = self._calc_z_offset(prev_pos)
         self.traverse_complete = False
-        self.distance_checked = 0.
         axes_d = [self.next_pos[i] - self.prev_pos[i] for i in range(4)]
         self.total_move_length = math.sqrt(sum([d*d for d in axes_d[:3]]))
         self.axis_move = [not isclose(d, 0., abs_tol=1e-10) for d in axes_d]
-    def _calc_z_offset(self, pos):
-        z = self.z_mesh.calc_z(pos[0], pos[1])
+        # Determine the positions along the move where it is split
+        start_z = self._calc_mesh_z(prev_pos)
+        end_z = self._calc_mesh_z(next_pos)
+        self.split_points = []
+        if ((self.axis_move[0] or self.axis_move[1])
+            and self.total_move_length > self.move_check_distance):
+            self.split_points = self._find_splits(start_z, end_z)
+        self.split_points.append((1., end_z))
+        self.split_index = 0
+    def _calc_mesh_z(self, pos):
+        # The end of the previous move is usually the start of this move
+        xy = (pos[0], pos[1])
+        if xy != self.last_xy:
+            self.last_xy = xy
+            self.last_z = self.z_mesh.calc_z(pos[0], pos[1])
+        return self.last_z
+    def _calc_z_offset(self, z):
         offset = self.fade_offset
         return self.z_factor * (z - offset) + offset
-    def _set_next_move(self, distance_from_prev):
-        t = distance_from_prev / self.total_move_length
-        if t > 1. or t < 0.:
-            raise self.gcode.error(
-                "bed_mesh: Slice distance is negative "
-                "or greater than entire move length")
-        for i in range(4):
-            if self.axis_move[i]:
-                self.current_pos[i] = lerp(
-                    t, self.prev_pos[i], self.next_pos[i])
+    def _lerp_xy(self, t):
+        return (lerp(t, self.prev_pos[0], self.next_pos[0]),
+                lerp(t, self.prev_pos[1], self.next_pos[1]))
+    def _find_splits(self, start_z, end_z):
+        z_mesh = self.z_mesh
+        max_delta_z = self.split_delta_z / max(self.z_factor, 1e-6)
+        # The mesh is bilinear within each cell, so the mesh height along
+        # the move is a quadratic between each cell boundary crossing.
+        crossings = z_mesh.get_cell_crossings(self.prev_pos, self.next_pos)
+        dxy = [(self.next_pos[i] - self.prev_pos[i]) for i in range(2)]
+        max_dev = .25 * abs(z_mesh.get_cell_curvature(None, None, dxy))
+        check_curve = max_dev > .5 * max_delta_z
+        split_t = []
+        last_t = 0.
+        for t in crossings + [1.]:
+            if check_curve:
+                # Subdivide cells where the mesh "twist" curves the path
+                mid_x, mid_y = self._lerp_xy(.5 * (last_t + t))
+                curve = abs(z_mesh.get_cell_curvature(mid_x, mid_y, dxy))
+                max_dev = .25 * curve * (t - last_t)**2
+                if max_dev > .5 * max_delta_z:
+                    count = int(math.ceil(math.sqrt(
+                        max_dev / (.5 * max_delta_z))))
+                    for i in range(1, count):
+                        split_t.append(last_t + (t - last_t) * i / count)
+            if t < 1.:
+                split_t.append(t)
+            last_t = t
+        split_z = z_mesh.calc_z_many([self._lerp_xy(t) for t in split_t])
+        points = [(0., start_z)] + list(zip(split_t, split_z))
+        points.append((1., end_z))
+        if len(points) <= 2:
+            return []
+        # Only split where a straight line between split points would
+        # deviate from the mesh by more than split_delta_z
+        min_t = self.move_check_distance / self.total_move_length
+        splits = []
+        anchor = 0
+        check = 2
+        while check < len(points):
+            at, az = points[anchor]
+            ct, cz = points[check]
+            slope = (cz - az) / (ct - at)
+            for i in range(anchor + 1, check):
+                pt, pz = points[i]
+                if abs(az + slope * (pt - at) - pz) > max_delta_z:
+                    break
+            else:
+                check += 1
+                continue
+            # Split at the last point that was within tolerance
+            split = check - 1
+            while split < len(points) - 1 and points[split][0] - at < min_t:
+                split += 1
+            if split >= len(points) - 1:
+                break
+            splits.append(points[split])
+            anchor = split
+            check = split + 2
+        return splits
     def split(self):
-        if not self.traverse_complete:
-            if self.axis_move[0] or self.axis_move[1]:
-                # X and/or Y axis move, traverse if necessary
-                while self.distance_checked + self.move_check_distance \
-                        < self.total_move_length:
-                    self.distance_checked += self.move_check_distance
-                    self._set_next_move(self.distance_checked)
-                    next_z = self._calc_z_offset(self.current_pos)
-                    if abs(next_z - self.z_offset) >= self.split_delta_z:
-                        self.z_offset = next_z
-                        return self.current_pos[0], self.current_pos[1], \
-                            self.current_pos[2] + self.z_offset, \
-                            self.current_pos[3]
+        if self.traverse_complete:
+            return None
+        t, z = self.split_points[self.split_index]
+        self.split_index += 1
+        if self.split_index >= len(self.split_points):
             # end of move reached
-            self.current_pos[:] = self.next_pos
-            self.z_offset = self._calc_z_offset(self.current_pos)
-            # Its okay to add Z-Offset to the final move, since it will not be
-            # used again.
-            self.current_pos[2] += self.z_offset
             self.traverse_complete = True
-            return self.current_pos
+            pos = list(self.next_pos)
         else:
-            # Traverse complete
-            return None
+            pos = [lerp(t, self.prev_pos[i], self.next_pos[i])
+                   if self.axis_move[i] else self.prev_pos[i]
+                   for i in range(4)]
+        pos[2] += self._calc_z_offset(z)
+        return pos
+
+
+# Apply the mesh adjustment to the z steppers during step generation
+# (instead of splitting moves).  In this mode the toolhead position
+# does not include the mesh adjustment.
+class NativeCompensation:
+    def __init__(self, config):
+        self.printer = config.get_printer()
+        self.stepper_kinematics = []
+        self.orig_stepper_kinematics = []
+        self.in_set_position = False
+        # The z velocity added by the mesh is limited by the toolhead
+        # speed (the mesh slope times the xy velocity)
+        pconfig = config.getsection('printer')
+        max_velocity = pconfig.getfloat('max_velocity', above=0.)
+        self.max_z_velocity = pconfig.getfloat('max_z_velocity', max_velocity,
+                                               above=0.)
+        self.max_slope = 0.
+        self.fade_end = 0.
+        # Wrap the stepper kinematics before input_shaper (which wraps
+        # the kinematics during the klippy:connect event)
+        self.printer.register_event_handler("klippy:mcu_identify",
+                                            self._handle_mcu_identify)
+        self.printer.register_event_handler("toolhead:set_position",
+                                            self._handle_set_position)
+    def _handle_mcu_identify(self):
+        toolhead = self.printer.lookup_object('toolhead')
+        ffi_main, ffi_lib = chelper.get_ffi()
+        for stepper in toolhead.get_kinematics().get_steppers():
+            if not stepper.is_active_axis('z'):
+                continue
+            orig_sk = stepper.get_stepper_kinematics()
+            sk = ffi_main.gc(ffi_lib.bed_mesh_alloc(), ffi_lib.bed_mesh_free)
+            ffi_lib.bed_mesh_set_sk(sk, orig_sk)
+            stepper.set_stepper_kinematics(sk)
+            self.orig_stepper_kinematics.append(orig_sk)
+            self.stepper_kinematics.append(sk)
+    def _calc_max_slope(self, mesh):
+        # Find the largest z change per mm of xy movement over the mesh
+        matrix = mesh.mesh_matrix
+        max_slope2 = 0.
+        for y in range(len(matrix) - 1):
+            row0, row1 = matrix[y], matrix[y + 1]
+            for x in range(len(row0) - 1):
+                dx = max(abs(row0[x + 1] - row0[x]),
+                         abs(row1[x + 1] - row1[x])) / mesh.mesh_x_dist
+                dy = max(abs(row1[x] - row0[x]),
+                         abs(row1[x + 1] - row0[x + 1])) / mesh.mesh_y_dist
+                max_slope2 = max(max_slope2, dx**2 + dy**2)
+        return math.sqrt(max_slope2)
+    def limit_speed(self, oldpos, newpos, speed):
+        # Limit the speed of xy moves so that the z velocity added by
+        # the mesh stays within max_z_velocity
+        if (not self.max_slope
+            or (oldpos[0] == newpos[0] and oldpos[1] == newpos[1])
+            or min(oldpos[2], newpos[2]) >= self.fade_end):
+            return speed
+        return min(speed, self.max_z_velocity / self.max_slope)
+    def _calc_offset(self, pos):
+        if not self.stepper_kinematics:
+            return 0.
+        ffi_main, ffi_lib = chelper.get_ffi()
+        return ffi_lib.bed_mesh_calc_offset(self.stepper_kinematics[0],
+                                            pos[0], pos[1], pos[2])
+    def _set_physical_position(self, pos):
+        # Find the toolhead z that results in the requested nozzle z.
+        # The adjustment changes with z only while fading, and by less
+        # than the change in z, so a fixed point iteration converges.
+        x, y, z, e = pos
+        toolhead_z = z - self._calc_offset(pos)
+        for i in range(20):
+            new_z = z - self._calc_offset((x, y, toolhead_z))
+            if abs(new_z - toolhead_z) < 1e-9:
+                break
+            toolhead_z = new_z
+        toolhead = self.printer.lookup_object('toolhead')
+        self.in_set_position = True
+        try:
+            toolhead.set_position([x, y, new_z, e])
+        finally:
+            self.in_set_position = False
+    def _handle_set_position(self):
+        # Positions passed to toolhead.set_position() (eg, from homing)
+        # are physical positions - convert them to toolhead positions
+        if self.in_set_position or not self.stepper_kinematics:
+            return
+        pos = self.printer.lookup_object('toolhead').get_position()
+        if self._calc_offset(pos):
+            self._set_physical_position(pos)
+    def update(self, mesh, fade_start, fade_end, fade_target):
+        toolhead = self.printer.lookup_object('toolhead', None)
+        if toolhead is None or not self.stepper_kinematics:
+            return
+        # Steps already generated use the previous mesh
+        toolhead.flush_step_generation()
+        pos = toolhead.get_position()
+        pos[2] += self._calc_offset(pos)
+        ffi_main, ffi_lib = chelper.get_ffi()
+        table = (0., 1., 0, 0., 1., 0, ffi_main.NULL)
+        x_offs = y_offs = 0.
+        self.max_slope = 0.
+        self.fade_end = fade_end
+        if mesh is not None:
+            self.max_slope = self._calc_max_slope(mesh)
+            z_table = [z for row in mesh.mesh_matrix for z in row]
+            table = (mesh.mesh_x_min, mesh.mesh_x_dist, mesh.mesh_x_count,
+                     mesh.mesh_y_min, mesh.mesh_y_dist, mesh.mesh_y_count,
+                     z_table)
+            x_offs, y_offs = mesh.mesh_offsets
+        for sk in self.stepper_kinematics:
+            ret = ffi_lib.bed_mesh_set_table(sk, *table)
+            if ret:
+                raise self.printer.command_error(
+                    "bed_mesh: Unable to load mesh for step generation")
+            ffi_lib.bed_mesh_set_offsets(sk, x_offs, y_offs)
+            ffi_lib.bed_mesh_set_fade(sk, fade_start, fade_end, fade_target)
+        # Keep the nozzle at its current physical position
+        self._set_physical_position(pos)
 
 
 class ZMesh:
     def __init__(self, params, name):
         self.profile_name = name or "adaptive-%X" % (id(self),)
         self.probed_matrix = self.mesh_matrix = None
+        self.mesh_coefs = None
+        self.max_cell_twist = 0.
         self.mesh_params = params
         self.mesh_offsets = [0., 0.]
         logging.debug('bed_mesh: probe/mesh parameters:')
@@ -1392,17 +1589,25 @@ class ZMesh:
             msg += "Interpolation Algorithm: %s\n" \
                    % (self.mesh_params['algo'])
             msg += "Measured points:\n"
-            for y_line in range(self.mesh_y_count - 1, -1, -1):
-                for z in matrix[y_line]:
-                    msg += "  %f" % (z)
-                msg += "\n"
+            lines = ["".join(["  %f" % (z,) for z in matrix[y_line]])
+                     for y_line in range(self.mesh_y_count - 1, -1, -1)]
+            msg += "\n".join(lines) + "\n"
             print_func(msg)
         else:
             print_func("bed_mesh: Z Mesh not generated")
     def build_mesh(self, z_matrix):
         self.probed_matrix = z_matrix
         self._sample(z_matrix)
-        self.print_mesh(logging.debug)
+        self._calc_coefs()
+        if logging.getLogger().isEnabledFor(logging.DEBUG):
+            self.print_mesh(logging.debug)
+    def copy_mesh(self, z_mesh):
+        # Use the mesh of another ZMesh built from the same parameters
+        # and probed points
+        self.probed_matrix = [list(line) for line in z_mesh.probed_matrix]
+        self.mesh_matrix = [list(line) for line in z_mesh.mesh_matrix]
+        self.mesh_coefs = z_mesh.mesh_coefs
+        self.max_cell_twist = z_mesh.max_cell_twist
     def set_zero_reference(self, xpos, ypos):
         offset = self.calc_z(xpos, ypos)
         logging.info(
@@ -1413,6 +1618,7 @@ class ZMesh:
             for yidx in range(len(matrix)):
                 for xidx in range(len(matrix[yidx])):
                     matrix[yidx][xidx] -= offset
+        self._calc_coefs()
     def set_mesh_offsets(self, offsets):
         for i, o in enumerate(offsets):
             if o is not None:
@@ -1422,16 +1628,106 @@ class ZMesh:
     def get_y_coordinate(self, index):
         return self.mesh_y_min + self.mesh_y_dist * index
     def calc_z(self, x, y):
-        if self.mesh_matrix is not None:
-            tbl = self.mesh_matrix
-            tx, xidx = self._get_linear_index(x + self.mesh_offsets[0], 0)
-            ty, yidx = self._get_linear_index(y + self.mesh_offsets[1], 1)
-            z0 = lerp(tx, tbl[yidx][xidx], tbl[yidx][xidx+1])
-            z1 = lerp(tx, tbl[yidx+1][xidx], tbl[yidx+1][xidx+1])
-            return lerp(ty, z0, z1)
-        else:
+        if self.mesh_coefs is None:
             # No mesh table generated, no z-adjustment
             return 0.
+        return self.calc_z_many([(x, y)])[0]
+    def calc_z_many(self, points):
+        # Return the mesh height at each of a list of (x, y) points
+        coefs = self.mesh_coefs
+        if coefs is None:
+            return [0.] * len(points)
+        x_base = self.mesh_x_min - self.mesh_offsets[0]
+        y_base = self.mesh_y_min - self.mesh_offsets[1]
+        x_scale = 1. / self.mesh_x_dist
+        y_scale = 1. / self.mesh_y_dist
+        x_cells = self.mesh_x_count - 1
+        y_cells = self.mesh_y_count - 1
+        out = []
+        for x, y in points:
+            # Locate the cell and the relative (u, v) position within it
+            u = (x - x_base) * x_scale
+            if u <= 0.:
+                xidx, u = 0, 0.
+            elif u >= x_cells:
+                xidx, u = x_cells - 1, 1.
+            else:
+                xidx = int(u)
+                u -= xidx
+            v = (y - y_base) * y_scale
+            if v <= 0.:
+                yidx, v = 0, 0.
+            elif v >= y_cells:
+                yidx, v = y_cells - 1, 1.
+            else:
+                yidx = int(v)
+                v -= yidx
+            i = (yidx * x_cells + xidx) * 4
+            out.append(coefs[i] + u * (coefs[i+1] + v * coefs[i+3])
+                       + v * coefs[i+2])
+        return out
+    def _calc_coefs(self):
+        # Each mesh cell is interpolated with z = a + b*u + c*v + d*u*v
+        # (where u, v are the cell relative coordinates).  Store the
+        # coefficients of all cells (row by row) in a flat list.
+        tbl = self.mesh_matrix
+        coefs = []
+        for y in range(self.mesh_y_count - 1):
+            row0, row1 = tbl[y], tbl[y+1]
+            for x in range(self.mesh_x_count - 1):
+                z00, z10, z01, z11 = row0[x], row0[x+1], row1[x], row1[x+1]
+                coefs.extend((z00, z10 - z00, z01 - z00,
+                              z00 - z10 - z01 + z11))
+        self.mesh_coefs = coefs
+        self.max_cell_twist = max([abs(d) for d in coefs[3::4]])
+    def get_cell_crossings(self, start, end):
+        # Return the positions (0. < t < 1.) along a line from start to
+        # end where the line crosses a mesh cell boundary
+        crossings = []
+        for axis in range(2):
+            if axis == 0:
+                mesh_min = self.mesh_x_min
+                mesh_cnt = self.mesh_x_count
+                mesh_dist = self.mesh_x_dist
+            else:
+                mesh_min = self.mesh_y_min
+                mesh_cnt = self.mesh_y_count
+                mesh_dist = self.mesh_y_dist
+            delta = end[axis] - start[axis]
+            if isclose(delta, 0., abs_tol=1e-10):
+                continue
+            coord = start[axis] + self.mesh_offsets[axis]
+            i0 = (coord - mesh_min) / mesh_dist
+            i1 = i0 + delta / mesh_dist
+            first = max(int(math.floor(min(i0, i1))) + 1, 0)
+            last = min(int(math.ceil(max(i0, i1))) - 1, mesh_cnt - 1)
+            for idx in range(first, last + 1):
+                t = (mesh_min + idx * mesh_dist - coord) / delta
+                if 0. < t < 1.:
+                    crossings.append(t)
+        crossings.sort()
+        return crossings
+    def get_cell_curvature(self, x, y, delta):
+        # Return the second order coefficient of the mesh height along a
+        # move of length 'delta' (x, y) through the cell at x, y (or the
+        # maximum over all cells if x, y is None)
+        if self.mesh_coefs is None:
+            return 0.
+        scale = delta[0] * delta[1] / (self.mesh_x_dist * self.mesh_y_dist)
+        if x is None:
+            return self.max_cell_twist * abs(scale)
+        x += self.mesh_offsets[0]
+        y += self.mesh_offsets[1]
+        if (x <= self.mesh_x_min or x >= self.mesh_x_max
+            or y <= self.mesh_y_min or y >= self.mesh_y_max):
+            # Mesh is not bilinear outside of its boundary
+            return 0.
+        xidx = int((x - self.mesh_x_min) / self.mesh_x_dist)
+        xidx = min(xidx, self.mesh_x_count - 2)
+        yidx = int((y - self.mesh_y_min) / self.mesh_y_dist)
+        yidx = min(yidx, self.mesh_y_count - 2)
+        i = (yidx * (self.mesh_x_count - 1) + xidx) * 4
+        return self.mesh_coefs[i+3] * scale
     def get_z_range(self):
         if self.mesh_matrix is not None:
             mesh_min = min([min(x) for x in self.mesh_matrix])
@@ -1449,27 +1745,28 @@ class ZMesh:
             return round(avg_z, 2)
         else:
             return 0.
-    def _get_linear_index(self, coord, axis):
-        if axis == 0:
-            # X-axis
-            mesh_min = self.mesh_x_min
-            mesh_cnt = self.mesh_x_count
-            mesh_dist = self.mesh_x_dist
-            cfunc = self.get_x_coordinate
-        else:
-            # Y-axis
-            mesh_min = self.mesh_y_min
-            mesh_cnt = self.mesh_y_count
-            mesh_dist = self.mesh_y_dist
-            cfunc = self.get_y_coordinate
-        t = 0.
-        idx = int(math.floor((coord - mesh_min) / mesh_dist))
-        idx = constrain(idx, 0, mesh_cnt - 2)
-        t = (coord - cfunc(idx)) / mesh_dist
-        return constrain(t, 0., 1.), idx
     def _sample_direct(self, z_matrix):
         self.mesh_matrix = z_matrix
+    def _sample_numpy(self, z_matrix, get_weights):
+        # The interpolated mesh is a linear combination of the probed
+        # points, so it may be built with matrix products (mesh =
+        # Wy * Z * Wx^T) when numpy is available
+        try:
+            import numpy
+        except ImportError:
+            return False
+        x_weights = numpy.array(get_weights(0))
+        y_weights = numpy.array(get_weights(1))
+        z = numpy.array(z_matrix, dtype=float)
+        self.mesh_matrix = y_weights.dot(z.dot(x_weights.T)).tolist()
+        return True
+    def _get_axis_params(self, axis):
+        if axis == 0:
+            return self.x_mult, self.mesh_x_count, self.get_x_coordinate
+        return self.y_mult, self.mesh_y_count, self.get_y_coordinate
     def _sample_lagrange(self, z_matrix):
+        if self._sample_numpy(z_matrix, self._get_lagrange_weights):
+            return
         x_mult = self.x_mult
         y_mult = self.y_mult
         self.mesh_matrix = \
@@ -1503,6 +1800,29 @@ class ZMesh:
         for j in range(self.mesh_params['y_count']):
             ypts.append(self.get_y_coordinate(j * self.y_mult))
         return xpts, ypts
+    def _get_lagrange_weights(self, axis):
+        # Weight of each probed point for every mesh point along an axis
+        mult, count, get_coord = self._get_axis_params(axis)
+        lpts = self._get_lagrange_coords()[axis]
+        pt_cnt = len(lpts)
+        weights = []
+        for idx in range(count):
+            w = [0.] * pt_cnt
+            if idx % mult == 0:
+                w[idx // mult] = 1.
+            else:
+                c = get_coord(idx)
+                for i in range(pt_cnt):
+                    n = 1.
+                    d = 1.
+                    for j in range(pt_cnt):
+                        if j == i:
+                            continue
+                        n *= (c - lpts[j])
+                        d *= (lpts[i] - lpts[j])
+                    w[i] = n / d
+            weights.append(w)
+        return weights
     def _calc_lagrange(self, lpts, c, vec, axis=0):
         pt_cnt = len(lpts)
         total = 0.
@@ -1524,6 +1844,8 @@ class ZMesh:
         return total
     def _sample_bicubic(self, z_matrix):
         # should work for any number of probe points above 3x3
+        if self._sample_numpy(z_matrix, self._get_bicubic_weights):
+            return
         x_mult = self.x_mult
         y_mult = self.y_mult
         c = self.mesh_params['tension']
@@ -1548,6 +1870,40 @@ class ZMesh:
                     continue
                 pts = self._get_y_ctl_pts(x, y)
                 self.mesh_matrix[y][x] = self._cardinal_spline(pts, c)
+    def _get_bicubic_weights(self, axis):
+        # Weight of each probed point for every mesh point along an axis
+        # (see _get_x_ctl_pts() and _cardinal_spline())
+        mult, count = self._get_axis_params(axis)[:2]
+        tension = self.mesh_params['tension']
+        pt_cnt = (count - 1) // mult + 1
+        last_pt = count - 1 - mult
+        weights = []
+        for idx in range(count):
+            w = [0.] * pt_cnt
+            weights.append(w)
+            if idx % mult == 0:
+                w[idx // mult] = 1.
+                continue
+            if idx < mult:
+                p0, p1, p2, p3 = 0, 0, 1, 2
+                t = idx / float(mult)
+            elif idx > last_pt:
+                i = last_pt // mult
+                p0, p1, p2, p3 = i - 1, i, i + 1, i + 1
+                t = (idx - last_pt) / float(mult)
+            else:
+                i = idx // mult
+                p0, p1, p2, p3 = i - 1, i, i + 1, i + 2
+                t = (idx - i * mult) / float(mult)
+            t2 = t*t
+            t3 = t2*t
+            m1 = tension * (t3 - 2*t2 + t)
+            m2 = tension * (t3 - t2)
+            w[p0] -= m1
+            w[p1] += 2*t3 - 3*t2 + 1 - m2
+            w[p2] += -2*t3 + 3*t2 + m1
+            w[p3] += m2
+        return weights
     def _get_x_ctl_pts(self, x, y):
         # Fetch control points and t for a X value in the mesh
         x_mult = self.x_mult
@@ -1629,6 +1985,8 @@ class ProfileManager:
         self.bedmesh = bedmesh
         self.profiles = {}
         self.incompatible_profiles = []
+        # Recently built meshes (keyed by probed points and parameters)
+        self.mesh_cache = collections.OrderedDict()
         # Fetch stored profiles from Config
         stored_profs = config.get_prefix_sections(self.name)
         stored_profs = [s for s in stored_profs
@@ -1714,11 +2072,20 @@ class ProfileManager:
                 "bed_mesh: Unknown profile [%s]" % prof_name)
         probed_matrix = profile['points']
         mesh_params = profile['mesh_params']
+        cache_key = (tuple([tuple(line) for line in probed_matrix]),
+                     tuple(mesh_params.items()))
+        built_mesh = self.mesh_cache.pop(cache_key, None)
+        if built_mesh is None:
+            built_mesh = ZMesh(mesh_params, prof_name)
+            try:
+                built_mesh.build_mesh(probed_matrix)
+            except BedMeshError as e:
+                raise self.gcode.error(str(e))
+        self.mesh_cache[cache_key] = built_mesh
+        while len(self.mesh_cache) > PROFILE_CACHE_SIZE:
+            self.mesh_cache.popitem(last=False)
         z_mesh = ZMesh(mesh_params, prof_name)
-        try:
-            z_mesh.build_mesh(probed_matrix)
-        except BedMeshError as e:
-            raise self.gcode.error(str(e))
+        z_mesh.copy_mesh(built_mesh)
         self.bedmesh.set_mesh(z_mesh)
     def remove_profile(self, prof_name):
         if prof_name in self.profiles:
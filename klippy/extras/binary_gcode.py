@@ -0,0 +1,212 @@
+# Pre-parsed binary representation of g-code files
+#
+# Copyright (C) 2026  agent <agent@local>
+#
+# This file may be distributed under the terms of the GNU GPLv3 license.
+import os, struct, bisect
+
+# The binary file contains a header, a series of records (one per line
+# in the source g-code file), an index of record offsets, and a
+# footer.  Simple G0-G3 moves are stored with a mask of their
+# parameter letters and the parameter values (as the original text,
+# so commands see the same parameters as when run from the g-code
+# file) along with the command text, other commands are stored as
+# text, and blank/comment lines are stored with no content.  Every
+# record holds the length of the source line so that the source file
+# position can be tracked during a print.
+
+BINARY_MAGIC = b'KGCB'
+BINARY_VERSION = 2
+INDEX_INTERVAL = 1024
+READ_SIZE = 8192
+MAX_COMMANDS = 1024
+
+# Record opcodes (OP_MOVE+N is used for command GN)
+OP_SKIP, OP_LINE, OP_MOVE = 0, 1, 2
+
+HEADER = struct.Struct('<4sIqd')
+FOOTER = struct.Struct('<qI4s')
+REC_HEADER = struct.Struct('<BII')
+REC_MOVE = struct.Struct('<II')
+INDEX_ENTRY = struct.Struct('<qq')
+
+LETTERS = "ABCDEFGHIJKLMNOPQRSTUVWXYZ"
+MOVE_COMMANDS = ["G0", "G1", "G2", "G3"]
+
+def get_source_id(filename):
+    st = os.stat(filename)
+    return st.st_size, st.st_mtime
+
+# Convert a g-code text file to the binary format
+def convert_file(src_filename, dst_filename, move_r):
+    src_size, src_mtime = get_source_id(src_filename)
+    index = []
+    src_pos = record_count = 0
+    tmp_filename = "%s.%d.tmp" % (dst_filename, os.getpid())
+    f = open(src_filename, 'rb')
+    out = open(tmp_filename, 'wb')
+    out.write(HEADER.pack(BINARY_MAGIC, BINARY_VERSION, src_size, src_mtime))
+    partial_input = b""
+    while 1:
+        data = f.read(READ_SIZE)
+        if not data:
+            break
+        lines = data.split(b'\n')
+        lines[0] = partial_input + lines[0]
+        partial_input = lines.pop()
+        for rawline in lines:
+            if not record_count % INDEX_INTERVAL:
+                index.append((src_pos, out.tell()))
+            record_count += 1
+            srclen = len(rawline) + 1
+            src_pos += srclen
+            origline = line = rawline.decode().strip()
+            cpos = line.find(';')
+            if cpos >= 0:
+                line = line[:cpos].strip()
+            if not line:
+                out.write(REC_HEADER.pack(OP_SKIP, srclen, 0))
+                continue
+            if move_r.match(line) is not None:
+                parts = line.split()
+                params = { p[0]: p[1:] for p in parts[1:] }
+                if 'G' not in params and len(params) == len(parts) - 1:
+                    letters = sorted(params)
+                    mask = 0
+                    for letter in letters:
+                        mask |= 1 << LETTERS.index(letter)
+                    values = " ".join([params[l] for l in letters]).encode()
+                    text = origline.encode()
+                    out.write(REC_HEADER.pack(OP_MOVE + int(parts[0][1:]),
+                                              srclen, len(text)))
+                    out.write(REC_MOVE.pack(mask, len(values)))
+                    out.write(values)
+                    out.write(text)
+                    continue
+            text = origline.encode()
+            out.write(REC_HEADER.pack(OP_LINE, srclen, len(text)))
+            out.write(text)
+    f.close()
+    index_pos = out.tell()
+    for entry in index:
+        out.write(INDEX_ENTRY.pack(*entry))
+    out.write(FOOTER.pack(index_pos, len(index), BINARY_MAGIC))
+    out.close()
+    os.rename(tmp_filename, dst_filename)
+
+# Read commands from a binary g-code file
+class BinaryGCodeReader:
+    error = IOError
+    def __init__(self, filename):
+        self.file = open(filename, 'rb')
+        try:
+            self._read_header()
+        except:
+            self.file.close()
+            raise
+        self.buffer = b""
+        self.buffer_pos = 0
+        self.mask_info = {}
+    def _read_header(self):
+        f = self.file
+        data = f.read(HEADER.size)
+        if len(data) != HEADER.size:
+            raise self.error("Truncated binary g-code file")
+        magic, version, src_size, src_mtime = HEADER.unpack(data)
+        if magic != BINARY_MAGIC or version != BINARY_VERSION:
+            raise self.error("Unknown binary g-code file format")
+        self.source_id = (src_size, src_mtime)
+        f.seek(-FOOTER.size, os.SEEK_END)
+        index_pos, index_count, magic = FOOTER.unpack(f.read(FOOTER.size))
+        if magic != BINARY_MAGIC:
+            raise self.error("Truncated binary g-code file")
+        f.seek(index_pos)
+        data = f.read(index_count * INDEX_ENTRY.size)
+        index = [INDEX_ENTRY.unpack_from(data, i * INDEX_ENTRY.size)
+                 for i in range(index_count)]
+        self.index_src = [e[0] for e in index]
+        self.index_rec = [e[1] for e in index]
+        self.records_end = index_pos
+        f.seek(HEADER.size)
+    def close(self):
+        self.file.close()
+    def get_source_id(self):
+        return self.source_id
+    def _get_mask_info(self, mask):
+        letters = self.mask_info.get(mask)
+        if letters is None:
+            letters = [l for i, l in enumerate(LETTERS) if mask & (1 << i)]
+            self.mask_info[mask] = letters
+        return letters
+    def _fill_buffer(self):
+        f = self.file
+        remaining = self.records_end - f.tell()
+        data = f.read(min(READ_SIZE, remaining))
+        self.buffer = self.buffer[self.buffer_pos:] + data
+        self.buffer_pos = 0
+        return len(data)
+    def _parse_records(self, out, max_count):
+        # Decode complete records in the buffer (up to max_count)
+        buf = self.buffer
+        buflen = len(buf)
+        pos = self.buffer_pos
+        hdr_unpack, hdr_size = REC_HEADER.unpack_from, REC_HEADER.size
+        mask_unpack, mask_size = REC_MOVE.unpack_from, REC_MOVE.size
+        mask_info = self.mask_info
+        while len(out) < max_count and pos + hdr_size <= buflen:
+            op, srclen, textlen = hdr_unpack(buf, pos)
+            rpos = pos + hdr_size
+            if op < OP_MOVE:
+                endpos = rpos + textlen
+                if endpos > buflen:
+                    break
+                out.append((srclen, buf[rpos:endpos].decode()))
+                pos = endpos
+                continue
+            if op >= OP_MOVE + len(MOVE_COMMANDS):
+                raise self.error("Invalid binary g-code record")
+            if rpos + mask_size > buflen:
+                break
+            mask, valueslen = mask_unpack(buf, rpos)
+            rpos += mask_size
+            letters = mask_info.get(mask)
+            if letters is None:
+                letters = self._get_mask_info(mask)
+            textpos = rpos + valueslen
+            endpos = textpos + textlen
+            if endpos > buflen:
+                break
+            cmd = MOVE_COMMANDS[op - OP_MOVE]
+            params = dict(zip(letters, buf[rpos:textpos].decode().split()))
+            params['G'] = cmd[1:]
+            line = buf[textpos:endpos].decode()
+            out.append((srclen, (cmd, line, params)))
+            pos = endpos
+        self.buffer_pos = pos
+    def read_commands(self, max_count=MAX_COMMANDS):
+        # Return a list of (srclen, command) pairs - empty list on EOF.
+        # The command is either a line of text or a (cmd, commandline,
+        # params) tuple.
+        out = []
+        while 1:
+            self._parse_records(out, max_count)
+            if out or not self._fill_buffer():
+                return out
+    def seek(self, src_pos):
+        # Position reader at the record starting at src_pos (if possible)
+        i = bisect.bisect_right(self.index_src, src_pos) - 1
+        if i < 0:
+            return False
+        self.file.seek(self.index_rec[i])
+        self.buffer = b""
+        self.buffer_pos = 0
+        pos = self.index_src[i]
+        while pos < src_pos:
+            out = []
+            self._parse_records(out, 1)
+            if not out:
+                if not self._fill_buffer():
+                    return False
+                continue
+            pos += out[0][0]
+        return pos == src_pos
@@ -119,10 +119,10 @@ class BulkDataQueue:
         self.lock = threading.Lock()
         self.raw_samples = []
         # Register callback with mcu
-        mcu.register_response(self._handle_data, msg_name, oid)
-    def _handle_data(self, params):
+        mcu.register_batch_response(self._handle_data, msg_name, oid)
+    def _handle_data(self, batch):
         with self.lock:
-            self.raw_samples.append(params)
+            self.raw_samples.extend(batch)
     def pull_queue(self):
         with self.lock:
             raw_samples = self.raw_samples
@@ -0,0 +1,327 @@
+# Index of layer and object locations in a g-code file
+#
+# Copyright (C) 2026  agent <agent@local>
+#
+# This file may be distributed under the terms of the GNU GPLv3 license.
+import os, re, math, json, bisect
+
+# The index is stored as a json file next to the g-code file.  It
+# contains the file position of each layer start and each
+# EXCLUDE_OBJECT_START command along with an estimate of the
+# cumulative print time at regular intervals of the file.
+
+INDEX_VERSION = 3
+BLOCK_SIZE = 65536
+READ_SIZE = 65536
+DEFAULT_SPEED = 25.
+# Number of queued moves whose timing may still change
+LOOKAHEAD_MOVES = 32
+
+def get_index_filename(filename):
+    dirname, basename = os.path.split(filename)
+    return os.path.join(dirname, "." + basename + ".index")
+
+def get_source_id(filename):
+    st = os.stat(filename)
+    return st.st_size, st.st_mtime
+
+args_r = re.compile('([A-Z_]+|[A-Z*/])')
+object_name_r = re.compile(r'\sNAME=("[^"]*"|\S+)', re.IGNORECASE)
+
+# Simple g-code interpreter used to estimate print time.  Moves are
+# timed with a simplified version of the toolhead lookahead - speed is
+# carried across junctions (limited by the junction deviation of the
+# direction change) and moves only stop at reversals, extrude only
+# moves, dwells, and the end of the file.
+class IndexBuilder:
+    def __init__(self, max_velocity, max_accel, square_corner_velocity=5.):
+        self.max_velocity = max_velocity
+        self.max_accel = max_accel
+        scv2 = square_corner_velocity**2
+        self.junction_deviation = scv2 * (math.sqrt(2.) - 1.) / max_accel
+        self.absolute_coord = self.absolute_extrude = True
+        self.position = [0., 0., 0., 0.]
+        self.speed = DEFAULT_SPEED
+        self.arc_plane = (0, 1, 'I', 'J')
+        self.print_time = 0.
+        # Moves whose timing is not yet known ([dist, cruise_v2,
+        # max_start_v2] for each move) and the records that need the
+        # print time at the end of one of those moves
+        self.move_queue = []
+        self.pending_times = []
+        self.last_end_v2 = 0.
+        self.prev_move = None
+        self.layer_z = None
+        self.pending_z_pos = 0
+        self.layers = []
+        self.objects = {}
+        self.blocks = []
+        self.next_block = 0
+    def _note_time(self, record, key):
+        # Store the print time (once known) of the current file position
+        if not self.move_queue:
+            record[key] = self.print_time
+        else:
+            self.pending_times.append([len(self.move_queue), record, key])
+    def _queue_move(self, dist, speed, start_r, end_r):
+        accel = self.max_accel
+        cruise_v2 = min(speed, self.max_velocity)**2
+        max_start_v2 = 0.
+        prev_move = self.prev_move
+        if prev_move is not None and prev_move[2] is not None and start_r:
+            # Find max junction velocity (as done by the toolhead)
+            prev_dist, prev_cruise_v2, prev_r = prev_move
+            cos_theta = -(start_r[0] * prev_r[0] + start_r[1] * prev_r[1]
+                          + start_r[2] * prev_r[2])
+            if cos_theta <= 0.999999:
+                cos_theta = max(cos_theta, -0.999999)
+                sin_theta_d2 = math.sqrt(0.5 * (1. - cos_theta))
+                R_jd = sin_theta_d2 / (1. - sin_theta_d2)
+                tan_theta_d2 = sin_theta_d2 / math.sqrt(0.5 * (1. + cos_theta))
+                max_start_v2 = min(
+                    R_jd * self.junction_deviation * accel,
+                    .5 * dist * tan_theta_d2 * accel,
+                    .5 * prev_dist * tan_theta_d2 * accel,
+                    cruise_v2, prev_cruise_v2)
+        self.prev_move = (dist, cruise_v2, end_r)
+        self.move_queue.append((dist, cruise_v2, max_start_v2))
+        if len(self.move_queue) >= 2 * LOOKAHEAD_MOVES:
+            self._flush_moves(LOOKAHEAD_MOVES)
+    def _flush_moves(self, count):
+        # Time the first 'count' queued moves (assuming the last queued
+        # move ends at rest)
+        accel = self.max_accel
+        queue = self.move_queue
+        start_v2 = [0.] * (len(queue) + 1)
+        for i in range(len(queue) - 1, -1, -1):
+            dist, cruise_v2, max_start_v2 = queue[i]
+            start_v2[i] = min(max_start_v2, start_v2[i+1] + 2.*accel*dist)
+        times = [self.print_time]
+        v2 = self.last_end_v2
+        for i in range(count):
+            dist, cruise_v2, max_start_v2 = queue[i]
+            s_v2 = min(v2, start_v2[i])
+            e_v2 = min(start_v2[i+1], s_v2 + 2. * accel * dist)
+            peak_v2 = min(cruise_v2, .5 * (s_v2 + e_v2) + accel * dist)
+            peak_v = math.sqrt(peak_v2)
+            cruise_d = dist - (2. * peak_v2 - s_v2 - e_v2) / (2. * accel)
+            move_t = ((2. * peak_v - math.sqrt(s_v2) - math.sqrt(e_v2))
+                      / accel + max(cruise_d, 0.) / peak_v)
+            times.append(times[-1] + move_t)
+            v2 = e_v2
+        self.print_time = times[-1]
+        self.last_end_v2 = v2
+        del queue[:count]
+        pending_times = []
+        for pt in self.pending_times:
+            if pt[0] <= count:
+                pt[1][pt[2]] = times[pt[0]]
+            else:
+                pt[0] -= count
+                pending_times.append(pt)
+        self.pending_times = pending_times
+    def _flush_all_moves(self):
+        self._flush_moves(len(self.move_queue))
+        self.last_end_v2 = 0.
+        self.prev_move = None
+    def _arc_move(self, newpos, params, clockwise):
+        # Approximate length of a G2/G3 arc (a helix if the third axis
+        # also moves) along with its start and end directions - arcs
+        # specified with R are treated as lines
+        a0, a1, p0, p1 = self.arc_plane
+        if p0 not in params and p1 not in params:
+            return None
+        c0 = self.position[a0] + float(params.get(p0, 0.))
+        c1 = self.position[a1] + float(params.get(p1, 0.))
+        radius = math.hypot(self.position[a0] - c0, self.position[a1] - c1)
+        start = math.atan2(self.position[a1] - c1, self.position[a0] - c0)
+        end = math.atan2(newpos[a1] - c1, newpos[a0] - c0)
+        angle = start - end if clockwise else end - start
+        if angle <= 0.:
+            angle += 2. * math.pi
+        a2 = 3 - a0 - a1
+        axial_d = newpos[a2] - self.position[a2]
+        dist = math.hypot(radius * angle, axial_d)
+        if not dist:
+            return None
+        plane_r = radius * angle / dist
+        sign = -1. if clockwise else 1.
+        dirs = []
+        for theta in (start, end):
+            r = [0., 0., 0.]
+            r[a0] = -sign * math.sin(theta) * plane_r
+            r[a1] = sign * math.cos(theta) * plane_r
+            r[a2] = axial_d / dist
+            dirs.append(r)
+        return dist, dirs[0], dirs[1]
+    def _process_move(self, pos, cmd, params):
+        newpos = list(self.position)
+        for i, axis in enumerate('XYZE'):
+            if axis not in params:
+                continue
+            v = float(params[axis])
+            if axis == 'E':
+                absolute = self.absolute_coord and self.absolute_extrude
+            else:
+                absolute = self.absolute_coord
+            if absolute:
+                newpos[i] = v
+            else:
+                newpos[i] += v
+        if 'F' in params:
+            speed = float(params['F']) / 60.
+            if speed > 0.:
+                self.speed = speed
+        axes_d = [n - o for n, o in zip(newpos, self.position)]
+        move = None
+        if cmd in ('G2', 'G3'):
+            move = self._arc_move(newpos, params, cmd == 'G2')
+        if move is None:
+            dist = math.sqrt(axes_d[0]**2 + axes_d[1]**2 + axes_d[2]**2)
+            if dist:
+                axes_r = [d / dist for d in axes_d[:3]]
+                move = (dist, axes_r, axes_r)
+            elif axes_d[3]:
+                # Extrude only moves start and end at rest
+                move = (abs(axes_d[3]), None, None)
+        if move is not None:
+            self._queue_move(move[0], self.speed, move[1], move[2])
+        if axes_d[2]:
+            self.pending_z_pos = pos
+        if (axes_d[3] > 0. and (axes_d[0] or axes_d[1])
+            and (self.layer_z is None or newpos[2] > self.layer_z + 0.000001)):
+            # First extrusion at a new height - note start of layer
+            self.layer_z = newpos[2]
+            layer = {'position': self.pending_z_pos, 'z': newpos[2],
+                     'time': self.print_time}
+            self.layers.append(layer)
+            self._note_time(layer, 'time')
+        self.position = newpos
+    def process_line(self, pos, line):
+        while pos >= self.next_block:
+            block = [self.next_block, self.print_time]
+            self.blocks.append(block)
+            self._note_time(block, 1)
+            self.next_block += BLOCK_SIZE
+        cpos = line.find(';')
+        if cpos >= 0:
+            line = line[:cpos]
+        uline = line.upper()
+        parts = args_r.split(uline)
+        if len(parts) < 3:
+            return
+        cmd = parts[1] + parts[2].strip()
+        params = { parts[i]: parts[i+1].strip()
+                   for i in range(1, len(parts) - 1, 2) }
+        try:
+            if cmd in ('G0', 'G1', 'G2', 'G3'):
+                self._process_move(pos, cmd, params)
+            elif cmd == 'G17':
+                self.arc_plane = (0, 1, 'I', 'J')
+            elif cmd == 'G18':
+                self.arc_plane = (0, 2, 'I', 'K')
+            elif cmd == 'G19':
+                self.arc_plane = (1, 2, 'J', 'K')
+            elif cmd == 'G90':
+                self.absolute_coord = True
+            elif cmd == 'G91':
+                self.absolute_coord = False
+            elif cmd == 'M82':
+                self.absolute_extrude = True
+            elif cmd == 'M83':
+                self.absolute_extrude = False
+            elif cmd == 'G92':
+                offsets = [params.get(a) for a in 'XYZE']
+                if offsets == [None, None, None, None]:
+                    offsets = [0., 0., 0., 0.]
+                for i, offset in enumerate(offsets):
+                    if offset is not None:
+                        self.position[i] = float(offset)
+            elif cmd == 'G4':
+                dwell = float(params.get('P', 0.)) / 1000.
+                self._flush_all_moves()
+                self.print_time += dwell
+        except ValueError:
+            pass
+        if cmd == 'EXCLUDE_OBJECT_START':
+            m = object_name_r.search(line)
+            if m is not None:
+                name = m.group(1).strip('"').upper()
+                self.objects.setdefault(name, []).append(pos)
+    def get_index(self, source_id):
+        self._flush_all_moves()
+        return {'version': INDEX_VERSION,
+                'source_size': source_id[0], 'source_mtime': source_id[1],
+                'estimated_time': self.print_time, 'layers': self.layers,
+                'objects': self.objects, 'blocks': self.blocks}
+
+# Build an index file for the given g-code file
+def build_index(src_filename, max_velocity, max_accel,
+                square_corner_velocity=5.):
+    source_id = get_source_id(src_filename)
+    builder = IndexBuilder(max_velocity, max_accel, square_corner_velocity)
+    f = open(src_filename, 'rb')
+    pos = 0
+    partial_input = b""
+    while 1:
+        data = f.read(READ_SIZE)
+        if not data:
+            break
+        lines = data.split(b'\n')
+        lines[0] = partial_input + lines[0]
+        partial_input = lines.pop()
+        for line in lines:
+            builder.process_line(pos, line.decode('utf-8', 'replace'))
+            pos += len(line) + 1
+    f.close()
+    dst_filename = get_index_filename(src_filename)
+    tmp_filename = "%s.%d.tmp" % (dst_filename, os.getpid())
+    f = open(tmp_filename, 'w')
+    json.dump(builder.get_index(source_id), f)
+    f.close()
+    os.rename(tmp_filename, dst_filename)
+
+# Access to the contents of an index file
+class GCodeIndex:
+    def __init__(self, data):
+        self.data = data
+        self.layer_positions = [l['position'] for l in data['layers']]
+        self.block_positions = [b[0] for b in data['blocks']]
+    def get_data(self):
+        return self.data
+    def get_layer_count(self):
+        return len(self.layer_positions)
+    def get_layer(self, pos):
+        return bisect.bisect_right(self.layer_positions, pos)
+    def get_estimated_time(self):
+        return self.data['estimated_time']
+    def get_time(self, pos):
+        # Interpolate the estimated print time at the given file position
+        blocks = self.data['blocks']
+        i = bisect.bisect_right(self.block_positions, pos) - 1
+        if i < 0:
+            return 0.
+        block_pos, block_time = blocks[i]
+        if i + 1 < len(blocks):
+            next_pos, next_time = blocks[i+1]
+        else:
+            next_pos = self.data['source_size']
+            next_time = self.data['estimated_time']
+        if next_pos <= block_pos:
+            return block_time
+        return block_time + ((next_time - block_time)
+                             * float(pos - block_pos) / (next_pos - block_pos))
+
+# Load the index for a g-code file (returns None if missing or stale)
+def load_index(src_filename):
+    try:
+        source_id = get_source_id(src_filename)
+        f = open(get_index_filename(src_filename), 'r')
+        data = json.load(f)
+        f.close()
+    except (IOError, OSError, ValueError):
+        return None
+    if (data.get('version') != INDEX_VERSION
+        or (data.get('source_size'), data.get('source_mtime')) != source_id):
+        return None
+    return GCodeIndex(data)
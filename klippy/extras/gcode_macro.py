@@ -11,22 +11,72 @@ import jinja2
 # Template handling
 ######################################################################
 
+# Read-only containers for status information shared between templates
+def _raise_read_only(*args, **kwargs):
+    raise TypeError("printer status information is read-only")
+
+class ReadOnlyDict(dict):
+    __setitem__ = __delitem__ = __ior__ = _raise_read_only
+    clear = pop = popitem = setdefault = update = _raise_read_only
+    def __copy__(self):
+        return dict(self)
+    def __deepcopy__(self, memo):
+        return {copy.deepcopy(k, memo): copy.deepcopy(v, memo)
+                for k, v in self.items()}
+
+class ReadOnlyList(list):
+    __setitem__ = __delitem__ = __iadd__ = __imul__ = _raise_read_only
+    append = extend = insert = pop = remove = _raise_read_only
+    reverse = sort = clear = _raise_read_only
+    def __copy__(self):
+        return list(self)
+    def __deepcopy__(self, memo):
+        return [copy.deepcopy(v, memo) for v in self]
+
+def make_read_only(obj):
+    if isinstance(obj, dict):
+        return ReadOnlyDict([(k, make_read_only(v)) for k, v in obj.items()])
+    if isinstance(obj, list):
+        return ReadOnlyList([make_read_only(v) for v in obj])
+    if type(obj) is tuple:
+        return tuple([make_read_only(v) for v in obj])
+    if isinstance(obj, (str, int, float, type(None))):
+        return obj
+    return copy.deepcopy(obj)
+
+# Cached get_status() results for all objects at a given eventtime.  The
+# results are shared by all templates rendered at that time, so they
+# are stored in read-only containers.
+class StatusSnapshot:
+    def __init__(self, printer, eventtime):
+        self.printer = printer
+        self.eventtime = eventtime
+        self.cache = {}
+    def get(self, name):
+        res = self.cache.get(name)
+        if res is not None:
+            return res
+        po = self.printer.lookup_object(name, None)
+        if po is None or not hasattr(po, 'get_status'):
+            return None
+        self.cache[name] = res = make_read_only(po.get_status(self.eventtime))
+        return res
+
 # Wrapper for access to printer object get_status() methods
 class GetStatusWrapper:
     def __init__(self, printer, eventtime=None):
         self.printer = printer
         self.eventtime = eventtime
-        self.cache = {}
+        self.snapshot = None
     def __getitem__(self, val):
-        sval = str(val).strip()
-        if sval in self.cache:
-            return self.cache[sval]
-        po = self.printer.lookup_object(sval, None)
-        if po is None or not hasattr(po, 'get_status'):
+        snapshot = self.snapshot
+        if snapshot is None:
+            gcode_macro = self.printer.lookup_object('gcode_macro')
+            self.snapshot = snapshot = gcode_macro.get_status_snapshot(
+                self.eventtime)
+        res = snapshot.get(str(val).strip())
+        if res is None:
             raise KeyError(val)
-        if self.eventtime is None:
-            self.eventtime = self.printer.get_reactor().monotonic()
-        self.cache[sval] = res = copy.deepcopy(po.get_status(self.eventtime))
         return res
     def __contains__(self, val):
         try:
@@ -48,7 +98,7 @@ class TemplateWrapper:
         gcode_macro = self.printer.lookup_object('gcode_macro')
         self.create_template_context = gcode_macro.create_template_context
         try:
-            self.template = env.from_string(script)
+            self.template = gcode_macro.compile_template(script)
         except Exception as e:
             msg = "Error loading template '%s': %s" % (
                  name, traceback.format_exception_only(type(e), e)[-1])
@@ -67,11 +117,33 @@ class TemplateWrapper:
     def run_gcode_from_command(self, context=None):
         self.gcode.run_script_from_command(self.render(context))
 
+# Compiled template code (retained across a RESTART)
+template_code_cache = {}
+
 # Main gcode macro template tracking
 class PrinterGCodeMacro:
     def __init__(self, config):
         self.printer = config.get_printer()
         self.env = jinja2.Environment('{%', '%}', '{', '}')
+        # Only retain compiled code for templates still in use
+        self.prev_code_cache = dict(template_code_cache)
+        template_code_cache.clear()
+        self.status_snapshot = None
+        self.template_actions = {
+            'action_emergency_stop': self._action_emergency_stop,
+            'action_respond_info': self._action_respond_info,
+            'action_raise_error': self._action_raise_error,
+            'action_call_remote_method': self._action_call_remote_method,
+        }
+    def compile_template(self, script):
+        env = self.env
+        code = template_code_cache.get(script)
+        if code is None:
+            code = self.prev_code_cache.get(script)
+            if code is None:
+                code = env.compile(script)
+            template_code_cache[script] = code
+        return env.template_class.from_code(env, code, env.make_globals(None))
     def load_template(self, config, option, default=None):
         name = "%s:%s" % (config.get_name(), option)
         if default is None:
@@ -94,14 +166,18 @@ class PrinterGCodeMacro:
         except self.printer.command_error:
             logging.exception("Remote Call Error")
         return ""
+    def get_status_snapshot(self, eventtime=None):
+        if eventtime is None:
+            eventtime = self.printer.get_reactor().monotonic()
+        snapshot = self.status_snapshot
+        if snapshot is None or snapshot.eventtime != eventtime:
+            self.status_snapshot = snapshot = StatusSnapshot(self.printer,
+                                                             eventtime)
+        return snapshot
     def create_template_context(self, eventtime=None):
-        return {
-            'printer': GetStatusWrapper(self.printer, eventtime),
-            'action_emergency_stop': self._action_emergency_stop,
-            'action_respond_info': self._action_respond_info,
-            'action_raise_error': self._action_raise_error,
-            'action_call_remote_method': self._action_call_remote_method,
-        }
+        context = dict(self.template_actions)
+        context['printer'] = GetStatusWrapper(self.printer, eventtime)
+        return context
 
 def load_config(config):
     return PrinterGCodeMacro(config)
@@ -186,7 +262,21 @@ class GCodeMacro:
         kwparams['rawparams'] = gcmd.get_raw_command_parameters()
         self.in_script = True
         try:
-            self.template.run_gcode_from_command(kwparams)
+            profiler = self.gcode.get_profiler()
+            if profiler is None:
+                self.template.run_gcode_from_command(kwparams)
+                return
+            # Track template render and script execution time separately
+            reactor = self.printer.get_reactor()
+            starttime = reactor.monotonic()
+            script = self.template.render(kwparams)
+            rendertime = reactor.monotonic()
+            profiler.record(self.alias + ":render", starttime, rendertime)
+            try:
+                self.gcode.run_script_from_command(script)
+            finally:
+                profiler.record(self.alias + ":execute", rendertime,
+                                reactor.monotonic())
         finally:
             self.in_script = False
 
@@ -3,7 +3,8 @@
 # Copyright (C) 2018-2024  Kevin O'Connor <kevin@koconnor.net>
 #
 # This file may be distributed under the terms of the GNU GPLv3 license.
-import os, sys, logging, io
+import os, sys, logging, io, multiprocessing, threading, queue
+from . import binary_gcode, gcode_index
 
 VALID_GCODE_EXTS = ['gcode', 'g', 'gco']
 
@@ -13,6 +14,82 @@ DEFAULT_ERROR_GCODE = """
 {% endif %}
 """
 
+READ_AHEAD_SIZE = 8192
+READ_AHEAD_CHUNKS = 32
+INDEX_CHECK_TIME = 1.
+
+# Helper to read and split file lines in a background thread
+class ReadAheadReader:
+    error = IOError
+    def __init__(self, reactor, filename):
+        self.reactor = reactor
+        self.filename = filename
+        self.lock = threading.Lock()
+        self.completion = None
+        self.queue = self.stop_event = None
+    def _bg_thread(self, pos, bg_queue, stop_event):
+        result = []
+        try:
+            f = open(self.filename, 'rb')
+            f.seek(pos)
+            partial_input = b""
+            while not stop_event.is_set():
+                data = f.read(READ_AHEAD_SIZE)
+                if not data:
+                    break
+                lines = data.split(b'\n')
+                lines[0] = partial_input + lines[0]
+                partial_input = lines.pop()
+                if lines:
+                    self._put(bg_queue, stop_event,
+                              [(len(l) + 1, l.decode()) for l in lines])
+            f.close()
+        except:
+            logging.exception("virtual_sdcard read ahead")
+            result = None
+        self._put(bg_queue, stop_event, result)
+    def _put(self, bg_queue, stop_event, data):
+        while not stop_event.is_set():
+            try:
+                bg_queue.put(data, timeout=0.100)
+                break
+            except queue.Full:
+                pass
+        # Wake up the reactor if it is waiting for data
+        with self.lock:
+            completion = self.completion
+            self.completion = None
+        if completion is not None:
+            self.reactor.async_complete(completion, None)
+    def seek(self, pos):
+        self.close()
+        self.queue = queue.Queue(READ_AHEAD_CHUNKS)
+        self.stop_event = threading.Event()
+        bg_thread = threading.Thread(target=self._bg_thread, args=(
+            pos, self.queue, self.stop_event))
+        bg_thread.daemon = True
+        bg_thread.start()
+        return True
+    def read_commands(self):
+        # Return a list of (srclen, line) pairs - empty list on EOF
+        while 1:
+            with self.lock:
+                try:
+                    data = self.queue.get_nowait()
+                    completion = None
+                except queue.Empty:
+                    completion = self.completion = self.reactor.completion()
+            if completion is None:
+                break
+            completion.wait()
+        if data is None:
+            raise self.error("Error reading file")
+        return data
+    def close(self):
+        if self.stop_event is not None:
+            self.stop_event.set()
+            self.queue = self.stop_event = None
+
 class VirtualSD:
     def __init__(self, config):
         self.printer = config.get_printer()
@@ -23,6 +100,17 @@ class VirtualSD:
         self.sdcard_dirname = os.path.normpath(os.path.expanduser(sd))
         self.current_file = None
         self.file_position = self.file_size = 0
+        self.read_ahead = config.getboolean('read_ahead', False)
+        # Optional cache of pre-parsed files
+        self.preparse = config.getboolean('preparse', False)
+        self.preparse_dirname = os.path.join(self.sdcard_dirname,
+                                             '.preparsed')
+        self.preparse_procs = {}
+        # Optional index of layer and object locations
+        self.file_index = config.getboolean('file_index', False)
+        self.current_index = self.index_proc = self.index_timer = None
+        self.index_filename = None
+        self.index_status = self.index_status_pos = None
         # Print Stat Tracking
         self.print_stats = self.printer.load_object(config, 'print_stats')
         # Work timer
@@ -30,6 +118,8 @@ class VirtualSD:
         self.must_pause_work = self.cmd_from_sd = False
         self.next_file_position = 0
         self.work_timer = None
+        self.batch_lines = config.getint('batch_lines', 1, minval=1)
+        self.batch_time = config.getfloat('batch_time', 0.050, above=0.)
         # Error handling
         gcode_macro = self.printer.load_object(config, 'gcode_macro')
         self.on_error_gcode = gcode_macro.load_template(
@@ -46,6 +136,9 @@ class VirtualSD:
         self.gcode.register_command(
             "SDCARD_PRINT_FILE", self.cmd_SDCARD_PRINT_FILE,
             desc=self.cmd_SDCARD_PRINT_FILE_help)
+        webhooks = self.printer.lookup_object('webhooks')
+        webhooks.register_endpoint("virtual_sdcard/file_index",
+                                   self._handle_file_index)
     def handle_shutdown(self):
         if self.work_timer is not None:
             self.must_pause_work = True
@@ -89,13 +182,34 @@ class VirtualSD:
             except:
                 logging.exception("virtual_sdcard get_file_list")
                 raise self.gcode.error("Unable to get file list")
+    def _get_index_status(self):
+        index = self.current_index
+        if index is None:
+            return 0., 0., 0, 0
+        pos = self.file_position
+        if pos != self.index_status_pos:
+            estimated_time = index.get_estimated_time()
+            estimated_progress = 0.
+            if estimated_time:
+                estimated_progress = index.get_time(pos) / estimated_time
+            self.index_status = (estimated_time, estimated_progress,
+                                 index.get_layer(pos),
+                                 index.get_layer_count())
+            self.index_status_pos = pos
+        return self.index_status
     def get_status(self, eventtime):
+        (estimated_time, estimated_progress,
+         layer, layer_count) = self._get_index_status()
         return {
             'file_path': self.file_path(),
             'progress': self.progress(),
             'is_active': self.is_active(),
             'file_position': self.file_position,
             'file_size': self.file_size,
+            'estimated_time': estimated_time,
+            'estimated_progress': estimated_progress,
+            'current_layer': layer,
+            'layer_count': layer_count,
         }
     def file_path(self):
         if self.current_file:
@@ -135,6 +249,7 @@ class VirtualSD:
             self.current_file.close()
             self.current_file = None
         self.file_position = self.file_size = 0
+        self._reset_index()
         self.print_stats.reset()
         self.printer.send_event("virtual_sdcard:reset_file")
     cmd_SDCARD_RESET_FILE_help = "Clears a loaded SD File. Stops the print "\
@@ -196,6 +311,10 @@ class VirtualSD:
         self.file_position = 0
         self.file_size = fsize
         self.print_stats.set_current_file(filename)
+        if self.preparse:
+            self._start_preparse(fname)
+        if self.file_index:
+            self._start_index(fname)
     def cmd_M24(self, gcmd):
         # Start/resume SD print
         self.do_resume()
@@ -221,6 +340,144 @@ class VirtualSD:
         self.next_file_position = pos
     def is_cmd_from_sd(self):
         return self.cmd_from_sd
+    # Pre-parsed binary file cache
+    def _get_preparse_filename(self, fname):
+        rpath = os.path.relpath(fname, self.sdcard_dirname)
+        return os.path.join(self.preparse_dirname, rpath + '.kgcb')
+    def _open_preparsed(self, fname):
+        bname = self._get_preparse_filename(fname)
+        if not os.path.exists(bname):
+            return None
+        try:
+            reader = binary_gcode.BinaryGCodeReader(bname)
+        except:
+            logging.exception("virtual_sdcard preparsed open")
+            return None
+        try:
+            source_id = binary_gcode.get_source_id(fname)
+        except:
+            source_id = None
+        if reader.get_source_id() != source_id:
+            reader.close()
+            return None
+        return reader
+    def _start_preparse(self, fname):
+        # Reap finished conversions
+        for pname, proc in list(self.preparse_procs.items()):
+            if not proc.is_alive():
+                proc.join()
+                del self.preparse_procs[pname]
+        bname = self._get_preparse_filename(fname)
+        if bname in self.preparse_procs:
+            # Conversion of this file is already in progress
+            return
+        reader = self._open_preparsed(fname)
+        if reader is not None:
+            reader.close()
+            return
+        move_r = self.gcode.fast_move_r
+        def convert_impl():
+            bdir = os.path.dirname(bname)
+            if not os.path.isdir(bdir):
+                os.makedirs(bdir)
+            binary_gcode.convert_file(fname, bname, move_r)
+        self.preparse_procs[bname] = self._start_bg_process("preparse",
+                                                            convert_impl)
+    # File layer/object index
+    def _load_index(self, fname):
+        # Read the index file in a background thread
+        completion = self.reactor.completion()
+        def load_impl():
+            try:
+                index = gcode_index.load_index(fname)
+            except:
+                logging.exception("virtual_sdcard index load")
+                index = None
+            self.reactor.async_complete(completion, index)
+        bg_thread = threading.Thread(target=load_impl)
+        bg_thread.daemon = True
+        bg_thread.start()
+        return completion.wait()
+    def _set_index(self, index):
+        self.current_index = index
+        self.index_status = self.index_status_pos = None
+    def _reset_index(self):
+        if self.index_timer is not None:
+            self.reactor.unregister_timer(self.index_timer)
+        self.current_index = self.index_proc = self.index_timer = None
+        self.index_filename = None
+        self.index_status = self.index_status_pos = None
+    def _start_index(self, fname):
+        self.index_filename = fname
+        index = self._load_index(fname)
+        if self.index_filename != fname:
+            # File was reset while loading
+            return
+        if index is not None:
+            self._set_index(index)
+            return
+        toolhead = self.printer.lookup_object('toolhead')
+        status = toolhead.get_status(self.reactor.monotonic())
+        max_velocity = status['max_velocity']
+        max_accel = status['max_accel']
+        scv = status['square_corner_velocity']
+        self.index_proc = self._start_bg_process(
+            "index", (lambda: gcode_index.build_index(fname, max_velocity,
+                                                       max_accel, scv)))
+        self.index_timer = self.reactor.register_timer(
+            self._check_index, self.reactor.monotonic() + INDEX_CHECK_TIME)
+    def _check_index(self, eventtime):
+        # Load the index once the background process has built it
+        index_proc = self.index_proc
+        if index_proc.is_alive():
+            return eventtime + INDEX_CHECK_TIME
+        index_proc.join()
+        self.reactor.unregister_timer(self.index_timer)
+        self.index_proc = self.index_timer = None
+        fname = self.index_filename
+        index = self._load_index(fname)
+        if self.index_filename == fname and self.index_proc is None:
+            self._set_index(index)
+        return self.reactor.NEVER
+    def _handle_file_index(self, web_request):
+        filename = web_request.get_str('filename', None)
+        if filename is None:
+            index = self.current_index
+        else:
+            if filename.startswith('/'):
+                filename = filename[1:]
+            fname = os.path.normpath(os.path.join(self.sdcard_dirname,
+                                                  filename))
+            if not fname.startswith(self.sdcard_dirname + os.sep):
+                raise web_request.error("Invalid filename '%s'" % (filename,))
+            index = self._load_index(fname)
+        if index is None:
+            web_request.send({'index': None})
+            return
+        web_request.send({'index': index.get_data()})
+    def _start_bg_process(self, desc, func):
+        def bg_impl():
+            try:
+                # Try to re-nice background process
+                os.nice(20)
+            except:
+                pass
+            try:
+                func()
+            except:
+                logging.exception("virtual_sdcard %s", desc)
+        bg_proc = multiprocessing.Process(target=bg_impl)
+        bg_proc.daemon = True
+        bg_proc.start()
+        return bg_proc
+    def _seek_reader(self, reader, pos):
+        try:
+            if reader.seek(pos):
+                return reader
+        except:
+            logging.exception("virtual_sdcard reader seek")
+        reader.close()
+        return None
     # Background work timer
     def work_handler(self, eventtime):
         logging.info("Starting SD card print (position %d)", self.file_position)
@@ -231,8 +488,19 @@ class VirtualSD:
             logging.exception("virtual_sdcard seek")
             self.work_timer = None
             return self.reactor.NEVER
+        reader = None
+        if self.preparse:
+            reader = self._open_preparsed(self.current_file.name)
+            if reader is not None:
+                reader = self._seek_reader(reader, self.file_position)
+        if reader is not None:
+            logging.info("Using pre-parsed file for SD card print")
+        elif self.read_ahead:
+            reader = ReadAheadReader(self.reactor, self.current_file.name)
+            reader = self._seek_reader(reader, self.file_position)
         self.print_stats.note_start()
         gcode_mutex = self.gcode.get_mutex()
+        is_locked = False
         partial_input = ""
         lines = []
         error_message = None
@@ -240,7 +508,10 @@ class VirtualSD:
             if not lines:
                 # Read more data
                 try:
-                    data = self.current_file.read(8192)
+                    if reader is not None:
+                        data = reader.read_commands()
+                    else:
+                        data = self.current_file.read(8192)
                 except:
                     logging.exception("virtual_sdcard read")
                     break
@@ -251,28 +522,45 @@ class VirtualSD:
                     logging.info("Finished SD card print")
                     self.gcode.respond_raw("Done printing file")
                     break
-                lines = data.split('\n')
-                lines[0] = partial_input + lines[0]
-                partial_input = lines.pop()
+                if reader is not None:
+                    lines = data
+                else:
+                    lines = data.split('\n')
+                    lines[0] = partial_input + lines[0]
+                    partial_input = lines.pop()
                 lines.reverse()
                 self.reactor.pause(self.reactor.NOW)
                 continue
             # Pause if any other request is pending in the gcode class
-            if gcode_mutex.test():
-                self.reactor.pause(self.reactor.monotonic() + 0.100)
-                continue
+            if not is_locked:
+                if gcode_mutex.test():
+                    self.reactor.pause(self.reactor.monotonic() + 0.100)
+                    continue
+                # Run up to batch_lines commands with a single lock
+                gcode_mutex.lock()
+                is_locked = True
+                batch_count = 0
+                batch_endtime = self.reactor.monotonic() + self.batch_time
             # Dispatch command
             self.cmd_from_sd = True
             line = lines.pop()
-            if sys.version_info.major >= 3:
+            if reader is not None:
+                srclen, line = line
+                next_file_position = self.file_position + srclen
+            elif sys.version_info.major >= 3:
                 next_file_position = self.file_position + len(line.encode()) + 1
             else:
                 next_file_position = self.file_position + len(line) + 1
             self.next_file_position = next_file_position
             try:
-                self.gcode.run_script(line)
+                if isinstance(line, tuple):
+                    self.gcode.run_parsed_command_from_command(*line)
+                elif line:
+                    self.gcode.run_script_from_command(line)
             except self.gcode.error as e:
                 error_message = str(e)
+                gcode_mutex.unlock()
+                is_locked = False
                 try:
                     self.gcode.run_script(self.on_error_gcode.render())
                 except:
@@ -283,6 +571,14 @@ class VirtualSD:
                 break
             self.cmd_from_sd = False
             self.file_position = self.next_file_position
+            # Release the gcode mutex at the end of a batch
+            batch_count += 1
+            if (batch_count >= self.batch_lines or not lines
+                or self.next_file_position != next_file_position
+                or gcode_mutex.has_waiters()
+                or self.reactor.monotonic() > batch_endtime):
+                gcode_mutex.unlock()
+                is_locked = False
             # Do we need to skip around?
             if self.next_file_position != next_file_position:
                 try:
@@ -291,9 +587,15 @@ class VirtualSD:
                     logging.exception("virtual_sdcard seek")
                     self.work_timer = None
                     return self.reactor.NEVER
+                if reader is not None:
+                    reader = self._seek_reader(reader, self.file_position)
                 lines = []
                 partial_input = ""
+        if is_locked:
+            gcode_mutex.unlock()
         logging.info("Exiting SD card print (position %d)", self.file_position)
+        if reader is not None:
+            reader.close()
         self.work_timer = None
         self.cmd_from_sd = False
         if error_message is not None:
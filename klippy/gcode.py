@@ -3,7 +3,7 @@
 # Copyright (C) 2016-2021  Kevin O'Connor <kevin@koconnor.net>
 #
 # This file may be distributed under the terms of the GNU GPLv3 license.
-import os, re, logging, collections, shlex
+import os, re, logging, collections, shlex, bisect, math
 
 class CommandError(Exception):
     pass
@@ -85,6 +85,66 @@ class GCodeCommand:
         return self.get(name, default, parser=float, minval=minval,
                         maxval=maxval, above=above, below=below)
 
+# Latency histogram bucket limits (in seconds)
+PROFILE_BUCKETS = [.0001, .001, .010, .100, 1.]
+PROFILE_TOP_COUNT = 10
+PROFILE_DECAY_TIME = 60.
+PROFILE_REBASE_TIME = 50. * PROFILE_DECAY_TIME
+
+# Tracking of time spent in each command handler
+class GCodeProfiler:
+    def __init__(self):
+        self.stats = {}
+        # Recent usage decays exponentially with time.  The values are
+        # stored scaled by exp((time - base_time) / PROFILE_DECAY_TIME)
+        # so that their relative order only changes in record().
+        self.recent = {}
+        self.base_time = None
+        self.top = None
+    def record(self, name, starttime, endtime):
+        duration = endtime - starttime
+        s = self.stats.get(name)
+        if s is None:
+            s = self.stats[name] = [0, 0., 0., [0] * (len(PROFILE_BUCKETS)+1)]
+        s[0] += 1
+        s[1] += duration
+        if duration > s[2]:
+            s[2] = duration
+        s[3][bisect.bisect(PROFILE_BUCKETS, duration)] += 1
+        # Update recent usage
+        if self.base_time is None:
+            self.base_time = endtime
+        elapsed = endtime - self.base_time
+        if elapsed > PROFILE_REBASE_TIME:
+            adj = math.exp(-elapsed / PROFILE_DECAY_TIME)
+            for r in self.recent.values():
+                r[0] *= adj
+                r[1] *= adj
+            self.base_time = endtime
+            elapsed = 0.
+        scale = math.exp(elapsed / PROFILE_DECAY_TIME)
+        r = self.recent.get(name)
+        if r is None:
+            r = self.recent[name] = [0., 0.]
+        r[0] += scale
+        r[1] += duration * scale
+        self.top = None
+    def get_stats(self):
+        return {name: {'count': s[0], 'total_time': s[1], 'max_time': s[2],
+                       'histogram': list(s[3])}
+                for name, s in self.stats.items()}
+    def get_top(self, eventtime):
+        # Report the commands with the most recent usage
+        if self.base_time is None:
+            return []
+        top = self.top
+        if top is None:
+            top = self.top = sorted(self.recent.items(),
+                                    key=(lambda i: i[1][1]),
+                                    reverse=True)[:PROFILE_TOP_COUNT]
+        scale = math.exp((self.base_time - eventtime) / PROFILE_DECAY_TIME)
+        return [[name, r[0] * scale, r[1] * scale] for name, r in top]
+
 # Parse and dispatch G-Code commands
 class GCodeDispatch:
     error = CommandError
@@ -98,7 +158,9 @@ class GCodeDispatch:
                                        self._handle_disconnect)
         # Command handling
         self.is_printer_ready = False
-        self.mutex = printer.get_reactor().mutex()
+        self.reactor = printer.get_reactor()
+        self.mutex = self.reactor.mutex()
+        self.profiler = None
         self.output_callbacks = []
         self.base_gcode_handlers = self.gcode_handlers = {}
         self.ready_gcode_handlers = {}
@@ -107,7 +169,8 @@ class GCodeDispatch:
         self.status_commands = {}
         # Register commands needed before config file is loaded
         handlers = ['M110', 'M112', 'M115',
-                    'RESTART', 'FIRMWARE_RESTART', 'ECHO', 'STATUS', 'HELP']
+                    'RESTART', 'FIRMWARE_RESTART', 'ECHO', 'STATUS', 'HELP',
+                    'GCODE_PROFILE']
         for cmd in handlers:
             func = getattr(self, 'cmd_' + cmd)
             desc = getattr(self, 'cmd_' + cmd + '_help', None)
@@ -160,7 +223,10 @@ class GCodeDispatch:
     def get_command_help(self):
         return dict(self.gcode_help)
     def get_status(self, eventtime):
-        return {'commands': self.status_commands}
+        profile = []
+        if self.profiler is not None:
+            profile = self.profiler.get_top(eventtime)
+        return {'commands': self.status_commands, 'profile': profile}
     def _build_status_commands(self):
         commands = {cmd: {} for cmd in self.gcode_handlers}
         for cmd in self.gcode_help:
@@ -185,50 +251,77 @@ class GCodeDispatch:
         self._respond_state("Ready")
     # Parse input into commands
     args_r = re.compile('([A-Z_]+|[A-Z*/])')
+    # Simple G0-G3 moves (eg, "G1 X10.5 Y20 E.3") may skip the general parser
+    fast_move_r = re.compile(r'G[0-3](?:\s+[A-Z][-+]?[0-9.]+)*\s*$')
     def _process_commands(self, commands, need_ack=True):
+        fast_move_match = self.fast_move_r.match
         for line in commands:
             # Ignore comments and leading/trailing spaces
             line = origline = line.strip()
             cpos = line.find(';')
             if cpos >= 0:
                 line = line[:cpos]
-            # Break line into parts and determine command
-            parts = self.args_r.split(line.upper())
-            numparts = len(parts)
-            cmd = ""
-            if numparts >= 3 and parts[1] != 'N':
-                cmd = parts[1] + parts[2].strip()
-            elif numparts >= 5 and parts[1] == 'N':
-                # Skip line number at start of command
-                cmd = parts[3] + parts[4].strip()
-            # Build gcode "params" dictionary
-            params = { parts[i]: parts[i+1].strip()
-                       for i in range(1, numparts, 2) }
-            gcmd = GCodeCommand(self, cmd, origline, params, need_ack)
-            # Invoke handler for command
-            handler = self.gcode_handlers.get(cmd, self.cmd_default)
-            try:
-                handler(gcmd)
-            except self.error as e:
-                self._respond_error(str(e))
-                self.printer.send_event("gcode:command_error")
-                if not need_ack:
-                    raise
-            except:
-                msg = 'Internal error on command:"%s"' % (cmd,)
-                logging.exception(msg)
-                self.printer.invoke_shutdown(msg)
-                self._respond_error(msg)
-                if not need_ack:
-                    raise
-            gcmd.ack()
+            if fast_move_match(line) is not None:
+                # Fast path - already upper case with one letter per param
+                parts = line.split()
+                cmd = parts[0]
+                params = { p[0]: p[1:] for p in parts }
+            else:
+                # Break line into parts and determine command
+                parts = self.args_r.split(line.upper())
+                numparts = len(parts)
+                cmd = ""
+                if numparts >= 3 and parts[1] != 'N':
+                    cmd = parts[1] + parts[2].strip()
+                elif numparts >= 5 and parts[1] == 'N':
+                    # Skip line number at start of command
+                    cmd = parts[3] + parts[4].strip()
+                # Build gcode "params" dictionary
+                params = { parts[i]: parts[i+1].strip()
+                           for i in range(1, numparts, 2) }
+            self._process_command(cmd, origline, params, need_ack)
+    def _process_command(self, cmd, origline, params, need_ack):
+        gcmd = GCodeCommand(self, cmd, origline, params, need_ack)
+        # Invoke handler for command
+        handler = self.gcode_handlers.get(cmd, self.cmd_default)
+        profiler = self.profiler
+        if profiler is not None:
+            starttime = self.reactor.monotonic()
+        try:
+            handler(gcmd)
+        except self.error as e:
+            self._respond_error(str(e))
+            self.printer.send_event("gcode:command_error")
+            if not need_ack:
+                raise
+        except:
+            msg = 'Internal error on command:"%s"' % (cmd,)
+            logging.exception(msg)
+            self.printer.invoke_shutdown(msg)
+            self._respond_error(msg)
+            if not need_ack:
+                raise
+        finally:
+            if profiler is not None and cmd:
+                profiler.record(cmd, starttime, self.reactor.monotonic())
+        gcmd.ack()
     def run_script_from_command(self, script):
         self._process_commands(script.split('\n'), need_ack=False)
     def run_script(self, script):
         with self.mutex:
             self._process_commands(script.split('\n'), need_ack=False)
+    def run_parsed_command_from_command(self, command, commandline, params):
+        # Run a command that has already been broken into its parameters
+        self._process_command(command, commandline, params, False)
     def get_mutex(self):
         return self.mutex
+    def get_profiler(self):
+        return self.profiler
+    def set_profile_enable(self, enable, reset=False):
+        if not enable:
+            self.profiler = None
+        elif self.profiler is None or reset:
+            self.profiler = GCodeProfiler()
     def create_gcode_command(self, command, commandline, params):
         return GCodeCommand(self, command, commandline, params, False)
     # Response handling
@@ -354,6 +447,19 @@ class GCodeDispatch:
         msg = self.printer.get_state_message()[0]
         msg = msg.rstrip() + "\nKlipper state: Not ready"
         raise gcmd.error(msg)
+    cmd_GCODE_PROFILE_help = "Enable/disable and report command profiling"
+    def cmd_GCODE_PROFILE(self, gcmd):
+        enable = gcmd.get_int('ENABLE', self.profiler is not None,
+                              minval=0, maxval=1)
+        self.set_profile_enable(enable, gcmd.get_int('RESET', 0))
+        if self.profiler is None:
+            gcmd.respond_info("G-Code profiling disabled")
+            return
+        msg = ["G-Code profile (command: count total_time):"]
+        eventtime = self.reactor.monotonic()
+        for name, count, total_time in self.profiler.get_top(eventtime):
+            msg.append("%s: %.1f %.6f" % (name, count, total_time))
+        gcmd.respond_info("\n".join(msg))
     cmd_HELP_help = "Report the list of available extended G-Code commands"
     def cmd_HELP(self, gcmd):
         cmdhelp = []
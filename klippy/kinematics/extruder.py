@@ -167,8 +167,9 @@ class PrinterExtruder:
         # Setup extruder trapq (trapezoidal motion queue)
         ffi_main, ffi_lib = chelper.get_ffi()
         self.trapq = ffi_main.gc(ffi_lib.trapq_alloc(), ffi_lib.trapq_free)
-        self.trapq_append = ffi_lib.trapq_append
+        self.trapq_append_batch = ffi_lib.trapq_append_batch
         self.trapq_finalize_moves = ffi_lib.trapq_finalize_moves
+        self.trapq_data = []
         # Setup extruder stepper
         self.extruder_stepper = None
         if (config.get('step_pin', None) is not None
@@ -238,16 +239,22 @@ class PrinterExtruder:
         accel = move.accel * axis_r
         start_v = move.start_v * axis_r
         cruise_v = move.cruise_v * axis_r
-        can_pressure_advance = False
+        can_pressure_advance = 0.
         if axis_r > 0. and (move.axes_d[0] or move.axes_d[1]):
-            can_pressure_advance = True
+            can_pressure_advance = 1.
         # Queue movement (x is extruder movement, y is pressure advance flag)
-        self.trapq_append(self.trapq, print_time,
-                          move.accel_t, move.cruise_t, move.decel_t,
-                          move.start_pos[3], 0., 0.,
-                          1., can_pressure_advance, 0.,
-                          start_v, cruise_v, accel)
+        self.trapq_data.extend((print_time,
+                                move.accel_t, move.cruise_t, move.decel_t,
+                                move.start_pos[3], 0., 0.,
+                                1., can_pressure_advance, 0.,
+                                start_v, cruise_v, accel))
         self.last_position = move.end_pos[3]
+    def flush_trapq_batch(self):
+        # Add moves queued by move() to the trapq
+        trapq_data = self.trapq_data
+        if trapq_data:
+            self.trapq_append_batch(self.trapq, trapq_data, len(trapq_data))
+            del trapq_data[:]
     def find_past_position(self, print_time):
         if self.extruder_stepper is None:
             return 0.
@@ -289,6 +296,8 @@ class DummyExtruder:
         self.printer = printer
     def update_move_time(self, flush_time, clear_history_time):
         pass
+    def flush_trapq_batch(self):
+        pass
     def check_move(self, move):
         raise move.move_error("Extrude when no extruder present")
     def find_past_position(self, print_time):
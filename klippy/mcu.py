@@ -570,6 +570,9 @@ class MCU:
             if not (self._serialport.startswith("/dev/rpmsg_")
                     or self._serialport.startswith("/tmp/klipper_host_")):
                 self._baud = config.getint('baud', 250000, minval=2400)
+        cache_path = config.get('dictionary_cache_path', None)
+        if cache_path is not None:
+            self._serial.set_dictionary_cache(os.path.expanduser(cache_path))
         # Restarts
         restart_methods = [None, 'arduino', 'cheetah', 'command', 'rpi_usb']
         self._restart_method = 'command'
@@ -608,9 +611,6 @@ class MCU:
         printer.load_object(config, "error_mcu")
         printer.register_event_handler("klippy:firmware_restart",
                                        self._firmware_restart)
-        printer.register_event_handler("klippy:mcu_identify",
-                                       self._mcu_identify)
-        printer.register_event_handler("klippy:connect", self._connect)
         printer.register_event_handler("klippy:shutdown", self._shutdown)
         printer.register_event_handler("klippy:disconnect", self._disconnect)
         printer.register_event_handler("klippy:ready", self._ready)
@@ -772,30 +772,37 @@ class MCU:
         logging.info(move_msg)
         log_info = self._log_info() + "\n" + move_msg
         self._printer.set_rollover_info(self._name, log_info, log=False)
-    def _mcu_identify(self):
+    def _connect_serial(self):
         if self.is_fileoutput():
             self._connect_file()
-        else:
-            resmeth = self._restart_method
-            if resmeth == 'rpi_usb' and not os.path.exists(self._serialport):
-                # Try toggling usb power
-                self._check_restart("enable power")
-            try:
-                if self._canbus_iface is not None:
-                    cbid = self._printer.lookup_object('canbus_ids')
-                    nodeid = cbid.get_nodeid(self._serialport)
-                    self._serial.connect_canbus(self._serialport, nodeid,
-                                                self._canbus_iface)
-                elif self._baud:
-                    # Cheetah boards require RTS to be deasserted
-                    # else a reset will trigger the built-in bootloader.
-                    rts = (resmeth != "cheetah")
-                    self._serial.connect_uart(self._serialport, self._baud, rts)
-                else:
-                    self._serial.connect_pipe(self._serialport)
-                self._clocksync.connect(self._serial)
-            except serialhdl.error as e:
-                raise error(str(e))
+            return
+        resmeth = self._restart_method
+        if resmeth == 'rpi_usb' and not os.path.exists(self._serialport):
+            # Try toggling usb power
+            self._check_restart("enable power")
+        try:
+            if self._canbus_iface is not None:
+                cbid = self._printer.lookup_object('canbus_ids')
+                nodeid = cbid.get_nodeid(self._serialport)
+                self._serial.connect_canbus(self._serialport, nodeid,
+                                            self._canbus_iface)
+            elif self._baud:
+                # Cheetah boards require RTS to be deasserted
+                # else a reset will trigger the built-in bootloader.
+                rts = (resmeth != "cheetah")
+                self._serial.connect_uart(self._serialport, self._baud, rts)
+            else:
+                self._serial.connect_pipe(self._serialport)
+        except serialhdl.error as e:
+            raise error(str(e))
+    def _connect_clocksync(self):
+        if self.is_fileoutput():
+            return
+        try:
+            self._clocksync.connect(self._serial)
+        except serialhdl.error as e:
+            raise error(str(e))
+    def _mcu_identify(self):
         logging.info(self._log_info())
         ppins = self._printer.lookup_object('pins')
         pin_resolver = ppins.get_pin_resolver(self._name)
@@ -873,6 +880,8 @@ class MCU:
         return self._name
     def register_response(self, cb, msg, oid=None):
         self._serial.register_response(cb, msg, oid)
+    def register_batch_response(self, cb, msg, oid=None):
+        self._serial.register_batch_response(cb, msg, oid)
     def alloc_command_queue(self):
         return self._serial.alloc_command_queue()
     def lookup_command(self, msgformat, cq=None):
@@ -1009,14 +1018,63 @@ class MCU:
         self._get_status_info['last_stats'] = last_stats
         return False, '%s: %s' % (self._name, stats)
 
+
+######################################################################
+# Parallel connection to all micro-controllers
+######################################################################
+
+# Helper to run the identify and connect phases of all mcus at the
+# same time (each mcu is handled in its own reactor greenlet)
+class MCUConnectHelper:
+    def __init__(self, printer, mcus):
+        self._printer = printer
+        self._reactor = printer.get_reactor()
+        self._mcus = mcus
+        printer.register_event_handler("klippy:mcu_identify",
+                                       self._mcu_identify)
+        printer.register_event_handler("klippy:connect", self._connect)
+    def _run_parallel(self, mcus, func):
+        if len(mcus) <= 1 or mcus[0].is_fileoutput():
+            # Nothing to overlap - avoid changing the reactor scheduling
+            for m in mcus:
+                func(m)
+            return
+        def make_callback(mcu):
+            def callback(eventtime):
+                try:
+                    func(mcu)
+                except Exception as e:
+                    return e
+                return None
+            return callback
+        completions = [self._reactor.register_callback(make_callback(m))
+                       for m in mcus]
+        results = [c.wait() for c in completions]
+        # Report the error of the first failing mcu (in config order)
+        for res in results:
+            if res is not None:
+                raise res
+    def _mcu_identify(self):
+        main_mcu, secondary_mcus = self._mcus[0], self._mcus[1:]
+        self._run_parallel(self._mcus, MCU._connect_serial)
+        # Secondary mcus synchronize their clocks to the main mcu
+        main_mcu._connect_clocksync()
+        self._run_parallel(secondary_mcus, MCU._connect_clocksync)
+        for m in self._mcus:
+            m._mcu_identify()
+    def _connect(self):
+        self._run_parallel(self._mcus, MCU._connect)
+
 def add_printer_objects(config):
     printer = config.get_printer()
     reactor = printer.get_reactor()
     mainsync = clocksync.ClockSync(reactor)
-    printer.add_object('mcu', MCU(config.getsection('mcu'), mainsync))
+    mcus = [MCU(config.getsection('mcu'), mainsync)]
+    printer.add_object('mcu', mcus[0])
     for s in config.get_prefix_sections('mcu '):
-        printer.add_object(s.section, MCU(
-            s, clocksync.SecondarySync(reactor, mainsync)))
+        mcus.append(MCU(s, clocksync.SecondarySync(reactor, mainsync)))
+        printer.add_object(s.section, mcus[-1])
+    MCUConnectHelper(printer, mcus)
 
 def get_printer_mcu(printer, name):
     if name == 'mcu':
@@ -159,6 +159,55 @@ def convert_msg_format(msgformat):
         msgformat = msgformat.replace(c, '%s')
     return msgformat
 
+# Generate python code specialized for encoding and parsing a message.
+# Integers and strings are handled inline (integers that fit in a
+# single byte are encoded inline); other values are passed to the
+# parameter type's methods.
+def build_codec(msgid_bytes, param_names):
+    env = {}
+    enc = ["def encode(params):", "    out = %s" % (list(msgid_bytes),)]
+    dec = ["def parse(s, pos):", "    pos += %d" % (len(msgid_bytes),)]
+    for i, (name, t) in enumerate(param_names):
+        env['encode%d' % (i,)] = t.encode
+        env['parse%d' % (i,)] = t.parse
+        enc.append("    v = params[%d]" % (i,))
+        if t.is_int:
+            enc += ["    if -0x20 <= v < 0x60:",
+                    "        out.append(v & 0x7f)",
+                    "    else:",
+                    "        encode%d(out, v)" % (i,)]
+            dec += ["    c = s[pos]",
+                    "    pos += 1",
+                    "    if c < 0x60:",
+                    "        v%d = c" % (i,),
+                    "    else:",
+                    "        v = c & 0x7f",
+                    "        if (c & 0x60) == 0x60:",
+                    "            v |= -0x20",
+                    "        while c & 0x80:",
+                    "            c = s[pos]",
+                    "            pos += 1",
+                    "            v = (v<<7) | (c & 0x7f)"]
+            if t.signed:
+                dec.append("        v%d = v" % (i,))
+            else:
+                dec.append("        v%d = int(v & 0xffffffff)" % (i,))
+        elif t.is_dynamic_string:
+            enc += ["    out.append(len(v))",
+                    "    out.extend(bytearray(v))"]
+            dec += ["    l = s[pos]",
+                    "    v%d = bytes(bytearray(s[pos+1:pos+l+1]))" % (i,),
+                    "    pos += l + 1"]
+        else:
+            enc.append("    encode%d(out, v)" % (i,))
+            dec.append("    v%d, pos = parse%d(s, pos)" % (i, i))
+    enc.append("    return out")
+    dec.append("    return {%s}, pos" % (", ".join([
+        "%s: v%d" % (repr(name), i)
+        for i, (name, t) in enumerate(param_names)]),))
+    exec("\n".join(enc + dec), env)
+    return env['encode'], env['parse']
+
 class MessageFormat:
     def __init__(self, msgid_bytes, msgformat, enumerations={}):
         self.msgid_bytes = msgid_bytes
@@ -168,23 +217,23 @@ class MessageFormat:
         self.param_names = lookup_params(msgformat, enumerations)
         self.param_types = [t for name, t in self.param_names]
         self.name_to_type = dict(self.param_names)
+        self.codec = None
+    def _build_codec(self):
+        # Replace encode() and parse() with versions specialized for
+        # this message (built on first use, as most messages are unused)
+        if self.codec is None:
+            self.codec = build_codec(self.msgid_bytes, self.param_names)
+            self.encode, self.parse = self.codec
+        return self.codec
     def encode(self, params):
-        out = list(self.msgid_bytes)
-        for i, t in enumerate(self.param_types):
-            t.encode(out, params[i])
-        return out
+        return self._build_codec()[0](params)
+    def parse(self, s, pos):
+        return self._build_codec()[1](s, pos)
     def encode_by_name(self, **params):
         out = list(self.msgid_bytes)
         for name, t in self.param_names:
             t.encode(out, params[name])
         return out
-    def parse(self, s, pos):
-        pos += len(self.msgid_bytes)
-        out = {}
-        for name, t in self.param_names:
-            v, pos = t.parse(s, pos)
-            out[name] = v
-        return out, pos
     def format_params(self, params):
         out = []
         for name, t in self.param_names:
@@ -282,7 +331,9 @@ class MessageParser:
             return "%s %s" % (name, msg)
         return str(params)
     def parse(self, s):
-        msgid, param_pos = self.msgid_parser.parse(s, MESSAGE_HEADER_SIZE)
+        msgid = s[MESSAGE_HEADER_SIZE]
+        if msgid >= 0x60:
+            msgid, param_pos = self.msgid_parser.parse(s, MESSAGE_HEADER_SIZE)
         mid = self.messages_by_id.get(msgid, self.unknown)
         params, pos = mid.parse(s, MESSAGE_HEADER_SIZE)
         if pos != len(s)-MESSAGE_TRAILER_SIZE:
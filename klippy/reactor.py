@@ -72,6 +72,8 @@ class ReactorMutex:
         self.unlock = self.__exit__
     def test(self):
         return self.is_locked
+    def has_waiters(self):
+        return not not self.queue
     def __enter__(self):
         if not self.is_locked:
             self.is_locked = True
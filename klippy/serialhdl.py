@@ -3,7 +3,7 @@
 # Copyright (C) 2016-2021  Kevin O'Connor <kevin@koconnor.net>
 #
 # This file may be distributed under the terms of the GNU GPLv3 license.
-import logging, threading, os
+import logging, threading, os, glob, zlib
 import serial
 
 import msgproto, chelper, util
@@ -11,6 +11,11 @@ import msgproto, chelper, util
 class error(Exception):
     pass
 
+# Maximum number of messages to obtain from the serialqueue at a time
+PULL_BATCH_SIZE = 32
+# Number of data dictionary bytes requested per identify command
+IDENTIFY_CHUNK = 40
+
 class SerialReader:
     def __init__(self, reactor, warn_prefix=""):
         self.reactor = reactor
@@ -28,54 +33,126 @@ class SerialReader:
         self.background_thread = None
         # Message handlers
         self.handlers = {}
+        self.batch_handlers = {}
         self.register_response(self._handle_unknown_init, '#unknown')
         self.register_response(self.handle_output, '#output')
         # Sent message notification tracking
         self.last_notify_id = 0
         self.pending_notifications = {}
+        # Data dictionary storage
+        self.dict_cache = None
     def _bg_thread(self):
-        response = self.ffi_main.new('struct pull_queue_message *')
+        responses = self.ffi_main.new('struct pull_queue_message[%d]'
+                                      % (PULL_BATCH_SIZE,))
         while 1:
-            self.ffi_lib.serialqueue_pull(self.serialqueue, response)
-            count = response.len
+            count = self.ffi_lib.serialqueue_pull_batch(
+                self.serialqueue, responses, PULL_BATCH_SIZE)
             if count < 0:
                 break
-            if response.notify_id:
+            # Parse responses
+            msgs = []
+            for i in range(count):
+                response = responses[i]
                 params = {'#sent_time': response.sent_time,
                           '#receive_time': response.receive_time}
-                completion = self.pending_notifications.pop(response.notify_id)
+                if not response.notify_id:
+                    params.update(self.msgparser.parse(
+                        response.msg[0:response.len]))
+                msgs.append((response.notify_id, params))
+            # Look up handlers
+            hdls = []
+            with self.lock:
+                for notify_id, params in msgs:
+                    if notify_id:
+                        hdls.append((None, None))
+                        continue
+                    key = (params['#name'], params.get('oid'))
+                    hdl = self.batch_handlers.get(key)
+                    if hdl is not None:
+                        hdls.append((hdl, key))
+                    else:
+                        hdls.append((self.handlers.get(key,
+                                                       self.handle_default),
+                                     None))
+            self._dispatch(msgs, hdls)
+    def _dispatch(self, msgs, hdls):
+        # Invoke handlers in arrival order - messages for batch handlers
+        # are accumulated and delivered before any following message
+        batches = []
+        batch_keys = {}
+        for (notify_id, params), (hdl, batch_key) in zip(msgs, hdls):
+            if batch_key is not None:
+                batch = batch_keys.get(batch_key)
+                if batch is None:
+                    batch = batch_keys[batch_key] = []
+                    batches.append((hdl, batch))
+                batch.append(params)
+                continue
+            if batches:
+                self._deliver_batches(batches)
+                batches = []
+                batch_keys = {}
+            if notify_id:
+                completion = self.pending_notifications.pop(notify_id)
                 self.reactor.async_complete(completion, params)
                 continue
-            params = self.msgparser.parse(response.msg[0:count])
-            params['#sent_time'] = response.sent_time
-            params['#receive_time'] = response.receive_time
-            hdl = (params['#name'], params.get('oid'))
             try:
-                with self.lock:
-                    hdl = self.handlers.get(hdl, self.handle_default)
-                    hdl(params)
+                hdl(params)
+            except:
+                logging.exception("%sException in serial callback",
+                                  self.warn_prefix)
+        self._deliver_batches(batches)
+    def _deliver_batches(self, batches):
+        for hdl, batch in batches:
+            try:
+                hdl(batch)
             except:
                 logging.exception("%sException in serial callback",
                                   self.warn_prefix)
     def _error(self, msg, *params):
         raise error(self.warn_prefix + (msg % params))
+    def _query_identify(self, offset):
+        msg = "identify offset=%d count=%d" % (offset, IDENTIFY_CHUNK)
+        while 1:
+            params = self.send_with_response(msg, 'identify_response')
+            if params['offset'] == offset:
+                return params['data']
+    def _check_dictionary_cache(self, prefix):
+        # A cached dictionary is only used if the mcu reports the same
+        # last identify chunk.  That chunk is shorter than
+        # IDENTIFY_CHUNK, which confirms the total length of the mcu's
+        # dictionary, and it ends with the zlib Adler-32 checksum of the
+        # full uncompressed dictionary.
+        for fname, data in self.dict_cache.lookup(prefix):
+            offset = max(len(prefix), len(data) - (IDENTIFY_CHUNK - 1))
+            tail = self._query_identify(offset)
+            if len(tail) < IDENTIFY_CHUNK and tail == data[offset:]:
+                self.dict_cache.note_used(fname)
+                return data
+        return None
     def _get_identify_data(self, eventtime):
         # Query the "data dictionary" from the micro-controller
-        identify_data = b""
-        while 1:
-            msg = "identify offset=%d count=%d" % (len(identify_data), 40)
-            try:
-                params = self.send_with_response(msg, 'identify_response')
-            except error as e:
-                logging.exception("%sWait for identify_response",
-                                  self.warn_prefix)
-                return None
-            if params['offset'] == len(identify_data):
-                msgdata = params['data']
-                if not msgdata:
-                    # Done
-                    return identify_data
+        try:
+            identify_data = self._query_identify(0)
+            if (self.dict_cache is not None
+                and len(identify_data) == IDENTIFY_CHUNK):
+                cached_data = self._check_dictionary_cache(identify_data)
+                if cached_data is not None:
+                    logging.info("%sUsing cached data dictionary",
+                                 self.warn_prefix)
+                    return cached_data
+            msgdata = identify_data
+            while msgdata:
+                msgdata = self._query_identify(len(identify_data))
                 identify_data += msgdata
+        except error as e:
+            logging.exception("%sWait for identify_response",
+                              self.warn_prefix)
+            return None
+        if self.dict_cache is not None and len(identify_data) > IDENTIFY_CHUNK:
+            self.dict_cache.store(identify_data[:IDENTIFY_CHUNK],
+                                  identify_data)
+        return identify_data
     def _start_session(self, serial_dev, serial_fd_type=b'u', client_id=0):
         self.serial_dev = serial_dev
         self.serialqueue = self.ffi_main.gc(
@@ -223,6 +300,8 @@ class SerialReader:
         self.ffi_lib.serialqueue_get_stats(self.serialqueue,
                                            self.stats_buf, len(self.stats_buf))
         return str(self.ffi_main.string(self.stats_buf).decode())
+    def set_dictionary_cache(self, dirname):
+        self.dict_cache = DictionaryCache(dirname, self.warn_prefix)
     def get_reactor(self):
         return self.reactor
     def get_msgparser(self):
@@ -238,6 +317,16 @@ class SerialReader:
                 del self.handlers[name, oid]
             else:
                 self.handlers[name, oid] = callback
+    def register_batch_response(self, callback, name, oid=None):
+        # The callback is invoked with a list of params for all
+        # matching messages obtained in a single pull from the
+        # serialqueue (the batch is delivered before any message for a
+        # regular handler that arrived after it)
+        with self.lock:
+            if callback is None:
+                del self.batch_handlers[name, oid]
+            else:
+                self.batch_handlers[name, oid] = callback
     # Command sending
     def raw_send(self, cmd, minclock, reqclock, cmd_queue):
         self.ffi_lib.serialqueue_send(self.serialqueue, cmd_queue,
@@ -300,6 +389,61 @@ class SerialReader:
     def handle_default(self, params):
         logging.warning("%sgot %s", self.warn_prefix, params)
 
+# Storage of previously downloaded data dictionaries
+class DictionaryCache:
+    MAX_ENTRIES = 16
+    def __init__(self, dirname, warn_prefix=""):
+        self.dirname = dirname
+        self.warn_prefix = warn_prefix
+    def _get_filename(self, prefix, data):
+        return os.path.join(self.dirname, "dict-%08x-%08x.bin" % (
+            zlib.crc32(prefix) & 0xffffffff, zlib.crc32(data) & 0xffffffff))
+    def lookup(self, prefix):
+        # Return the stored dictionaries that start with the given bytes
+        pattern = os.path.join(self.dirname, "dict-%08x-*.bin" % (
+            zlib.crc32(prefix) & 0xffffffff,))
+        res = []
+        for fname in sorted(glob.glob(pattern)):
+            try:
+                with open(fname, 'rb') as f:
+                    data = f.read()
+                zlib.decompress(data)
+            except (IOError, OSError, zlib.error) as e:
+                logging.warning("%sUnable to load cached dictionary %s: %s",
+                                self.warn_prefix, fname, str(e))
+                continue
+            if (fname != self._get_filename(prefix, data)
+                or not data.startswith(prefix)):
+                logging.warning("%sIgnoring mismatched cached dictionary %s",
+                                self.warn_prefix, fname)
+                continue
+            res.append((fname, data))
+        return res
+    def note_used(self, fname):
+        try:
+            os.utime(fname, None)
+        except OSError:
+            pass
+    def store(self, prefix, data):
+        fname = self._get_filename(prefix, data)
+        tmpname = fname + ".tmp"
+        try:
+            if not os.path.isdir(self.dirname):
+                os.makedirs(self.dirname)
+            with open(tmpname, 'wb') as f:
+                f.write(data)
+            os.rename(tmpname, fname)
+            self._prune()
+        except (IOError, OSError):
+            logging.exception("%sUnable to store data dictionary",
+                              self.warn_prefix)
+    def _prune(self):
+        # Remove the least recently used dictionaries
+        fnames = glob.glob(os.path.join(self.dirname, "dict-*.bin"))
+        fnames.sort(key=os.path.getmtime, reverse=True)
+        for fname in fnames[self.MAX_ENTRIES:]:
+            os.remove(fname)
+
 # Class to send a query command and return the received response
 class SerialRetryCommand:
     def __init__(self, serial, name, oid=None):
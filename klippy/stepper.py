@@ -20,7 +20,8 @@ MIN_BOTH_EDGE_DURATION = 0.000000200
 class MCU_stepper:
     def __init__(self, name, step_pin_params, dir_pin_params,
                  rotation_dist, steps_per_rotation,
-                 step_pulse_duration=None, units_in_radians=False):
+                 step_pulse_duration=None, units_in_radians=False,
+                 high_ratio_compress=False):
         self._name = name
         self._rotation_dist = rotation_dist
         self._steps_per_rotation = steps_per_rotation
@@ -45,6 +46,8 @@ class MCU_stepper:
         self._stepqueue = ffi_main.gc(ffi_lib.stepcompress_alloc(oid),
                                       ffi_lib.stepcompress_free)
         ffi_lib.stepcompress_set_invert_sdir(self._stepqueue, self._invert_dir)
+        ffi_lib.stepcompress_set_high_ratio(self._stepqueue,
+                                            high_ratio_compress)
         self._mcu.register_stepqueue(self._stepqueue)
         self._stepper_kinematics = None
         self._itersolve_generate_steps = ffi_lib.itersolve_generate_steps
@@ -211,7 +214,7 @@ class MCU_stepper:
         return old_tq
     def add_active_callback(self, cb):
         self._active_callbacks.append(cb)
-    def generate_steps(self, flush_time):
+    def check_active(self, flush_time):
         # Check for activity if necessary
         if self._active_callbacks:
             sk = self._stepper_kinematics
@@ -221,6 +224,8 @@ class MCU_stepper:
                 self._active_callbacks = []
                 for cb in cbs:
                     cb(ret)
+    def generate_steps(self, flush_time):
+        self.check_active(flush_time)
         # Generate steps
         sk = self._stepper_kinematics
         ret = self._itersolve_generate_steps(sk, flush_time)
@@ -245,9 +250,13 @@ def PrinterStepper(config, units_in_radians=False):
         config, units_in_radians, True)
     step_pulse_duration = config.getfloat('step_pulse_duration', None,
                                           minval=0., maxval=.001)
+    compress_modes = {'standard': False, 'high_ratio': True}
+    high_ratio_compress = config.getchoice('step_compression',
+                                           compress_modes, 'standard')
     mcu_stepper = MCU_stepper(name, step_pin_params, dir_pin_params,
                               rotation_dist, steps_per_rotation,
-                              step_pulse_duration, units_in_radians)
+                              step_pulse_duration, units_in_radians,
+                              high_ratio_compress)
     # Register with helper modules
     for mname in ['stepper_enable', 'force_move', 'motion_report']:
         m = printer.load_object(config, mname)
@@ -4,7 +4,7 @@
 #
 # This file may be distributed under the terms of the GNU GPLv3 license.
 import math, logging, importlib
-import mcu, chelper, kinematics.extruder
+import mcu, chelper, stepper, kinematics.extruder
 
 # Common suffixes: _d is distance (in mm), _v is velocity (in
 #   mm/second), _v2 is velocity squared (mm^2/s^2), _t is time (in
@@ -12,23 +12,33 @@ import mcu, chelper, kinematics.extruder
 
 # Class to track each move request
 class Move:
+    __slots__ = (
+        'toolhead', 'start_pos', 'end_pos', 'accel', 'junction_deviation',
+        'timing_callbacks', 'is_kinematic_move', 'axes_d', 'move_d',
+        'axes_r', 'min_move_t', 'max_start_v2', 'max_cruise_v2', 'delta_v2',
+        'max_smoothed_v2', 'smooth_delta_v2', 'start_v', 'cruise_v', 'end_v',
+        'accel_t', 'cruise_t', 'decel_t')
     def __init__(self, toolhead, start_pos, end_pos, speed):
         self.toolhead = toolhead
-        self.start_pos = tuple(start_pos)
-        self.end_pos = tuple(end_pos)
+        self.start_pos = start_pos = tuple(start_pos)
+        self.end_pos = end_pos = tuple(end_pos)
         self.accel = toolhead.max_accel
         self.junction_deviation = toolhead.junction_deviation
-        self.timing_callbacks = []
+        # List of callbacks is only allocated if one is registered
+        self.timing_callbacks = None
         velocity = min(speed, toolhead.max_velocity)
         self.is_kinematic_move = True
-        self.axes_d = axes_d = [end_pos[i] - start_pos[i] for i in (0, 1, 2, 3)]
-        self.move_d = move_d = math.sqrt(sum([d*d for d in axes_d[:3]]))
+        dx = end_pos[0] - start_pos[0]
+        dy = end_pos[1] - start_pos[1]
+        dz = end_pos[2] - start_pos[2]
+        de = end_pos[3] - start_pos[3]
+        move_d = math.sqrt(dx*dx + dy*dy + dz*dz)
         if move_d < .000000001:
             # Extrude only move
             self.end_pos = (start_pos[0], start_pos[1], start_pos[2],
                             end_pos[3])
-            axes_d[0] = axes_d[1] = axes_d[2] = 0.
-            self.move_d = move_d = abs(axes_d[3])
+            dx = dy = dz = 0.
+            move_d = abs(de)
             inv_move_d = 0.
             if move_d:
                 inv_move_d = 1. / move_d
@@ -37,7 +47,10 @@ class Move:
             self.is_kinematic_move = False
         else:
             inv_move_d = 1. / move_d
-        self.axes_r = [d * inv_move_d for d in axes_d]
+        self.move_d = move_d
+        self.axes_d = (dx, dy, dz, de)
+        self.axes_r = (dx * inv_move_d, dy * inv_move_d, dz * inv_move_d,
+                       de * inv_move_d)
         self.min_move_t = move_d / velocity
         # Junction speeds are tracked in velocity squared.  The
         # delta_v2 is the maximum amount of this squared-velocity that
@@ -114,9 +127,12 @@ class LookAheadQueue:
     def __init__(self, toolhead):
         self.toolhead = toolhead
         self.queue = []
+        # State of the last lazy flush scan on entry to each queued move
+        self.scan_states = []
         self.junction_flush = LOOKAHEAD_FLUSH_TIME
     def reset(self):
         del self.queue[:]
+        del self.scan_states[:]
         self.junction_flush = LOOKAHEAD_FLUSH_TIME
     def set_flush_time(self, flush_time):
         self.junction_flush = flush_time
@@ -128,6 +144,7 @@ class LookAheadQueue:
         self.junction_flush = LOOKAHEAD_FLUSH_TIME
         update_flush_count = lazy
         queue = self.queue
+        scan_states = self.scan_states
         flush_count = len(queue)
         # Traverse queue from last to first move and determine maximum
         # junction speed assuming the robot comes to a complete stop
@@ -135,6 +152,16 @@ class LookAheadQueue:
         delayed = []
         next_end_v2 = next_smoothed_v2 = peak_cruise_v2 = 0.
         for i in range(flush_count-1, -1, -1):
+            if update_flush_count:
+                # The search for a flush point only depends on the
+                # velocities and on whether a peak or delayed move has
+                # been found.  If a previous lazy flush entered this move
+                # with the same state then no flush point will be found.
+                state = (next_end_v2, next_smoothed_v2,
+                         not not peak_cruise_v2, not not delayed)
+                if scan_states[i] == state:
+                    return
+                scan_states[i] = state
             move = queue[i]
             reachable_start_v2 = next_end_v2 + move.delta_v2
             start_v2 = min(move.max_start_v2, reachable_start_v2)
@@ -176,8 +203,10 @@ class LookAheadQueue:
         self.toolhead._process_moves(queue[:flush_count])
         # Remove processed moves from the queue
         del queue[:flush_count]
+        del scan_states[:flush_count]
     def add_move(self, move):
         self.queue.append(move)
+        self.scan_states.append(None)
         if len(self.queue) == 1:
             return
         move.calc_junction(self.queue[-2])
@@ -198,6 +227,10 @@ STEPCOMPRESS_FLUSH_TIME = 0.050
 SDS_CHECK_TIME = 0.001 # step+dir+step filter in stepcompress.c
 MOVE_HISTORY_EXPIRE = 30.
 
+ADAPTIVE_SAFETY_TIME = 0.150
+ADAPTIVE_LATENESS_FACTOR = 3.
+LATENESS_DECAY_TIME = 30.
+
 DRIP_SEGMENT_TIME = 0.050
 DRIP_TIME = 0.100
 class DripModeEndSignal(Exception):
@@ -212,7 +245,6 @@ class ToolHead:
             m for n, m in self.printer.lookup_objects(module='mcu')]
         self.mcu = self.all_mcus[0]
         self.lookahead = LookAheadQueue(self)
-        self.lookahead.set_flush_time(BUFFER_TIME_HIGH)
         self.commanded_pos = [0., 0., 0., 0.]
         # Velocity and acceleration control
         self.max_velocity = config.getfloat('max_velocity', above=0.)
@@ -240,6 +272,24 @@ class ToolHead:
         if self.mcu.is_fileoutput():
             self.can_pause = False
         self.need_check_pause = -1.
+        # Buffer time tracking (optionally adjusted from measured host
+        # scheduling delays)
+        self.adaptive_buffer_time = config.getboolean('adaptive_buffer_time',
+                                                      False)
+        self.buffer_time_min = config.getfloat('buffer_time_min', 0.250,
+                                               above=0.)
+        self.buffer_time_max = config.getfloat('buffer_time_max',
+                                               BUFFER_TIME_HIGH,
+                                               minval=self.buffer_time_min)
+        self.flush_waketime = self.reactor.NEVER
+        self.flush_sample_time = 0.
+        self.wakeup_jitter = self.flush_lateness = 0.
+        buffer_time_low = BUFFER_TIME_LOW
+        if self.adaptive_buffer_time:
+            buffer_time_low = min(max(buffer_time_low, self.buffer_time_min),
+                                  self.buffer_time_max)
+        self._set_buffer_time(buffer_time_low)
+        self.lookahead.set_flush_time(self.buffer_time_high)
         # Print time tracking
         self.print_time = 0.
         self.special_queuing_state = "NeedPrime"
@@ -256,9 +306,17 @@ class ToolHead:
         # Setup iterative solver
         ffi_main, ffi_lib = chelper.get_ffi()
         self.trapq = ffi_main.gc(ffi_lib.trapq_alloc(), ffi_lib.trapq_free)
-        self.trapq_append = ffi_lib.trapq_append
+        self.trapq_append_batch = ffi_lib.trapq_append_batch
         self.trapq_finalize_moves = ffi_lib.trapq_finalize_moves
         self.step_generators = []
+        # Optional generation of stepper steps using multiple threads
+        self.steppool = None
+        self.pool_steppers = []
+        threads = config.getint('step_generation_threads', 1, minval=1)
+        if threads > 1:
+            self.steppool = ffi_main.gc(ffi_lib.steppool_alloc(threads),
+                                        ffi_lib.steppool_free)
+            self.steppool_generate_steps = ffi_lib.steppool_generate_steps
         # Create kinematics class
         gcode = self.printer.lookup_object('gcode')
         self.Coord = gcode.Coord
@@ -290,12 +348,27 @@ class ToolHead:
         for module_name in modules:
             self.printer.load_object(config, module_name)
     # Print time and flush tracking
+    def _generate_pool_steps(self, flush_time):
+        # Activity callbacks of all pool steppers are run first (in
+        # registration order) and then the steps are generated for all
+        # steppers in parallel by the steppool threads.  Pool steppers
+        # are flushed before any other registered step generators.
+        sks = []
+        for s in self.pool_steppers:
+            s.check_active(flush_time)
+            sks.append(s.get_stepper_kinematics())
+        ret = self.steppool_generate_steps(self.steppool, sks, len(sks),
+                                           flush_time)
+        if ret:
+            raise stepper.error("Internal error in stepcompress")
     def _advance_flush_time(self, flush_time):
         flush_time = max(flush_time, self.last_flush_time)
         # Generate steps via itersolve
         sg_flush_want = min(flush_time + STEPCOMPRESS_FLUSH_TIME,
                             self.print_time - self.kin_flush_delay)
         sg_flush_time = max(sg_flush_want, flush_time)
+        if self.pool_steppers:
+            self._generate_pool_steps(sg_flush_time)
         for sg in self.step_generators:
             sg(sg_flush_time)
         self.min_restart_time = max(self.min_restart_time, sg_flush_time)
@@ -316,7 +389,8 @@ class ToolHead:
         self.print_time = max(self.print_time, next_print_time)
         want_flush_time = max(flush_time, self.print_time - pt_delay)
         while 1:
-            flush_time = min(flush_time + MOVE_BATCH_TIME, want_flush_time)
+            flush_time = min(flush_time + self.move_batch_time,
+                             want_flush_time)
             self._advance_flush_time(flush_time)
             if flush_time >= want_flush_time:
                 break
@@ -325,7 +399,8 @@ class ToolHead:
         est_print_time = self.mcu.estimated_print_time(curtime)
         kin_time = max(est_print_time + MIN_KIN_TIME, self.min_restart_time)
         kin_time += self.kin_flush_delay
-        min_print_time = max(est_print_time + BUFFER_TIME_START, kin_time)
+        min_print_time = max(est_print_time + self.buffer_time_start,
+                             kin_time)
         if min_print_time > self.print_time:
             self.print_time = min_print_time
             self.printer.send_event("toolhead:sync_print_time",
@@ -340,20 +415,26 @@ class ToolHead:
             self._calc_print_time()
         # Queue moves into trapezoid motion queue (trapq)
         next_move_time = self.print_time
+        trapq_data = []
         for move in moves:
             if move.is_kinematic_move:
-                self.trapq_append(
-                    self.trapq, next_move_time,
-                    move.accel_t, move.cruise_t, move.decel_t,
-                    move.start_pos[0], move.start_pos[1], move.start_pos[2],
-                    move.axes_r[0], move.axes_r[1], move.axes_r[2],
-                    move.start_v, move.cruise_v, move.accel)
+                start_pos = move.start_pos
+                axes_r = move.axes_r
+                trapq_data.extend((
+                    next_move_time, move.accel_t, move.cruise_t, move.decel_t,
+                    start_pos[0], start_pos[1], start_pos[2],
+                    axes_r[0], axes_r[1], axes_r[2],
+                    move.start_v, move.cruise_v, move.accel))
             if move.axes_d[3]:
                 self.extruder.move(next_move_time, move)
             next_move_time = (next_move_time + move.accel_t
                               + move.cruise_t + move.decel_t)
-            for cb in move.timing_callbacks:
-                cb(next_move_time)
+            if move.timing_callbacks is not None:
+                for cb in move.timing_callbacks:
+                    cb(next_move_time)
+        if trapq_data:
+            self.trapq_append_batch(self.trapq, trapq_data, len(trapq_data))
+        self.extruder.flush_trapq_batch()
         # Generate steps for moves
         if self.special_queuing_state:
             self._update_drip_move_time(next_move_time)
@@ -365,7 +446,7 @@ class ToolHead:
         self.lookahead.flush()
         self.special_queuing_state = "NeedPrime"
         self.need_check_pause = -1.
-        self.lookahead.set_flush_time(BUFFER_TIME_HIGH)
+        self.lookahead.set_flush_time(self.buffer_time_high)
         self.check_stall_time = 0.
     def flush_step_generation(self):
         self._flush_lookahead()
@@ -394,11 +475,11 @@ class ToolHead:
             if self.priming_timer is None:
                 self.priming_timer = self.reactor.register_timer(
                     self._priming_handler)
-            wtime = eventtime + max(0.100, buffer_time - BUFFER_TIME_LOW)
+            wtime = eventtime + max(0.100, buffer_time - self.buffer_time_low)
             self.reactor.update_timer(self.priming_timer, wtime)
         # Check if there are lots of queued moves and pause if so
         while 1:
-            pause_time = buffer_time - BUFFER_TIME_HIGH
+            pause_time = buffer_time - self.buffer_time_high
             if pause_time <= 0.:
                 break
             if not self.can_pause:
@@ -409,7 +490,8 @@ class ToolHead:
             buffer_time = self.print_time - est_print_time
         if not self.special_queuing_state:
             # In main state - defer pause checking until needed
-            self.need_check_pause = est_print_time + BUFFER_TIME_HIGH + 0.100
+            self.need_check_pause = (est_print_time + self.buffer_time_high
+                                     + 0.100)
     def _priming_handler(self, eventtime):
         self.reactor.unregister_timer(self.priming_timer)
         self.priming_timer = None
@@ -421,35 +503,73 @@ class ToolHead:
             logging.exception("Exception in priming_handler")
             self.printer.invoke_shutdown("Exception in priming_handler")
         return self.reactor.NEVER
+    def _check_flush(self, eventtime):
+        est_print_time = self.mcu.estimated_print_time(eventtime)
+        if not self.special_queuing_state:
+            # In "main" state - flush lookahead if buffer runs low
+            print_time = self.print_time
+            buffer_time = print_time - est_print_time
+            if buffer_time > self.buffer_time_low:
+                # Running normally - reschedule check
+                return eventtime + buffer_time - self.buffer_time_low
+            # Under ran low buffer mark - flush lookahead queue
+            self._flush_lookahead()
+            if print_time != self.print_time:
+                self.check_stall_time = self.print_time
+        # In "NeedPrime"/"Priming" state - flush queues if needed
+        while 1:
+            end_flush = self.need_flush_time + BGFLUSH_EXTRA_TIME
+            if self.last_flush_time >= end_flush:
+                self.do_kick_flush_timer = True
+                return self.reactor.NEVER
+            buffer_time = self.last_flush_time - est_print_time
+            if buffer_time > self.bgflush_low_time:
+                return eventtime + buffer_time - self.bgflush_low_time
+            ftime = (est_print_time + self.bgflush_low_time
+                     + self.bgflush_batch_time)
+            self._advance_flush_time(min(end_flush, ftime))
     def _flush_handler(self, eventtime):
         try:
-            est_print_time = self.mcu.estimated_print_time(eventtime)
-            if not self.special_queuing_state:
-                # In "main" state - flush lookahead if buffer runs low
-                print_time = self.print_time
-                buffer_time = print_time - est_print_time
-                if buffer_time > BUFFER_TIME_LOW:
-                    # Running normally - reschedule check
-                    return eventtime + buffer_time - BUFFER_TIME_LOW
-                # Under ran low buffer mark - flush lookahead queue
-                self._flush_lookahead()
-                if print_time != self.print_time:
-                    self.check_stall_time = self.print_time
-            # In "NeedPrime"/"Priming" state - flush queues if needed
-            while 1:
-                end_flush = self.need_flush_time + BGFLUSH_EXTRA_TIME
-                if self.last_flush_time >= end_flush:
-                    self.do_kick_flush_timer = True
-                    return self.reactor.NEVER
-                buffer_time = self.last_flush_time - est_print_time
-                if buffer_time > BGFLUSH_LOW_TIME:
-                    return eventtime + buffer_time - BGFLUSH_LOW_TIME
-                ftime = est_print_time + BGFLUSH_LOW_TIME + BGFLUSH_BATCH_TIME
-                self._advance_flush_time(min(end_flush, ftime))
+            waketime = self._check_flush(eventtime)
+            self._note_flush_timing(eventtime, waketime)
+            return waketime
         except:
             logging.exception("Exception in flush_handler")
             self.printer.invoke_shutdown("Exception in flush_handler")
         return self.reactor.NEVER
+    # Buffer time tracking
+    def _set_buffer_time(self, buffer_time_low):
+        ratio = buffer_time_low / BUFFER_TIME_LOW
+        self.buffer_time_low = buffer_time_low
+        self.buffer_time_high = BUFFER_TIME_HIGH * ratio
+        self.buffer_time_start = BUFFER_TIME_START * ratio
+        self.bgflush_low_time = BGFLUSH_LOW_TIME * ratio
+        self.bgflush_batch_time = BGFLUSH_BATCH_TIME * ratio
+        self.move_batch_time = MOVE_BATCH_TIME * ratio
+    def _note_flush_timing(self, eventtime, waketime):
+        # Track reactor wakeup jitter and flush handler lateness
+        sched_time = self.flush_waketime
+        self.flush_waketime = waketime
+        wake_delay = eventtime - sched_time
+        if wake_delay < 0.:
+            # Timer was not run from a scheduled wakeup
+            return
+        lateness = self.reactor.monotonic() - sched_time
+        sample_time = min(eventtime - self.flush_sample_time, 1.)
+        self.flush_sample_time = eventtime
+        decay = math.exp(-sample_time / LATENESS_DECAY_TIME)
+        self.wakeup_jitter = max(wake_delay, self.wakeup_jitter * decay)
+        self.flush_lateness = max(lateness, self.flush_lateness * decay)
+        if not self.adaptive_buffer_time:
+            return
+        # Increase buffer time immediately, but reduce it slowly
+        buffer_time_low = max(ADAPTIVE_SAFETY_TIME + (ADAPTIVE_LATENESS_FACTOR
+                                                      * self.flush_lateness),
+                              self.buffer_time_low * decay)
+        buffer_time_low = min(max(buffer_time_low, self.buffer_time_min),
+                              self.buffer_time_max)
+        if buffer_time_low != self.buffer_time_low:
+            self._set_buffer_time(buffer_time_low)
     # Movement commands
     def get_position(self):
         return list(self.commanded_pos)
@@ -521,8 +641,9 @@ class ToolHead:
         self.special_queuing_state = "Drip"
         self.need_check_pause = self.reactor.NEVER
         self.reactor.update_timer(self.flush_timer, self.reactor.NEVER)
+        self.flush_waketime = self.reactor.NEVER
         self.do_kick_flush_timer = False
-        self.lookahead.set_flush_time(BUFFER_TIME_HIGH)
+        self.lookahead.set_flush_time(self.buffer_time_high)
         self.check_stall_time = 0.
         self.drip_completion = drip_completion
         # Submit move
@@ -570,7 +691,11 @@ class ToolHead:
                      'max_velocity': self.max_velocity,
                      'max_accel': self.max_accel,
                      'minimum_cruise_ratio': self.min_cruise_ratio,
-                     'square_corner_velocity': self.square_corner_velocity})
+                     'square_corner_velocity': self.square_corner_velocity,
+                     'buffer_time_low': self.buffer_time_low,
+                     'buffer_time_high': self.buffer_time_high,
+                     'wakeup_jitter': self.wakeup_jitter,
+                     'flush_lateness': self.flush_lateness})
         return res
     def _handle_shutdown(self):
         self.can_pause = False
@@ -580,6 +705,12 @@ class ToolHead:
     def get_trapq(self):
         return self.trapq
     def register_step_generator(self, handler):
+        mcu_stepper = getattr(handler, '__self__', None)
+        if (self.steppool is not None
+            and isinstance(mcu_stepper, stepper.MCU_stepper)
+            and handler == mcu_stepper.generate_steps):
+            self.pool_steppers.append(mcu_stepper)
+            return
         self.step_generators.append(handler)
     def note_step_generation_scan_time(self, delay, old_delay=0.):
         self.flush_step_generation()
@@ -594,6 +725,8 @@ class ToolHead:
         if last_move is None:
             callback(self.get_last_move_time())
             return
+        if last_move.timing_callbacks is None:
+            last_move.timing_callbacks = []
         last_move.timing_callbacks.append(callback)
     def note_mcu_movequeue_activity(self, mq_time, set_step_gen_time=False):
         self.need_flush_time = max(self.need_flush_time, mq_time)
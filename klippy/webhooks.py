@@ -3,7 +3,7 @@
 # Copyright (C) 2020 Eric Callahan <arksine.code@gmail.com>
 #
 # This file may be distributed under the terms of the GNU GPLv3 license
-import logging, socket, os, sys, errno, json, collections
+import logging, socket, os, sys, errno, re, json, collections
 import gcode
 
 REQUEST_LOG_SIZE = 20
@@ -187,6 +187,7 @@ class ClientConnection:
         self.blocking_count = 0
         self.set_client_info("?", "New connection")
         self.request_log = collections.deque([], REQUEST_LOG_SIZE)
+        self.close_callbacks = []
 
     def dump_request_log(self):
         out = []
@@ -218,10 +219,20 @@ class ClientConnection:
         except socket.error:
             pass
         self.server.pop_client(self.uid)
+        callbacks = self.close_callbacks
+        self.close_callbacks = []
+        for cb in callbacks:
+            cb()
 
     def is_closed(self):
         return self.fd_handle is None
 
+    def register_close_callback(self, cb):
+        if self.is_closed():
+            cb()
+            return
+        self.close_callbacks.append(cb)
+
     def process_received(self, eventtime):
         try:
             data = self.sock.recv(4096)
@@ -414,6 +425,89 @@ class WebHooks:
                 "No active connections for method '%s'" % (method))
         self._remote_methods[method] = valid_conns
 
+STREAM_WINDOW = 1024
+STREAM_MAX_WINDOW = 16384
+STREAM_BATCH_SIZE = 64
+m112_r = re.compile(r'^(?:[nN][0-9]+)?\s*[mM]112(?:\s|$)')
+
+# State for a client feeding a continuous stream of g-code lines
+class GCodeStream:
+    def __init__(self, printer, gcode, cconn, template, window):
+        self.printer = printer
+        self.reactor = printer.get_reactor()
+        self.gcode = gcode
+        self.cconn = cconn
+        self.template = template
+        self.window = window
+        self.pending = collections.deque()
+        self.received = self.completed = 0
+        self.running = 0
+        self.is_processing = False
+        self.error = None
+    def get_credits(self):
+        # Credits are returned once a line has completed
+        return self.window - len(self.pending) - self.running
+    def get_state(self):
+        return {'received': self.received, 'completed': self.completed,
+                'credits': self.get_credits(), 'error': self.error}
+    def _send(self, params):
+        if self.cconn.is_closed():
+            return
+        tmp = dict(self.template)
+        tmp['params'] = params
+        self.cconn.send(tmp)
+    def add_lines(self, lines):
+        if self.error is not None:
+            raise WebRequestError("Stream halted due to error on line %d"
+                                  % (self.error['line'],))
+        if len(lines) > self.get_credits():
+            raise WebRequestError("Stream window exceeded (%d lines sent, %d"
+                                  " credits available)"
+                                  % (len(lines), self.get_credits()))
+        # Check for M112 out-of-order
+        for line in lines:
+            if m112_r.match(line) is not None:
+                self.gcode.cmd_M112(None)
+        self.pending.extend(lines)
+        self.received += len(lines)
+        if not self.is_processing and self.pending:
+            self.is_processing = True
+            self.reactor.register_callback(self._process_lines)
+    def cancel(self):
+        self.pending.clear()
+    def _halt(self, msg):
+        # Discard remaining lines and report the error
+        self.error = {'line': self.completed + 1, 'message': msg}
+        self.pending.clear()
+    def _process_lines(self, eventtime):
+        pending = self.pending
+        gcode_mutex = self.gcode.get_mutex()
+        while pending and not self.cconn.is_closed():
+            # Run a batch of lines while holding the g-code lock
+            with gcode_mutex:
+                for i in range(STREAM_BATCH_SIZE):
+                    if not pending:
+                        break
+                    line = pending.popleft()
+                    self.running = 1
+                    try:
+                        self.gcode.run_script_from_command(line)
+                    except self.gcode.error as e:
+                        self._halt(str(e))
+                        break
+                    except:
+                        logging.exception("webhooks: g-code stream dispatch")
+                        self._halt("Internal error")
+                        break
+                    finally:
+                        self.running = 0
+                    self.completed += 1
+                    if gcode_mutex.has_waiters():
+                        break
+            self._send(self.get_state())
+        pending.clear()
+        self.is_processing = False
+
 class GCodeHelper:
     def __init__(self, printer):
         self.printer = printer
@@ -421,6 +515,8 @@ class GCodeHelper:
         # Output subscription tracking
         self.is_output_registered = False
         self.clients = {}
+        # Line streams (one per client connection)
+        self.streams = {}
         # Register webhooks
         wh = printer.lookup_object('webhooks')
         wh.register_endpoint("gcode/help", self._handle_help)
@@ -430,6 +526,11 @@ class GCodeHelper:
                              self._handle_firmware_restart)
         wh.register_endpoint("gcode/subscribe_output",
                              self._handle_subscribe_output)
+        wh.register_endpoint("gcode/profile", self._handle_profile)
+        wh.register_endpoint("gcode/stream_start", self._handle_stream_start)
+        wh.register_endpoint("gcode/stream_lines", self._handle_stream_lines)
+        wh.register_endpoint("gcode/stream_cancel",
+                             self._handle_stream_cancel)
     def _handle_help(self, web_request):
         web_request.send(self.gcode.get_command_help())
     def _handle_script(self, web_request):
@@ -438,6 +539,18 @@ class GCodeHelper:
         self.gcode.run_script('restart')
     def _handle_firmware_restart(self, web_request):
         self.gcode.run_script('firmware_restart')
+    def _handle_profile(self, web_request):
+        enable = web_request.get('enable', None, types=(bool,))
+        reset = web_request.get('reset', False, types=(bool,))
+        if enable is not None or reset:
+            if enable is None:
+                enable = self.gcode.get_profiler() is not None
+            self.gcode.set_profile_enable(enable, reset)
+        profiler = self.gcode.get_profiler()
+        if profiler is None:
+            web_request.send({'enabled': False, 'commands': {}})
+            return
+        web_request.send({'enabled': True, 'commands': profiler.get_stats()})
     def _output_callback(self, msg):
         for cconn, template in list(self.clients.items()):
             if cconn.is_closed():
@@ -453,6 +566,42 @@ class GCodeHelper:
         if not self.is_output_registered:
             self.gcode.register_output_handler(self._output_callback)
             self.is_output_registered = True
+    def _get_stream(self, web_request):
+        cconn = web_request.get_client_connection()
+        stream = self.streams.get(cconn)
+        if stream is None:
+            raise web_request.error("No g-code stream started")
+        return stream
+    def _handle_stream_start(self, web_request):
+        cconn = web_request.get_client_connection()
+        template = web_request.get_dict('response_template', {})
+        window = web_request.get_int('window', STREAM_WINDOW)
+        if window < 1 or window > STREAM_MAX_WINDOW:
+            raise web_request.error("Invalid stream window %d" % (window,))
+        prev_stream = self.streams.get(cconn)
+        stream = GCodeStream(self.printer, self.gcode, cconn, template, window)
+        self.streams[cconn] = stream
+        if prev_stream is not None:
+            prev_stream.cancel()
+        else:
+            cconn.register_close_callback(
+                (lambda: self._handle_stream_close(cconn)))
+        web_request.send(stream.get_state())
+    def _handle_stream_close(self, cconn):
+        stream = self.streams.pop(cconn, None)
+        if stream is not None:
+            stream.cancel()
+    def _handle_stream_lines(self, web_request):
+        stream = self._get_stream(web_request)
+        lines = web_request.get_str('script').split('\n')
+        if not lines[-1]:
+            lines.pop()
+        stream.add_lines(lines)
+        web_request.send(stream.get_state())
+    def _handle_stream_cancel(self, web_request):
+        stream = self._get_stream(web_request)
+        stream.cancel()
+        web_request.send(stream.get_state())
 
 SUBSCRIPTION_REFRESH_TIME = .25
 
@@ -0,0 +1,125 @@
+#!/usr/bin/env python
+# Benchmark bed_mesh mesh building and z height lookups
+#
+# Copyright (C) 2026  agent <agent@local>
+#
+# This file may be distributed under the terms of the GNU GPLv3 license.
+import sys, os, optparse, math, random, time, collections
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)),
+                             '..', 'klippy'))
+from extras import bed_mesh
+
+MESH_MIN, MESH_MAX = 10., 240.
+MAX_ERROR = 1e-9
+
+def build_mesh(probe_count, pps, algo, use_numpy=True):
+    params = collections.OrderedDict([
+        ('min_x', MESH_MIN), ('max_x', MESH_MAX),
+        ('min_y', MESH_MIN), ('max_y', MESH_MAX),
+        ('x_count', probe_count), ('y_count', probe_count),
+        ('mesh_x_pps', pps), ('mesh_y_pps', pps),
+        ('algo', algo), ('tension', .2)])
+    # Synthetic warped bed with some probe noise
+    random.seed(0)
+    probed = [[.15 * math.sin(x * .9) + .1 * math.cos(y * 1.3)
+               + .0005 * x * y + random.uniform(-.03, .03)
+               for x in range(probe_count)]
+              for y in range(probe_count)]
+    z_mesh = bed_mesh.ZMesh(params, "bench")
+    # A None entry in sys.modules causes "import numpy" to fail
+    orig_numpy = sys.modules.get('numpy')
+    if not use_numpy:
+        sys.modules['numpy'] = None
+    try:
+        start_time = time.time()
+        z_mesh.build_mesh(probed)
+        build_time = time.time() - start_time
+    finally:
+        if orig_numpy is not None:
+            sys.modules['numpy'] = orig_numpy
+        elif not use_numpy:
+            del sys.modules['numpy']
+    return z_mesh, build_time
+
+def have_numpy():
+    try:
+        import numpy
+    except ImportError:
+        return False
+    return True
+
+# Per-point index search and bilinear interpolation (the lookup method
+# used prior to the per-cell coefficient tables)
+def reference_calc_z(z_mesh, x, y):
+    def get_index(coord, mesh_min, mesh_dist, mesh_cnt):
+        idx = int(math.floor((coord - mesh_min) / mesh_dist))
+        idx = bed_mesh.constrain(idx, 0, mesh_cnt - 2)
+        t = (coord - (mesh_min + mesh_dist * idx)) / mesh_dist
+        return bed_mesh.constrain(t, 0., 1.), idx
+    tbl = z_mesh.mesh_matrix
+    tx, xidx = get_index(x + z_mesh.mesh_offsets[0], z_mesh.mesh_x_min,
+                         z_mesh.mesh_x_dist, z_mesh.mesh_x_count)
+    ty, yidx = get_index(y + z_mesh.mesh_offsets[1], z_mesh.mesh_y_min,
+                         z_mesh.mesh_y_dist, z_mesh.mesh_y_count)
+    z0 = bed_mesh.lerp(tx, tbl[yidx][xidx], tbl[yidx][xidx+1])
+    z1 = bed_mesh.lerp(tx, tbl[yidx+1][xidx], tbl[yidx+1][xidx+1])
+    return bed_mesh.lerp(ty, z0, z1)
+
+def time_lookups(name, func, count):
+    start_time = time.time()
+    res = func()
+    run_time = time.time() - start_time
+    print("%-16s %8.3fs %8.0f ns/point" % (
+        name, run_time, run_time * 1000000000. / count))
+    return res, run_time
+
+def main():
+    usage = "%prog [options]"
+    opts = optparse.OptionParser(usage)
+    opts.add_option("-c", "--probe_count", type="int", dest="probe_count",
+                    default=8, help="number of probe points per axis")
+    opts.add_option("-p", "--pps", type="int", dest="pps", default=6,
+                    help="interpolated points per segment")
+    opts.add_option("-a", "--algorithm", type="choice", dest="algo",
+                    choices=["lagrange", "bicubic", "direct"],
+                    default="bicubic", help="interpolation algorithm")
+    opts.add_option("-n", "--points", type="int", dest="points",
+                    default=200000, help="number of z height lookups")
+    options, args = opts.parse_args()
+    if args:
+        opts.error("Incorrect number of arguments")
+    if options.probe_count < 3 or options.pps < 0:
+        opts.error("Invalid mesh size")
+    z_mesh, build_time = build_mesh(options.probe_count, options.pps,
+                                    options.algo, use_numpy=False)
+    print("Mesh %dx%d (%s) built in %.3fs" % (
+        z_mesh.mesh_x_count, z_mesh.mesh_y_count, options.algo, build_time))
+    if have_numpy():
+        np_mesh, np_time = build_mesh(options.probe_count, options.pps,
+                                      options.algo)
+        print("Mesh built with numpy in %.3fs (%.1fx)" % (
+            np_time, build_time / np_time))
+    # Lookups cover the mesh and the area just outside of it
+    random.seed(1)
+    span = MESH_MAX - MESH_MIN
+    points = [(random.uniform(MESH_MIN - .05 * span, MESH_MAX + .05 * span),
+               random.uniform(MESH_MIN - .05 * span, MESH_MAX + .05 * span))
+              for i in range(options.points)]
+    count = len(points)
+    ref, ref_time = time_lookups(
+        "reference", lambda: [reference_calc_z(z_mesh, x, y)
+                              for x, y in points], count)
+    res, calc_time = time_lookups(
+        "calc_z", lambda: [z_mesh.calc_z(x, y) for x, y in points], count)
+    many, many_time = time_lookups(
+        "calc_z_many", lambda: z_mesh.calc_z_many(points), count)
+    max_err = max([abs(r - z) for r, z in zip(ref, res)]
+                  + [abs(r - z) for r, z in zip(ref, many)])
+    print("Speedup: calc_z %.1fx, calc_z_many %.1fx (max difference %.3g)" % (
+        ref_time / calc_time, ref_time / many_time, max_err))
+    if max_err > MAX_ERROR:
+        sys.stderr.write("Error: lookup results do not match reference\n")
+        sys.exit(-1)
+
+if __name__ == '__main__':
+    main()
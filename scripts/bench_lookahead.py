@@ -0,0 +1,185 @@
+#!/usr/bin/env python
+# Benchmark the toolhead lookahead planner
+#
+# Copyright (C) 2026  agent <agent@local>
+#
+# This file may be distributed under the terms of the GNU GPLv3 license.
+import sys, os, optparse, math, time, re, gc
+sys.path.append(os.path.join(os.path.dirname(__file__), '../klippy'))
+import toolhead
+
+# Minimal toolhead that records planned moves instead of generating steps
+class DummyExtruder:
+    def calc_junction(self, prev_move, move):
+        return move.max_cruise_v2
+
+class BenchToolHead:
+    def __init__(self, options):
+        self.max_velocity = options.velocity
+        self.max_accel = options.accel
+        scv2 = options.scv**2
+        self.junction_deviation = scv2 * (math.sqrt(2.) - 1.) / self.max_accel
+        self.max_accel_to_decel = self.max_accel * (1. - options.cruise_ratio)
+        self.extruder = DummyExtruder()
+        self.lookahead = toolhead.LookAheadQueue(self)
+        self.lookahead.set_flush_time(toolhead.BUFFER_TIME_HIGH)
+        self.move_count = 0
+        self.checksum = 0.
+        self.print_time = 0.
+    def _process_moves(self, moves):
+        for move in moves:
+            self.checksum += move.start_v + move.cruise_v + move.end_v
+            self.print_time += move.accel_t + move.cruise_t + move.decel_t
+        self.move_count += len(moves)
+    def plan(self, moves):
+        for move in moves:
+            self.lookahead.add_move(move)
+        self.lookahead.flush()
+
+
+######################################################################
+# Move generation
+######################################################################
+
+# Generate a series of arcs made of small line segments
+def gen_arcs(count, base_radius, segment_length, speed):
+    pos = [0., 0., 0.2, 0.]
+    moves = []
+    for i in range(count):
+        radius = base_radius + (i % 10)
+        center = (pos[0] + radius, pos[1])
+        seg_count = max(1, int(2. * math.pi * radius / segment_length))
+        for s in range(1, seg_count + 1):
+            angle = math.pi + 2. * math.pi * s / seg_count
+            newpos = [center[0] + radius * math.cos(angle),
+                      center[1] + radius * math.sin(angle), pos[2],
+                      pos[3] + segment_length * .05]
+            moves.append((pos, newpos, speed))
+            pos = newpos
+        # Travel to the next arc
+        newpos = [pos[0] + 1., pos[1] + 1., pos[2], pos[3]]
+        moves.append((pos, newpos, speed * 2.))
+        pos = newpos
+    return moves
+
+args_r = re.compile('([A-Z])([-+]?[0-9.]+)')
+
+# Load G0-G3 moves from a g-code file (arcs are split into segments)
+def load_gcode(filename, segment_length):
+    pos = [0., 0., 0., 0.]
+    speed = 25.
+    absolute = absolute_e = True
+    moves = []
+    for line in open(filename, 'r'):
+        line = line.split(';', 1)[0].strip().upper()
+        if not line:
+            continue
+        parts = line.split(None, 1)
+        cmd = parts[0]
+        params = dict(args_r.findall(line[len(cmd):]))
+        if cmd in ('G90', 'G91'):
+            absolute = cmd == 'G90'
+            continue
+        if cmd in ('M82', 'M83'):
+            absolute_e = cmd == 'M82'
+            continue
+        if cmd == 'G92':
+            for i, a in enumerate('XYZE'):
+                if a in params:
+                    pos[i] = float(params[a])
+            continue
+        if cmd not in ('G0', 'G1', 'G2', 'G3'):
+            continue
+        if 'F' in params:
+            speed = float(params['F']) / 60.
+        newpos = list(pos)
+        for i, a in enumerate('XYZE'):
+            if a in params:
+                v = float(params[a])
+                if absolute and (a != 'E' or absolute_e):
+                    newpos[i] = v
+                else:
+                    newpos[i] += v
+        if cmd in ('G0', 'G1'):
+            moves.append((pos, newpos, speed))
+            pos = newpos
+            continue
+        # Arc move (only I/J center format is supported)
+        cx = pos[0] + float(params.get('I', 0.))
+        cy = pos[1] + float(params.get('J', 0.))
+        radius = math.hypot(pos[0] - cx, pos[1] - cy)
+        start_a = math.atan2(pos[1] - cy, pos[0] - cx)
+        end_a = math.atan2(newpos[1] - cy, newpos[0] - cx)
+        if cmd == 'G2':
+            if end_a >= start_a:
+                end_a -= 2. * math.pi
+        elif end_a <= start_a:
+            end_a += 2. * math.pi
+        seg_count = max(1, int(abs(end_a - start_a) * radius / segment_length))
+        for s in range(1, seg_count + 1):
+            r = float(s) / seg_count
+            a = start_a + (end_a - start_a) * r
+            segpos = [cx + radius * math.cos(a), cy + radius * math.sin(a),
+                      pos[2] + (newpos[2] - pos[2]) * r,
+                      pos[3] + (newpos[3] - pos[3]) * r]
+            moves.append((pos, segpos, speed))
+            pos = segpos
+        pos = newpos
+    return moves
+
+
+######################################################################
+# Startup
+######################################################################
+
+def main():
+    usage = "%prog [options] [gcode_file]"
+    opts = optparse.OptionParser(usage)
+    opts.add_option("-a", "--accel", type="float", dest="accel",
+                    default=3000., help="maximum acceleration")
+    opts.add_option("-v", "--velocity", type="float", dest="velocity",
+                    default=300., help="maximum velocity")
+    opts.add_option("-s", "--scv", type="float", dest="scv",
+                    default=5., help="square corner velocity")
+    opts.add_option("-r", "--cruise_ratio", type="float", dest="cruise_ratio",
+                    default=.5, help="minimum cruise ratio")
+    opts.add_option("-l", "--segment", type="float", dest="segment",
+                    default=.1, help="arc segment length")
+    opts.add_option("-f", "--speed", type="float", dest="speed",
+                    default=100., help="speed of generated arc moves")
+    opts.add_option("-R", "--radius", type="float", dest="radius",
+                    default=2., help="minimum radius of generated arcs")
+    opts.add_option("-c", "--count", type="int", dest="count",
+                    default=2000, help="number of generated arcs")
+    options, args = opts.parse_args()
+    if len(args) > 1:
+        opts.error("Incorrect number of arguments")
+    if args:
+        moves = load_gcode(args[0], options.segment)
+    else:
+        moves = gen_arcs(options.count, options.radius, options.segment,
+                         options.speed)
+    th = BenchToolHead(options)
+    # Create Move objects (tracking new garbage collector objects)
+    gc.collect()
+    gc.disable()
+    gc_count = gc.get_count()[0]
+    starttime = time.time()
+    moves = [toolhead.Move(th, start_pos, end_pos, speed)
+             for start_pos, end_pos, speed in moves]
+    duration = time.time() - starttime
+    gc_count = gc.get_count()[0] - gc_count
+    gc.enable()
+    print("Created %d moves in %.3f seconds (%.2f gc objects per move)"
+          % (len(moves), duration, float(gc_count) / len(moves)))
+    # Plan moves
+    starttime = time.time()
+    th.plan(moves)
+    duration = time.time() - starttime
+    print("Planned %d moves in %.3f seconds (%.0f moves/sec)"
+          % (th.move_count, duration, th.move_count / duration))
+    print("Total move time %.6f, velocity checksum %.6f"
+          % (th.print_time, th.checksum))
+
+if __name__ == '__main__':
+    main()
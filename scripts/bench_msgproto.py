@@ -0,0 +1,135 @@
+#!/usr/bin/env python
+# Benchmark encoding and decoding of mcu protocol messages
+#
+# Copyright (C) 2026  agent <agent@local>
+#
+# This file may be distributed under the terms of the GNU GPLv3 license.
+import sys, os, optparse, json, random, time
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)),
+                             '..', 'klippy'))
+import msgproto
+
+# Subset of a typical data dictionary
+COMMANDS = {
+    "stepper_get_position oid=%c": 10,
+    "queue_step oid=%c interval=%u count=%hu add=%hi": 11,
+    "set_next_step_dir oid=%c dir=%c": 12,
+}
+RESPONSES = {
+    "stepper_position oid=%c pos=%i": 80,
+    "sensor_bulk_data oid=%c sequence=%hu data=%*s": 81,
+}
+BULK_DATA_SIZE = 48
+
+def build_parser():
+    data = {'commands': COMMANDS, 'responses': RESPONSES,
+            'enumerations': {}, 'config': {}}
+    mp = msgproto.MessageParser()
+    mp.process_identify(json.dumps(data).encode(), decompress=False)
+    return mp
+
+# Reference codec that processes each parameter with its type's methods
+def build_generic_codec(msgid_bytes, param_names):
+    def encode(params):
+        out = list(msgid_bytes)
+        for i, (name, t) in enumerate(param_names):
+            t.encode(out, params[i])
+        return out
+    def parse(s, pos):
+        pos += len(msgid_bytes)
+        out = {}
+        for name, t in param_names:
+            v, pos = t.parse(s, pos)
+            out[name] = v
+        return out, pos
+    return encode, parse
+
+def use_generic_codec(mp):
+    # Replace the generated codec of each message with the reference one
+    for msg in mp.messages_by_name.values():
+        msg.encode, msg.parse = build_generic_codec(msg.msgid_bytes,
+                                                    msg.param_names)
+
+def build_msgblock(seq, cmd):
+    msglen = msgproto.MESSAGE_MIN + len(cmd)
+    seq = (seq & msgproto.MESSAGE_SEQ_MASK) | msgproto.MESSAGE_DEST
+    out = [msglen, seq] + cmd
+    out.extend(msgproto.crc16_ccitt(out))
+    out.append(msgproto.MESSAGE_SYNC)
+    return bytearray(out)
+
+# Build a list of message blocks of the given message type
+def build_packets(mp, name, count):
+    random.seed(0)
+    mf = mp.messages_by_name[name]
+    packets = []
+    for i in range(count):
+        if name == 'stepper_position':
+            params = [i % 8, random.randint(-2000000, 2000000)]
+        else:
+            params = [i % 4, i & 0xffff,
+                      bytes(bytearray([random.randrange(256)
+                                       for j in range(BULK_DATA_SIZE)]))]
+        packets.append(build_msgblock(i, mf.encode(params)))
+    return packets
+
+def build_commands(count):
+    random.seed(1)
+    cmds = []
+    for i in range(count):
+        if i % 8 == 0:
+            cmds.append(('stepper_get_position', [i % 8]))
+        elif i % 8 == 1:
+            cmds.append(('set_next_step_dir', [i % 8, i & 1]))
+        else:
+            cmds.append(('queue_step', [i % 8, random.randint(100, 200000),
+                                        random.randint(1, 500),
+                                        random.randint(-100, 100)]))
+    return cmds
+
+def bench_decode(mp, packets):
+    parse = mp.parse
+    start_time = time.time()
+    for packet in packets:
+        parse(packet)
+    return len(packets) / (time.time() - start_time)
+
+def bench_encode(mp, cmds):
+    # Encode each message once so that its codec is built
+    for name, params in cmds:
+        mp.messages_by_name[name].encode(params)
+    cmds = [(mp.messages_by_name[name].encode, params)
+            for name, params in cmds]
+    start_time = time.time()
+    for encode, params in cmds:
+        encode(params)
+    return len(cmds) / (time.time() - start_time)
+
+def run_tests(mp, count):
+    results = []
+    for name in ['stepper_position', 'sensor_bulk_data']:
+        packets = build_packets(mp, name, count)
+        results.append(("decode %s" % (name,), bench_decode(mp, packets)))
+    cmds = build_commands(count)
+    results.append(("encode commands", bench_encode(mp, cmds)))
+    return results
+
+def main():
+    usage = "%prog [options]"
+    opts = optparse.OptionParser(usage)
+    opts.add_option("-n", "--count", type="int", dest="count",
+                    default=200000, help="number of messages per test")
+    options, args = opts.parse_args()
+    if args:
+        opts.error("Incorrect number of arguments")
+    fast = run_tests(build_parser(), options.count)
+    mp = build_parser()
+    use_generic_codec(mp)
+    generic = run_tests(mp, options.count)
+    print("%-26s %14s %14s" % ("test", "generic msg/s", "msg/s"))
+    for (name, rate), (gname, grate) in zip(fast, generic):
+        print("%-26s %14.0f %14.0f (%.1fx)" % (name, grate, rate,
+                                               rate / grate))
+
+if __name__ == '__main__':
+    main()
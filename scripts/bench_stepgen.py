@@ -0,0 +1,414 @@
+#!/usr/bin/env python
+# Benchmark host step generation and step compression
+#
+# Copyright (C) 2026  agent <agent@local>
+#
+# This file may be distributed under the terms of the GNU GPLv3 license.
+import sys, os, optparse, math, time
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)),
+                             '..', 'klippy'))
+import chelper, toolhead
+from extras import shaper_defs
+
+MCU_FREQ = 16000000.
+MAX_ERROR = .000025
+FLUSH_INTERVAL = .050
+MOVE_QUEUE = 500
+HISTORY_MAX = 4096
+CENTER_X, CENTER_Y = 60., 0.
+START_TIME = 2.
+
+
+######################################################################
+# Kinematics definitions
+######################################################################
+
+# Each kinematics returns a list of (name, stepper_kinematics, step_dist)
+def kin_cartesian(ffi_lib):
+    return [('x', ffi_lib.cartesian_stepper_alloc(b'x'), .0125),
+            ('y', ffi_lib.cartesian_stepper_alloc(b'y'), .0125),
+            ('z', ffi_lib.cartesian_stepper_alloc(b'z'), .0025)]
+
+def kin_corexy(ffi_lib):
+    return [('a', ffi_lib.corexy_stepper_alloc(b'+'), .0125),
+            ('b', ffi_lib.corexy_stepper_alloc(b'-'), .0125),
+            ('z', ffi_lib.cartesian_stepper_alloc(b'z'), .0025)]
+
+def kin_corexz(ffi_lib):
+    return [('a', ffi_lib.corexz_stepper_alloc(b'+'), .0125),
+            ('b', ffi_lib.corexz_stepper_alloc(b'-'), .0125),
+            ('y', ffi_lib.cartesian_stepper_alloc(b'y'), .0125)]
+
+def kin_delta(ffi_lib):
+    arm2, radius = 250.**2, 140.
+    out = []
+    for name, angle in [('a', 210.), ('b', 330.), ('c', 90.)]:
+        a = math.radians(angle)
+        sk = ffi_lib.delta_stepper_alloc(arm2, math.cos(a) * radius,
+                                         math.sin(a) * radius)
+        out.append((name, sk, .01))
+    return out
+
+def kin_polar(ffi_lib):
+    return [('bed', ffi_lib.polar_stepper_alloc(b'a'), math.pi / 3200.),
+            ('arm', ffi_lib.polar_stepper_alloc(b'r'), .0125),
+            ('z', ffi_lib.cartesian_stepper_alloc(b'z'), .0025)]
+
+def kin_winch(ffi_lib):
+    anchors = [(-200., -200., 300.), (200., -200., 300.), (0., 200., 300.),
+               (0., 0., 400.)]
+    return [('winch%d' % (i,), ffi_lib.winch_stepper_alloc(*a), .01)
+            for i, a in enumerate(anchors)]
+
+KINEMATICS = {
+    'cartesian': kin_cartesian, 'corexy': kin_corexy, 'corexz': kin_corexz,
+    'delta': kin_delta, 'polar': kin_polar, 'winch': kin_winch,
+}
+
+
+######################################################################
+# Workload generation
+######################################################################
+
+# Each workload returns a list of (start_pos, end_pos, speed) moves
+
+# Outward spiral made of short line segments
+def gen_spiral(scale):
+    pos = [CENTER_X + 1., CENTER_Y, .2, 0.]
+    moves = []
+    segment = .5
+    angle, radius = 0., 1.
+    while len(moves) < 20000 * scale:
+        angle += segment / radius
+        radius = min(1. + angle * .4 / (2. * math.pi), 40.)
+        newpos = [CENTER_X + radius * math.cos(angle),
+                  CENTER_Y + radius * math.sin(angle), pos[2],
+                  pos[3] + segment * .05]
+        moves.append((pos, newpos, 150.))
+        pos = newpos
+    return moves
+
+# Small arcs made of tiny line segments
+def gen_arcs(scale):
+    pos = [CENTER_X - 20., CENTER_Y, .2, 0.]
+    moves = []
+    segment = .05
+    while len(moves) < 20000 * scale:
+        radius = 2. + (len(moves) % 7)
+        cx, cy = pos[0] + radius, pos[1]
+        seg_count = max(1, int(2. * math.pi * radius / segment))
+        for s in range(1, seg_count + 1):
+            angle = math.pi + 2. * math.pi * s / seg_count
+            newpos = [cx + radius * math.cos(angle),
+                      cy + radius * math.sin(angle), pos[2],
+                      pos[3] + segment * .05]
+            moves.append((pos, newpos, 100.))
+            pos = newpos
+        # Travel to the start of the next arc
+        newpos = [pos[0] + .5, pos[1] + .5, pos[2], pos[3]]
+        if newpos[0] > CENTER_X + 20.:
+            newpos[0] = CENTER_X - 20.
+            newpos[1] = CENTER_Y
+        moves.append((pos, newpos, 200.))
+        pos = newpos
+    return moves
+
+# Back and forth infill style moves
+def gen_zigzag(scale):
+    pos = [CENTER_X - 20., CENTER_Y - 20., .2, 0.]
+    moves = []
+    direction = 1.
+    while len(moves) < 20000 * scale:
+        newpos = [pos[0] + 40. * direction, pos[1], pos[2], pos[3] + 2.]
+        moves.append((pos, newpos, 300.))
+        pos = newpos
+        direction = -direction
+        newpos = [pos[0], pos[1] + .4, pos[2], pos[3] + .02]
+        if newpos[1] > CENTER_Y + 20.:
+            newpos = [pos[0], CENTER_Y - 20., pos[2] + .2, pos[3]]
+        moves.append((pos, newpos, 300.))
+        pos = newpos
+    return moves
+
+WORKLOADS = {'spiral': gen_spiral, 'arcs': gen_arcs, 'zigzag': gen_zigzag}
+
+
+######################################################################
+# Step generation benchmark
+######################################################################
+
+# Minimal toolhead that queues planned moves into trapq objects
+class DummyExtruder:
+    def calc_junction(self, prev_move, move):
+        return move.max_cruise_v2
+
+class BenchToolHead:
+    def __init__(self, options, ffi_main, ffi_lib):
+        self.max_velocity = options.velocity
+        self.max_accel = options.accel
+        scv2 = options.scv**2
+        self.junction_deviation = scv2 * (math.sqrt(2.) - 1.) / self.max_accel
+        self.max_accel_to_decel = self.max_accel * .5
+        self.extruder = DummyExtruder()
+        self.lookahead = toolhead.LookAheadQueue(self)
+        self.lookahead.set_flush_time(toolhead.BUFFER_TIME_HIGH)
+        self.trapq = ffi_main.gc(ffi_lib.trapq_alloc(), ffi_lib.trapq_free)
+        self.extruder_trapq = ffi_main.gc(ffi_lib.trapq_alloc(),
+                                          ffi_lib.trapq_free)
+        self.trapq_append = ffi_lib.trapq_append
+        self.trapq_set_position = ffi_lib.trapq_set_position
+        self.print_time = START_TIME
+    def _process_moves(self, moves):
+        for move in moves:
+            if move.is_kinematic_move:
+                self.trapq_append(
+                    self.trapq, self.print_time,
+                    move.accel_t, move.cruise_t, move.decel_t,
+                    move.start_pos[0], move.start_pos[1], move.start_pos[2],
+                    move.axes_r[0], move.axes_r[1], move.axes_r[2],
+                    move.start_v, move.cruise_v, move.accel)
+            axis_r = move.axes_r[3]
+            if axis_r:
+                can_pa = 0.
+                if axis_r > 0. and (move.axes_d[0] or move.axes_d[1]):
+                    can_pa = 1.
+                self.trapq_append(
+                    self.extruder_trapq, self.print_time,
+                    move.accel_t, move.cruise_t, move.decel_t,
+                    move.start_pos[3], 0., 0., 1., can_pa, 0.,
+                    move.start_v * axis_r, move.cruise_v * axis_r,
+                    move.accel * axis_r)
+            self.print_time += move.accel_t + move.cruise_t + move.decel_t
+    def plan(self, moves):
+        start_pos = moves[0][0]
+        self.trapq_set_position(self.trapq, 0., start_pos[0], start_pos[1],
+                                start_pos[2])
+        self.trapq_set_position(self.extruder_trapq, 0., start_pos[3], 0., 0.)
+        for start_pos, end_pos, speed in moves:
+            self.lookahead.add_move(toolhead.Move(self, start_pos, end_pos,
+                                                  speed))
+        self.lookahead.flush()
+
+class StepGenBench:
+    def __init__(self, options, kin_name):
+        self.ffi_main, self.ffi_lib = ffi_main, ffi_lib = chelper.get_ffi()
+        self.options = options
+        self.kin_name = kin_name
+        # Setup host to mcu message queue (output is discarded)
+        self.devnull = open(os.devnull, 'wb')
+        self.serialqueue = ffi_lib.serialqueue_alloc(self.devnull.fileno(),
+                                                     b'f', 0)
+        ffi_lib.serialqueue_set_clock_est(self.serialqueue, 1000000000000.,
+                                          ffi_lib.get_monotonic(), 0, 0)
+        # Setup steppers
+        self.steppers = []
+        self.step_gen_window = 0.
+        for name, sk, step_dist in KINEMATICS[kin_name](ffi_lib):
+            self.steppers.append((name, self._setup_shaper(sk), step_dist))
+        if options.pressure_advance is not None:
+            sk = ffi_lib.extruder_stepper_alloc()
+            smooth_time = .040
+            ffi_lib.extruder_set_pressure_advance(
+                sk, 0., options.pressure_advance, smooth_time)
+            self.step_gen_window = max(self.step_gen_window, smooth_time * .5)
+            self.steppers.append(('extruder', sk, .002))
+        self.stepqueues = []
+        for i, (name, sk, step_dist) in enumerate(self.steppers):
+            sc = ffi_main.gc(ffi_lib.stepcompress_alloc(i),
+                             ffi_lib.stepcompress_free)
+            ffi_lib.stepcompress_fill(sc, int(MAX_ERROR * MCU_FREQ), 1, 2)
+            ffi_lib.stepcompress_set_high_ratio(sc, options.high_ratio)
+            ffi_lib.itersolve_set_stepcompress(sk, sc, step_dist)
+            self.stepqueues.append(sc)
+        self.steppersync = ffi_main.gc(
+            ffi_lib.steppersync_alloc(self.serialqueue, self.stepqueues,
+                                      len(self.stepqueues), MOVE_QUEUE),
+            ffi_lib.steppersync_free)
+        ffi_lib.steppersync_set_time(self.steppersync, 0., MCU_FREQ)
+        self.history = ffi_main.new('struct pull_history_steps[]',
+                                    HISTORY_MAX)
+    def _setup_shaper(self, sk):
+        options = self.options
+        ffi_main, ffi_lib = self.ffi_main, self.ffi_lib
+        if options.shaper is None:
+            return sk
+        if not (ffi_lib.itersolve_is_active_axis(sk, b'x')
+                or ffi_lib.itersolve_is_active_axis(sk, b'y')):
+            return sk
+        is_sk = ffi_main.gc(ffi_lib.input_shaper_alloc(), ffi_lib.free)
+        if ffi_lib.input_shaper_set_sk(is_sk, sk) < 0:
+            return sk
+        shapers = {s.name: s.init_func for s in shaper_defs.INPUT_SHAPERS}
+        A, T = shapers[options.shaper](options.shaper_freq, .1)
+        for axis in 'xy':
+            ffi_lib.input_shaper_set_shaper_params(is_sk, axis.encode(),
+                                                   len(A), A, T)
+        window = ffi_lib.input_shaper_get_step_generation_window(is_sk)
+        self.step_gen_window = max(self.step_gen_window, window)
+        return is_sk
+    def _count_steps(self):
+        # Count queue_step messages created since the last flush
+        ffi_lib = self.ffi_lib
+        msgs = steps = 0
+        for i, sc in enumerate(self.stepqueues):
+            last_first_clock = self.last_first_clocks[i]
+            count = ffi_lib.stepcompress_extract_old(
+                sc, self.history, HISTORY_MAX, max(0, last_first_clock),
+                1<<62)
+            if count >= HISTORY_MAX:
+                raise Exception("Too many queue_step messages in flush")
+            for j in range(count):
+                hs = self.history[j]
+                if hs.first_clock <= last_first_clock:
+                    break
+                msgs += 1
+                steps += abs(hs.step_count)
+            if count:
+                self.last_first_clocks[i] = max(
+                    last_first_clock, self.history[0].first_clock)
+        return msgs, steps
+    def run(self, moves):
+        ffi_lib = self.ffi_lib
+        th = BenchToolHead(self.options, self.ffi_main, ffi_lib)
+        th.plan(moves)
+        start_pos = moves[0][0]
+        for name, sk, step_dist in self.steppers:
+            if name == 'extruder':
+                ffi_lib.itersolve_set_trapq(sk, th.extruder_trapq)
+                ffi_lib.itersolve_set_position(sk, start_pos[3], 0., 0.)
+            else:
+                ffi_lib.itersolve_set_trapq(sk, th.trapq)
+                ffi_lib.itersolve_set_position(sk, start_pos[0],
+                                               start_pos[1], start_pos[2])
+        generate_steps = ffi_lib.itersolve_generate_steps
+        steppersync_flush = ffi_lib.steppersync_flush
+        sks = [sk for name, sk, step_dist in self.steppers]
+        end_time = th.print_time + self.step_gen_window
+        gen_time = flush_time = 0.
+        total_msgs = total_steps = 0
+        self.last_first_clocks = [-1] * len(self.stepqueues)
+        cur_time = START_TIME
+        cpu_start = sum(os.times()[:2])
+        while cur_time < end_time:
+            cur_time = min(cur_time + FLUSH_INTERVAL, end_time)
+            # Generate steps
+            t1 = time.time()
+            for sk in sks:
+                if generate_steps(sk, cur_time):
+                    raise Exception("Internal error in stepcompress")
+            # Compress steps and transmit queue_step messages
+            t2 = time.time()
+            clock = int(cur_time * MCU_FREQ)
+            if steppersync_flush(self.steppersync, clock,
+                                 max(0, clock - int(MCU_FREQ))):
+                raise Exception("Internal error in stepcompress")
+            t3 = time.time()
+            gen_time += t2 - t1
+            flush_time += t3 - t2
+            msgs, steps = self._count_steps()
+            total_msgs += msgs
+            total_steps += steps
+            free_time = cur_time - self.step_gen_window
+            ffi_lib.trapq_finalize_moves(th.trapq, free_time, free_time)
+            ffi_lib.trapq_finalize_moves(th.extruder_trapq, free_time,
+                                         free_time)
+        cpu_time = sum(os.times()[:2]) - cpu_start
+        return (th.print_time, total_steps, total_msgs,
+                gen_time, flush_time, cpu_time, self._get_bytes_write())
+    def _get_bytes_write(self):
+        # Wait for the serialqueue to transmit all pending messages
+        ffi_main, ffi_lib = self.ffi_main, self.ffi_lib
+        sbuf = ffi_main.new('char[4096]')
+        for i in range(100):
+            ffi_lib.serialqueue_get_stats(self.serialqueue, sbuf, len(sbuf))
+            stats = dict([s.split('=', 1) for s in
+                          ffi_main.string(sbuf).decode().split()])
+            if stats['ready_bytes'] == stats['upcoming_bytes'] == '0':
+                break
+            time.sleep(.010)
+        return int(stats['bytes_write'])
+    def close(self):
+        self.ffi_lib.serialqueue_exit(self.serialqueue)
+        self.ffi_lib.serialqueue_free(self.serialqueue)
+        self.devnull.close()
+
+
+######################################################################
+# Startup
+######################################################################
+
+def parse_list(value, choices, desc):
+    if value == 'all':
+        return sorted(choices)
+    names = value.split(',')
+    for name in names:
+        if name not in choices:
+            raise optparse.OptionValueError("Unknown %s '%s'" % (desc, name))
+    return names
+
+def main():
+    usage = "%prog [options]"
+    opts = optparse.OptionParser(usage)
+    opts.add_option("-k", "--kinematics", type="string", dest="kinematics",
+                    default="cartesian",
+                    help="comma separated kinematics to test (or 'all')")
+    opts.add_option("-w", "--workload", type="string", dest="workload",
+                    default="all",
+                    help="comma separated workloads to test (or 'all')")
+    opts.add_option("-n", "--scale", type="float", dest="scale",
+                    default=1., help="workload size multiplier")
+    opts.add_option("-a", "--accel", type="float", dest="accel",
+                    default=10000., help="maximum acceleration")
+    opts.add_option("-v", "--velocity", type="float", dest="velocity",
+                    default=300., help="maximum velocity")
+    opts.add_option("-s", "--scv", type="float", dest="scv",
+                    default=5., help="square corner velocity")
+    opts.add_option("-i", "--shaper", type="string", dest="shaper",
+                    default=None, help="input shaper type (eg, mzv)")
+    opts.add_option("-f", "--shaper_freq", type="float", dest="shaper_freq",
+                    default=50., help="input shaper frequency")
+    opts.add_option("-p", "--pressure_advance", type="float",
+                    dest="pressure_advance", default=None,
+                    help="add extruder stepper with given pressure advance")
+    opts.add_option("-r", "--high_ratio", action="store_true",
+                    dest="high_ratio", default=False,
+                    help="use high_ratio step compression")
+    options, args = opts.parse_args()
+    if args:
+        opts.error("Incorrect number of arguments")
+    try:
+        kin_names = parse_list(options.kinematics, KINEMATICS, "kinematics")
+        workloads = parse_list(options.workload, WORKLOADS, "workload")
+    except optparse.OptionValueError as e:
+        opts.error(str(e))
+    if options.shaper is not None:
+        shapers = [s.name for s in shaper_defs.INPUT_SHAPERS]
+        if options.shaper not in shapers:
+            opts.error("Unknown shaper '%s'" % (options.shaper,))
+    chelper.get_ffi()
+    for workload in workloads:
+        moves = WORKLOADS[workload](options.scale)
+        for kin_name in kin_names:
+            bench = StepGenBench(options, kin_name)
+            try:
+                res = bench.run(moves)
+            finally:
+                bench.close()
+            (print_time, steps, msgs, gen_time, flush_time, cpu_time,
+             bytes_write) = res
+            print_time -= START_TIME
+            step_time = gen_time + flush_time
+            print("%s %s: %d moves, %.3fs print time, %d steps,"
+                  " %d queue_step" % (kin_name, workload, len(moves),
+                                      print_time, steps, msgs))
+            print("  generate %.3fs, compress %.3fs, total cpu %.3fs"
+                  % (gen_time, flush_time, cpu_time))
+            print("  %.0f steps/sec, %.1f ns/step, %.0f queue_step/sec"
+                  " (%.0f queue_step per second of print time)"
+                  % (steps / step_time, step_time * 1000000000. / max(steps, 1),
+                     msgs / step_time, msgs / print_time))
+            print("  %d bytes sent (%.0f bytes per second of print time)"
+                  % (bytes_write, bytes_write / print_time))
+
+if __name__ == '__main__':
+    main()
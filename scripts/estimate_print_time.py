@@ -0,0 +1,285 @@
+#!/usr/bin/env python
+# Estimate the motion time of a gcode file using the klippy planner
+#
+# Copyright (C) 2026  agent <agent@local>
+#
+# This file may be distributed under the terms of the GNU GPLv3 license.
+import sys, os, io, optparse, logging, json, re, time
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)),
+                             '..', 'klippy'))
+import klippy, reactor, configfile, pins, toolhead
+from extras import homing
+
+# Config sections (in addition to the printer, kinematics, and extruder
+# sections) that are loaded by the estimator.  Other sections do not
+# alter the toolhead motion and their commands are ignored.
+LOAD_SECTIONS = [
+    "gcode_macro", "gcode_arcs", "firmware_retraction", "extruder_stepper",
+    "heater_bed", "heater_generic", "exclude_object", "respond",
+]
+PROBE_SECTIONS = ["probe", "bltouch", "smart_effector"]
+INPUT_CHUNK = 1024
+
+# Recognized slicer layer change markers
+layer_r = re.compile(r'^\s*(?:;\s*LAYER\s*:\s*(?P<num>-?\d+)'
+                     r'|;\s*LAYER_CHANGE'
+                     r'|;\s*layer\s+(?P<s3d>\d+)'
+                     r'|SET_PRINT_STATS_INFO\s.*CURRENT_LAYER=(?P<psi>\d+))',
+                     re.IGNORECASE)
+
+
+######################################################################
+# Placeholder micro-controller
+######################################################################
+
+# Pin object that accepts (and ignores) output and endstop setup
+class EstimatorPin:
+    def __init__(self, mcu, pin_params):
+        self._mcu = mcu
+        self._steppers = []
+    def get_mcu(self):
+        return self._mcu
+    def setup_max_duration(self, max_duration):
+        pass
+    def setup_start_value(self, start_value, shutdown_value):
+        pass
+    def setup_cycle_time(self, cycle_time, hardware_pwm=False):
+        pass
+    def set_digital(self, print_time, value):
+        pass
+    def set_pwm(self, print_time, value):
+        pass
+    def add_stepper(self, stepper):
+        self._steppers.append(stepper)
+    def get_steppers(self):
+        return list(self._steppers)
+
+# Probe "virtual endstop" that reports the probe z_offset
+class EstimatorProbePin(EstimatorPin):
+    def __init__(self, mcu, pin_params, z_offset):
+        EstimatorPin.__init__(self, mcu, pin_params)
+        self._z_offset = z_offset
+    def get_position_endstop(self):
+        return self._z_offset
+
+# Stand-in for mcu.MCU - all step and command output is discarded
+class EstimatorMCU:
+    def __init__(self, printer, name, z_offset=None):
+        self._printer = printer
+        self._name = name
+        self._z_offset = z_offset
+        self._oid_count = 0
+    def get_printer(self):
+        return self._printer
+    def get_name(self):
+        return self._name
+    def is_fileoutput(self):
+        return True
+    def get_constants(self):
+        return {}
+    def create_oid(self):
+        self._oid_count += 1
+        return self._oid_count - 1
+    def register_config_callback(self, cb):
+        pass
+    def register_stepqueue(self, stepqueue):
+        pass
+    def add_config_cmd(self, cmd, is_init=False, on_restart=False):
+        pass
+    def setup_pin(self, pin_type, pin_params):
+        if self._z_offset is not None:
+            return EstimatorProbePin(self, pin_params, self._z_offset)
+        return EstimatorPin(self, pin_params)
+    def estimated_print_time(self, eventtime):
+        return 0.
+    def flush_moves(self, print_time, clear_history_time):
+        pass
+    def check_active(self, print_time, eventtime):
+        pass
+    def stats(self, eventtime):
+        return False, ""
+
+# Placeholder temperature sensor (heaters are assumed to be at target)
+class EstimatorSensor:
+    def __init__(self, config):
+        config.get('sensor_type', None)
+    def setup_minmax(self, min_temp, max_temp):
+        pass
+    def setup_callback(self, temperature_callback):
+        pass
+    def get_report_time_delta(self):
+        return 1.
+
+
+######################################################################
+# Printer setup
+######################################################################
+
+# Homing helper that moves directly to the homed position
+class EstimatorHoming(homing.Homing):
+    def home_rails(self, rails, forcepos, movepos):
+        homing_axes = [axis for axis in range(3) if forcepos[axis] is not None]
+        self.toolhead.set_position(self._fill_coord(movepos),
+                                   homing_axes=homing_axes)
+
+class EstimatorPrinter(klippy.Printer):
+    def _setup_chips(self, config):
+        ppins = self.lookup_object('pins')
+        mcu_names = ['mcu'] + [s.get_name()
+                               for s in config.get_prefix_sections('mcu ')]
+        for name in mcu_names:
+            chip = EstimatorMCU(self, name)
+            self.add_object(name, chip)
+            ppins.register_chip(name.split()[-1], chip)
+        # Endstop pins may reference probes and stepper drivers
+        z_offset = 0.
+        for sname in PROBE_SECTIONS:
+            if config.has_section(sname):
+                z_offset = config.getsection(sname).getfloat('z_offset', 0.)
+                break
+        for s in config.get_prefix_sections(''):
+            pin = s.get('endstop_pin', None, note_valid=False)
+            if pin is None or ':' not in pin:
+                continue
+            chip_name = pin.split(':')[0].strip().lstrip('^~!').strip()
+            if chip_name in ppins.chips:
+                continue
+            if chip_name == 'probe':
+                chip = EstimatorMCU(self, chip_name, z_offset)
+            else:
+                chip = EstimatorMCU(self, chip_name)
+            ppins.register_chip(chip_name, chip)
+    def _setup_sensor(self, config):
+        return EstimatorSensor(config)
+    def _read_config(self):
+        self.objects['configfile'] = pconfig = configfile.PrinterConfig(self)
+        config = pconfig.read_main_config()
+        pins.add_printer_objects(config)
+        self._setup_chips(config)
+        pheaters = self.load_object(config, 'heaters')
+        pheaters.setup_sensor = self._setup_sensor
+        for section_config in config.get_prefix_sections(''):
+            name = section_config.get_name()
+            if name.split()[0] in LOAD_SECTIONS:
+                self.load_object(config, name)
+        toolhead.add_printer_objects(config)
+        # Homing is instantaneous
+        gcode = self.lookup_object('gcode')
+        gcode.register_command('G28', None)
+        gcode.register_command('G28', self.cmd_G28)
+    def cmd_G28(self, gcmd):
+        axes = [pos for pos, axis in enumerate('XYZ')
+                if gcmd.get(axis, None) is not None]
+        if not axes:
+            axes = [0, 1, 2]
+        homing_state = EstimatorHoming(self)
+        homing_state.set_axes(axes)
+        kin = self.lookup_object('toolhead').get_kinematics()
+        kin.home(homing_state)
+    def setup(self):
+        self._read_config()
+        for event in ["klippy:mcu_identify", "klippy:connect"]:
+            self.send_event(event)
+        # Motion is planned but steps are not generated
+        th = self.lookup_object('toolhead')
+        del th.step_generators[:]
+        del th.pool_steppers[:]
+        self.state_message = klippy.message_ready
+        self.send_event("klippy:ready")
+
+
+######################################################################
+# Print time estimation
+######################################################################
+
+class PrintTimeEstimator:
+    def __init__(self, config_file):
+        start_args = {'config_file': config_file, 'debugoutput': os.devnull,
+                      'gcode_fd': os.open(os.devnull, os.O_RDWR)}
+        self.printer = EstimatorPrinter(reactor.Reactor(), None, start_args)
+        self.printer.setup()
+        self.toolhead = self.printer.lookup_object('toolhead')
+        self.gcode = self.printer.lookup_object('gcode')
+        self.layers = []
+    def _note_layer(self, layer):
+        def layer_callback(print_time):
+            self.layers.append((layer, print_time))
+        self.toolhead.register_lookahead_callback(layer_callback)
+    def _process(self, lines):
+        self.gcode.run_script("".join(lines))
+    def estimate(self, f):
+        start_time = self.toolhead.get_last_move_time()
+        layer_match = layer_r.match
+        lines = []
+        for line in f:
+            m = None
+            if line[:1] in ';S':
+                m = layer_match(line)
+            if m is not None:
+                self._process(lines)
+                lines = []
+                num = m.group('num') or m.group('s3d') or m.group('psi')
+                if num is None:
+                    num = len(self.layers)
+                self._note_layer(int(num))
+            lines.append(line)
+            if len(lines) >= INPUT_CHUNK:
+                self._process(lines)
+                lines = []
+        self._process(lines)
+        end_time = self.toolhead.get_last_move_time()
+        # Build report
+        layers = []
+        starts = [lt for l, lt in self.layers] + [end_time]
+        for i, (layer, layer_time) in enumerate(self.layers):
+            layers.append({'layer': layer, 'start': layer_time - start_time,
+                           'time': starts[i+1] - layer_time})
+        return {'total_time': end_time - start_time,
+                'startup_time': starts[0] - start_time,
+                'layers': layers}
+
+def format_time(secs):
+    secs = int(secs + .5)
+    return "%d:%02d:%02d" % (secs // 3600, (secs // 60) % 60, secs % 60)
+
+def main():
+    usage = "%prog [options] <config file> <gcode file>"
+    opts = optparse.OptionParser(usage)
+    opts.add_option("-j", "--json", action="store_true",
+                    help="output results in json format")
+    opts.add_option("-s", "--summary", action="store_true",
+                    help="only report the total motion time")
+    opts.add_option("-v", action="store_true", dest="verbose",
+                    help="enable debug messages")
+    options, args = opts.parse_args()
+    if len(args) != 2:
+        opts.error("Incorrect number of arguments")
+    logging.basicConfig(level=logging.DEBUG if options.verbose
+                        else logging.ERROR)
+    starttime = time.time()
+    try:
+        est = PrintTimeEstimator(args[0])
+    except (configfile.error, pins.error) as e:
+        sys.stderr.write("Config error: %s\n" % (str(e),))
+        sys.exit(-1)
+    try:
+        with io.open(args[1], 'r', encoding='utf-8', errors='replace') as f:
+            res = est.estimate(f)
+    except est.printer.command_error as e:
+        sys.stderr.write("Error: %s\n" % (str(e),))
+        sys.exit(-1)
+    res['run_time'] = time.time() - starttime
+    if options.json:
+        sys.stdout.write(json.dumps(res) + "\n")
+        return
+    if not options.summary:
+        print("Startup: %.3fs" % (res['startup_time'],))
+        for l in res['layers']:
+            print("Layer %d: start %.3fs time %.3fs" % (
+                l['layer'], l['start'], l['time']))
+    print("Total motion time: %.3fs (%s)" % (
+        res['total_time'], format_time(res['total_time'])))
+    print("Estimate run time: %.3fs" % (res['run_time'],))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,681 @@
+#!/usr/bin/env python
+# Simulate a micro-controller on a pseudo-tty for testing without hardware
+#
+# Copyright (C) 2026  agent <agent@local>
+#
+# This file may be distributed under the terms of the GNU GPLv3 license.
+import sys, os, optparse, logging, json, zlib, pty, tty, errno, random
+import collections
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)),
+                             '..', 'klippy'))
+import reactor, msgproto, util
+
+# Commands that are still processed after a shutdown
+IN_SHUTDOWN_COMMANDS = [
+    'identify', 'get_config', 'get_clock', 'get_uptime', 'emergency_stop',
+    'clear_shutdown', 'config_reset', 'reset', 'debug_ping', 'debug_nop']
+
+class error(Exception):
+    pass
+
+STATS_TIME = 5.
+BULK_DATA_SIZE = 51
+BYTES_PER_SAMPLE = 5
+# Allowed delay between the receipt of a step and its scheduled time
+STEP_PAST_TIME = .100
+
+
+######################################################################
+# Serial port emulation
+######################################################################
+
+class SimulatedSerial:
+    def __init__(self, reactor, ptyname, baud, latency):
+        self.reactor = reactor
+        self.latency = latency
+        self.byte_time = 0.
+        if baud:
+            self.byte_time = 10. / baud
+        self.mfd, self.sfd = pty.openpty()
+        # Keep the slave open so that reads do not fail while no host
+        # is connected
+        tty.setraw(self.sfd)
+        try:
+            os.unlink(ptyname)
+        except os.error:
+            pass
+        os.symlink(os.ttyname(self.sfd), ptyname)
+        util.set_nonblock(self.mfd)
+        self.input_callback = None
+        self.fd_handle = reactor.register_fd(self.mfd, self._process_input)
+        self.pending = collections.deque()
+        self.next_free_time = 0.
+        self.write_timer = reactor.register_timer(self._flush_output)
+    def set_input_callback(self, callback):
+        self.input_callback = callback
+    def _process_input(self, eventtime):
+        try:
+            data = os.read(self.mfd, 4096)
+        except os.error as e:
+            if e.errno in (errno.EAGAIN, errno.EWOULDBLOCK):
+                return
+            raise
+        self.input_callback(eventtime, bytearray(data))
+    def _write(self, data):
+        try:
+            os.write(self.mfd, data)
+        except os.error as e:
+            # Discard output if the host is not reading it
+            if e.errno not in (errno.EAGAIN, errno.EWOULDBLOCK, errno.EIO):
+                raise
+    def write(self, data):
+        if not self.latency and not self.byte_time:
+            self._write(data)
+            return
+        # Delay data based on configured latency and bandwidth
+        curtime = self.reactor.monotonic()
+        start_time = max(curtime + self.latency, self.next_free_time)
+        self.next_free_time = start_time + len(data) * self.byte_time
+        self.pending.append((self.next_free_time, data))
+        if len(self.pending) == 1:
+            self.reactor.update_timer(self.write_timer, self.next_free_time)
+    def _flush_output(self, eventtime):
+        pending = self.pending
+        while pending and pending[0][0] <= eventtime:
+            self._write(pending.popleft()[1])
+        if pending:
+            return pending[0][0]
+        return self.reactor.NEVER
+
+
+######################################################################
+# Simulated peripherals
+######################################################################
+
+class SimStepper:
+    def __init__(self, sim, oid):
+        self.sim = sim
+        self.oid = oid
+        self.position = 0
+        self.next_dir = 0
+        self.next_step_clock = 0
+        self.need_reset = False
+        # Queue of (first_clock, interval, count, add, step_dir) moves
+        self.moves = collections.deque()
+    def _get_end_clock(self, move):
+        first_clock, interval, count, add, step_dir = move
+        return first_clock + count * interval + add * count * (count - 1) // 2
+    def _retire_moves(self, clock):
+        moves = self.moves
+        while moves and self._get_end_clock(moves[0]) <= clock:
+            move = moves.popleft()
+            self.position += move[4] * move[2]
+    def get_position(self, clock):
+        self._retire_moves(clock)
+        if not self.moves:
+            return self.position
+        # Find the number of steps of the active move taken at 'clock'
+        first_clock, interval, count, add, step_dir = self.moves[0]
+        low, high = 0, count
+        while low < high:
+            mid = (low + high + 1) // 2
+            step_clock = first_clock + mid*interval + add*mid*(mid-1) // 2
+            if step_clock <= clock:
+                low = mid
+            else:
+                high = mid - 1
+        return self.position + step_dir * low
+    def reset_step_clock(self, clock):
+        self._retire_moves(self.sim.get_clock())
+        if self.moves:
+            self.sim.shutdown("Can't reset time when stepper active")
+            return
+        self.next_step_clock = clock
+        self.need_reset = False
+    def queue_step(self, interval, count, add):
+        if not count:
+            self.sim.shutdown("Invalid count parameter")
+            return
+        if self.need_reset:
+            return
+        curclock = self.sim.get_clock()
+        self._retire_moves(curclock)
+        first_step = self.next_step_clock + interval
+        if first_step < curclock - STEP_PAST_TIME * self.sim.freq:
+            self.sim.shutdown("Stepper too far in past")
+            return
+        move = (self.next_step_clock, interval, count, add,
+                1 if self.next_dir else -1)
+        self.moves.append(move)
+        self.next_step_clock = self._get_end_clock(move)
+    def stop(self, clock):
+        self.position = self.get_position(clock)
+        self.moves.clear()
+        self.need_reset = True
+
+class SimTrsync:
+    def __init__(self, sim, oid):
+        self.sim = sim
+        self.oid = oid
+        self.can_trigger = False
+        self.trigger_reason = self.expire_reason = 0
+        self.report_ticks = 0
+        self.steppers = []
+        self.report_timer = sim.register_timer(self._report_event)
+        self.expire_timer = sim.register_timer(self._expire_event)
+    def _report(self, clock):
+        self.sim.send("trsync_state", oid=self.oid,
+                      can_trigger=int(self.can_trigger),
+                      trigger_reason=self.trigger_reason, clock=clock)
+    def _report_event(self, eventtime):
+        self._report(self.sim.get_clock(eventtime) & 0xffffffff)
+        return eventtime + self.report_ticks / self.sim.freq
+    def _expire_event(self, eventtime):
+        self.trigger(self.expire_reason, self.sim.get_clock(eventtime))
+        return self.sim.reactor.NEVER
+    def _stop_timers(self):
+        reactor = self.sim.reactor
+        reactor.update_timer(self.report_timer, reactor.NEVER)
+        reactor.update_timer(self.expire_timer, reactor.NEVER)
+    def start(self, report_clock, report_ticks, expire_reason):
+        self._stop_timers()
+        self.steppers = []
+        self.can_trigger = True
+        self.trigger_reason = 0
+        self.expire_reason = expire_reason
+        self.report_ticks = report_ticks
+        if report_ticks:
+            self.sim.reactor.update_timer(self.report_timer,
+                                          self.sim.clock_to_time(report_clock))
+    def set_timeout(self, clock):
+        if self.can_trigger:
+            self.sim.reactor.update_timer(self.expire_timer,
+                                          self.sim.clock_to_time(clock))
+    def add_stepper(self, stepper):
+        self.steppers.append(stepper)
+    def trigger(self, reason, clock):
+        if not self.can_trigger:
+            return
+        self.can_trigger = False
+        self.trigger_reason = reason
+        for stepper in self.steppers:
+            stepper.stop(clock)
+        self.steppers = []
+        self._stop_timers()
+        self._report(clock & 0xffffffff)
+
+class SimEndstop:
+    def __init__(self, sim, oid):
+        self.sim = sim
+        self.oid = oid
+        self.homing = False
+        self.pin_value = self.trigger_value = 0
+        self.trsync = None
+        self.trigger_reason = 0
+        self.timer = sim.register_timer(self._trigger_event)
+    def _trigger_event(self, eventtime):
+        if self.homing:
+            self.homing = False
+            self.pin_value = self.trigger_value
+            self.trsync.trigger(self.trigger_reason,
+                                self.sim.get_clock(eventtime))
+        return self.sim.reactor.NEVER
+    def home(self, clock, sample_count, pin_value, trsync, trigger_reason):
+        self.sim.reactor.update_timer(self.timer, self.sim.reactor.NEVER)
+        if not sample_count:
+            # End of homing - assume the endstop is no longer triggered
+            self.homing = False
+            self.pin_value = int(not self.trigger_value)
+            return
+        self.homing = True
+        self.trigger_value = pin_value
+        self.pin_value = int(not pin_value)
+        self.trsync = trsync
+        self.trigger_reason = trigger_reason
+        if self.sim.endstop_delay < 0.:
+            # Endstop never triggers
+            return
+        start_time = max(self.sim.clock_to_time(clock),
+                         self.sim.reactor.monotonic())
+        self.sim.reactor.update_timer(self.timer,
+                                      start_time + self.sim.endstop_delay)
+    def query_state(self):
+        self.sim.send("endstop_state", oid=self.oid, homing=int(self.homing),
+                      next_clock=self.sim.get_clock() & 0xffffffff,
+                      pin_value=self.pin_value)
+
+class SimAnalogIn:
+    def __init__(self, sim, oid):
+        self.sim = sim
+        self.oid = oid
+        self.next_begin_clock = 0
+        self.sample_ticks = self.sample_count = self.rest_ticks = 0
+        self.value = 0
+        self.timer = sim.register_timer(self._report_event)
+    def query(self, clock, sample_ticks, sample_count, rest_ticks,
+              min_value, max_value, range_check_count):
+        self.sim.reactor.update_timer(self.timer, self.sim.reactor.NEVER)
+        if not sample_count:
+            return
+        self.next_begin_clock = clock
+        self.sample_ticks = sample_ticks
+        self.sample_count = sample_count
+        self.rest_ticks = rest_ticks
+        adc_max = self.sim.adc_max * sample_count
+        if self.sim.adc_value is not None:
+            value = int(self.sim.adc_value * adc_max + .5)
+        elif range_check_count:
+            value = (min_value + max_value) // 2
+        else:
+            value = adc_max // 2
+        if range_check_count:
+            value = max(min_value, min(max_value, value))
+        self.value = max(0, min(0xffff, value))
+        self._schedule()
+    def _schedule(self):
+        clock = self.next_begin_clock + self.sample_ticks * self.sample_count
+        waketime = self.sim.clock_to_time(clock)
+        self.sim.reactor.update_timer(self.timer, waketime)
+    def _report_event(self, eventtime):
+        self.next_begin_clock += self.rest_ticks
+        self.sim.send("analog_in_state", oid=self.oid,
+                      next_clock=self.next_begin_clock & 0xffffffff,
+                      value=self.value)
+        clock = self.next_begin_clock + self.sample_ticks * self.sample_count
+        return self.sim.clock_to_time(clock)
+
+# SPI device with a simple register interface (address in first byte,
+# 0x80 bit indicates a read)
+class SimSPI:
+    def __init__(self, sim, oid):
+        self.sim = sim
+        self.oid = oid
+        self.regs = bytearray(64)
+    def transfer(self, data):
+        if not data:
+            return bytearray()
+        reg = data[0] & 0x3f
+        if data[0] & 0x80:
+            count = len(data) - 1
+            return bytearray([0]) + self.regs[reg:reg+count]
+        self.regs[reg:reg+len(data)-1] = data[1:]
+        return bytearray(len(data))
+
+class SimADXL345:
+    REG_DEVID = 0x00
+    REG_BW_RATE = 0x2C
+    REG_POWER_CTL = 0x2D
+    def __init__(self, sim, oid, spi):
+        self.sim = sim
+        self.oid = oid
+        self.spi = spi
+        spi.regs[self.REG_DEVID] = 0xe5
+        self.rest_ticks = 0
+        self.sequence = self.possible_overflows = 0
+        self.data = bytearray()
+        self.measure_start = None
+        self.sample_count = 0
+        self.timer = sim.register_timer(self._query_event)
+    def query(self, rest_ticks):
+        self.sim.reactor.update_timer(self.timer, self.sim.reactor.NEVER)
+        if not rest_ticks:
+            return
+        self.rest_ticks = rest_ticks
+        self.sequence = self.possible_overflows = 0
+        self.data = bytearray()
+        self.measure_start = None
+        self.sim.reactor.update_timer(self.timer, self.sim.reactor.NOW)
+    def _get_sample(self):
+        # Gravity on the z axis with some measurement noise
+        x = int(random.gauss(0., 3.))
+        y = int(random.gauss(0., 3.))
+        z = 256 + int(random.gauss(0., 3.))
+        xh, yh, zh = (x >> 8) & 0xff, (y >> 8) & 0xff, (z >> 8) & 0xff
+        return [x & 0xff, y & 0xff, z & 0xff,
+                (xh & 0x1f) | ((zh << 5) & 0xe0),
+                (yh & 0x1f) | ((zh << 2) & 0x60)]
+    def _query_event(self, eventtime):
+        regs = self.spi.regs
+        if not regs[self.REG_POWER_CTL] & 0x08:
+            self.measure_start = None
+        else:
+            if self.measure_start is None:
+                self.measure_start = eventtime
+                self.sample_count = 0
+            rate = 3200. / 2**(0x0f - (regs[self.REG_BW_RATE] & 0x0f))
+            count = int((eventtime - self.measure_start) * rate)
+            for i in range(count - self.sample_count):
+                self.data.extend(self._get_sample())
+                if len(self.data) + BYTES_PER_SAMPLE > BULK_DATA_SIZE:
+                    self._report()
+            self.sample_count = count
+        return eventtime + self.rest_ticks / self.sim.freq
+    def _report(self):
+        self.sim.send("sensor_bulk_data", oid=self.oid,
+                      sequence=self.sequence & 0xffff, data=bytes(self.data))
+        self.data = bytearray()
+        self.sequence += 1
+    def query_status(self):
+        self.sim.send("sensor_bulk_status", oid=self.oid,
+                      clock=self.sim.get_clock() & 0xffffffff, query_ticks=10,
+                      next_sequence=self.sequence & 0xffff,
+                      buffered=len(self.data),
+                      possible_overflows=self.possible_overflows)
+
+
+######################################################################
+# Micro-controller simulation
+######################################################################
+
+class MCUSimulator:
+    def __init__(self, reactor, dictionary, serial, options):
+        self.reactor = reactor
+        self.serial = serial
+        self.move_count = options.move_count
+        self.endstop_delay = options.endstop_delay
+        self.adc_value = options.adc_value
+        # Load data dictionary
+        self.identify_data = zlib.compress(dictionary, 9)
+        self.msgparser = msgproto.MessageParser()
+        self.msgparser.process_identify(dictionary, decompress=False)
+        self.freq = self.msgparser.get_constant_float('CLOCK_FREQ')
+        self.adc_max = self.msgparser.get_constant_float('ADC_MAX', 4095.)
+        enums = self.msgparser.get_enumerations()
+        self.static_strings = enums.get('static_string_id', {})
+        # Clock and message state
+        self.start_time = reactor.monotonic()
+        self.next_sequence = msgproto.MESSAGE_DEST
+        self.input_buf = bytearray()
+        self.need_sync = False
+        serial.set_input_callback(self._process_input)
+        self.timers = []
+        self.stats_timer = reactor.register_timer(
+            self._stats_event, self.start_time + STATS_TIME)
+        self._reset_config()
+    def _reset_config(self):
+        self.shutdown_reason = None
+        self.is_config = 0
+        self.config_crc = 0
+        self.oids = {}
+        for timer in self.timers:
+            self.reactor.unregister_timer(timer)
+        self.timers = []
+    def register_timer(self, callback):
+        timer = self.reactor.register_timer(callback)
+        self.timers.append(timer)
+        return timer
+    # Clock handling
+    def get_clock(self, eventtime=None):
+        if eventtime is None:
+            eventtime = self.reactor.monotonic()
+        return int((eventtime - self.start_time) * self.freq)
+    def clock32_to_clock64(self, clock32):
+        last_clock = self.get_clock()
+        clock_diff = (clock32 - last_clock) & 0xffffffff
+        if clock_diff & 0x80000000:
+            clock_diff -= 0x100000000
+        return last_clock + clock_diff
+    def clock_to_time(self, clock):
+        return self.start_time + clock / self.freq
+    # Message transmission
+    def _send_block(self, cmd):
+        msglen = msgproto.MESSAGE_MIN + len(cmd)
+        out = [msglen, self.next_sequence] + cmd
+        out.extend(msgproto.crc16_ccitt(out))
+        out.append(msgproto.MESSAGE_SYNC)
+        self.serial.write(bytes(bytearray(out)))
+    def send(self, name, **params):
+        mf = self.msgparser.messages_by_name[name]
+        self._send_block(mf.encode_by_name(**params))
+    def shutdown(self, reason):
+        if self.shutdown_reason is not None:
+            return
+        if reason not in self.static_strings:
+            reason = "Command request"
+        logging.info("Shutdown: %s", reason)
+        self.shutdown_reason = reason
+        for timer in self.timers:
+            self.reactor.update_timer(timer, self.reactor.NEVER)
+        self.send("shutdown", clock=self.get_clock() & 0xffffffff,
+                  static_string_id=reason)
+    # Message reception
+    def _process_input(self, eventtime, data):
+        buf = self.input_buf
+        buf.extend(data)
+        while buf:
+            if self.need_sync:
+                # Discard bytes until next sync byte
+                pos = buf.find(bytearray([msgproto.MESSAGE_SYNC]))
+                if pos < 0:
+                    del buf[:]
+                    break
+                del buf[:pos+1]
+                self.need_sync = False
+                self._send_block([])
+                continue
+            msglen = self.msgparser.check_packet(buf)
+            if not msglen:
+                break
+            if msglen < 0:
+                if buf[0] != msgproto.MESSAGE_SYNC:
+                    self.need_sync = True
+                else:
+                    del buf[:1]
+                continue
+            block = buf[:msglen]
+            del buf[:msglen]
+            msgseq = block[msgproto.MESSAGE_POS_SEQ]
+            if msgseq != self.next_sequence:
+                # Lost message - send nak
+                self._send_block([])
+                continue
+            self.next_sequence = (((msgseq + 1) & msgproto.MESSAGE_SEQ_MASK)
+                                  | msgproto.MESSAGE_DEST)
+            self._dispatch(block)
+            self._send_block([])
+    def _dispatch(self, block):
+        mp = self.msgparser
+        pos = msgproto.MESSAGE_HEADER_SIZE
+        end = len(block) - msgproto.MESSAGE_TRAILER_SIZE
+        while pos < end:
+            msgid, param_pos = mp.msgid_parser.parse(block, pos)
+            mid = mp.messages_by_id.get(msgid)
+            if mid is None:
+                self.shutdown("Invalid command")
+                return
+            params, pos = mid.parse(block, pos)
+            name = mid.name
+            logging.debug("Received %s", mid.format_params(params))
+            if (self.shutdown_reason is not None
+                and name not in IN_SHUTDOWN_COMMANDS):
+                self.send("is_shutdown", static_string_id=self.shutdown_reason)
+                continue
+            func = getattr(self, 'cmd_' + name, None)
+            if func is None:
+                continue
+            try:
+                func(params)
+            except error as e:
+                self.shutdown(str(e))
+                return
+    def _lookup_oid(self, oid, obj_type):
+        obj = self.oids.get(oid)
+        if not isinstance(obj, obj_type):
+            raise error("Invalid oid type")
+        return obj
+    def _alloc_oid(self, oid, obj):
+        self.oids[oid] = obj
+    # Periodic statistics
+    def _stats_event(self, eventtime):
+        # Report a lightly loaded mcu
+        count = 10000
+        diff = int(.01 * STATS_TIME * self.freq / count)
+        sumsq = min(0xffffffff, count * ((diff * diff + 255) // 256))
+        self.send("stats", count=count, sum=count * diff, sumsq=sumsq)
+        return eventtime + STATS_TIME
+    # Basic commands
+    def cmd_identify(self, params):
+        offset, count = params['offset'], params['count']
+        self.send("identify_response", offset=offset,
+                  data=self.identify_data[offset:offset+count])
+    def cmd_get_uptime(self, params):
+        clock = self.get_clock()
+        self.send("uptime", high=clock >> 32, clock=clock & 0xffffffff)
+    def cmd_get_clock(self, params):
+        self.send("clock", clock=self.get_clock() & 0xffffffff)
+    def cmd_get_config(self, params):
+        self.send("config", is_config=self.is_config, crc=self.config_crc,
+                  is_shutdown=int(self.shutdown_reason is not None),
+                  move_count=self.move_count)
+    def cmd_finalize_config(self, params):
+        self.is_config = 1
+        self.config_crc = params['crc']
+    def cmd_emergency_stop(self, params):
+        self.shutdown("Command request")
+    def cmd_clear_shutdown(self, params):
+        if self.shutdown_reason is None:
+            self.shutdown("Shutdown cleared when not shutdown")
+            return
+        self.shutdown_reason = None
+    def cmd_config_reset(self, params):
+        if self.shutdown_reason is None:
+            self.shutdown("config_reset only available when shutdown")
+            return
+        logging.info("Config reset")
+        self._reset_config()
+    def cmd_reset(self, params):
+        logging.info("Reset")
+        self._reset_config()
+        self.next_sequence = msgproto.MESSAGE_DEST
+    def cmd_debug_ping(self, params):
+        self.send("pong", data=params['data'])
+    # Steppers and homing
+    def cmd_config_stepper(self, params):
+        self._alloc_oid(params['oid'], SimStepper(self, params['oid']))
+    def cmd_queue_step(self, params):
+        stepper = self._lookup_oid(params['oid'], SimStepper)
+        stepper.queue_step(params['interval'], params['count'], params['add'])
+    def cmd_set_next_step_dir(self, params):
+        self._lookup_oid(params['oid'], SimStepper).next_dir = params['dir']
+    def cmd_reset_step_clock(self, params):
+        stepper = self._lookup_oid(params['oid'], SimStepper)
+        stepper.reset_step_clock(self.clock32_to_clock64(params['clock']))
+    def cmd_stepper_get_position(self, params):
+        stepper = self._lookup_oid(params['oid'], SimStepper)
+        self.send("stepper_position", oid=params['oid'],
+                  pos=stepper.get_position(self.get_clock()))
+    def cmd_stepper_stop_on_trigger(self, params):
+        stepper = self._lookup_oid(params['oid'], SimStepper)
+        trsync = self._lookup_oid(params['trsync_oid'], SimTrsync)
+        trsync.add_stepper(stepper)
+    def cmd_config_trsync(self, params):
+        self._alloc_oid(params['oid'], SimTrsync(self, params['oid']))
+    def cmd_trsync_start(self, params):
+        trsync = self._lookup_oid(params['oid'], SimTrsync)
+        trsync.start(self.clock32_to_clock64(params['report_clock']),
+                     params['report_ticks'], params['expire_reason'])
+    def cmd_trsync_set_timeout(self, params):
+        trsync = self._lookup_oid(params['oid'], SimTrsync)
+        trsync.set_timeout(self.clock32_to_clock64(params['clock']))
+    def cmd_trsync_trigger(self, params):
+        trsync = self._lookup_oid(params['oid'], SimTrsync)
+        trsync.trigger(params['reason'], self.get_clock())
+        self.send("trsync_state", oid=params['oid'], can_trigger=0,
+                  trigger_reason=trsync.trigger_reason, clock=0)
+    def cmd_config_endstop(self, params):
+        self._alloc_oid(params['oid'], SimEndstop(self, params['oid']))
+    def cmd_endstop_home(self, params):
+        endstop = self._lookup_oid(params['oid'], SimEndstop)
+        trsync = None
+        if params['sample_count']:
+            trsync = self._lookup_oid(params['trsync_oid'], SimTrsync)
+        endstop.home(self.clock32_to_clock64(params['clock']),
+                     params['sample_count'], params['pin_value'], trsync,
+                     params['trigger_reason'])
+    def cmd_endstop_query_state(self, params):
+        self._lookup_oid(params['oid'], SimEndstop).query_state()
+    # Sensors
+    def cmd_config_analog_in(self, params):
+        self._alloc_oid(params['oid'], SimAnalogIn(self, params['oid']))
+    def cmd_query_analog_in(self, params):
+        adc = self._lookup_oid(params['oid'], SimAnalogIn)
+        adc.query(self.clock32_to_clock64(params['clock']),
+                  params['sample_ticks'], params['sample_count'],
+                  params['rest_ticks'], params['min_value'],
+                  params['max_value'], params['range_check_count'])
+    def cmd_config_spi(self, params):
+        self._alloc_oid(params['oid'], SimSPI(self, params['oid']))
+    def cmd_config_spi_without_cs(self, params):
+        self._alloc_oid(params['oid'], SimSPI(self, params['oid']))
+    def cmd_spi_send(self, params):
+        self._lookup_oid(params['oid'], SimSPI).transfer(
+            bytearray(params['data']))
+    def cmd_spi_transfer(self, params):
+        spi = self._lookup_oid(params['oid'], SimSPI)
+        response = spi.transfer(bytearray(params['data']))
+        self.send("spi_transfer_response", oid=params['oid'],
+                  response=bytes(response))
+    def cmd_config_adxl345(self, params):
+        spi = self._lookup_oid(params['spi_oid'], SimSPI)
+        self._alloc_oid(params['oid'], SimADXL345(self, params['oid'], spi))
+    def cmd_query_adxl345(self, params):
+        adxl = self._lookup_oid(params['oid'], SimADXL345)
+        adxl.query(params['rest_ticks'])
+    def cmd_query_adxl345_status(self, params):
+        self._lookup_oid(params['oid'], SimADXL345).query_status()
+
+
+######################################################################
+# Startup
+######################################################################
+
+def main():
+    usage = "%prog [options] <data dictionary>"
+    opts = optparse.OptionParser(usage)
+    opts.add_option("-o", "--output", dest="output",
+                    default="/tmp/klipper_host_sim",
+                    help="filename of the pseudo-tty to create")
+    opts.add_option("-b", "--baud", type="int", dest="baud", default=250000,
+                    help="simulated baud rate of mcu responses (0 for none)")
+    opts.add_option("-l", "--latency", type="float", dest="latency",
+                    default=0., help="delay (in seconds) of mcu responses")
+    opts.add_option("-m", "--move-count", type="int", dest="move_count",
+                    default=1024, help="number of moves the mcu may queue")
+    opts.add_option("-e", "--endstop-delay", type="float",
+                    dest="endstop_delay", default=.5,
+                    help="time from start of homing to endstop trigger"
+                    " (negative for never)")
+    opts.add_option("-a", "--adc", type="float", dest="adc_value",
+                    help="adc reading as fraction of maximum"
+                    " (default is middle of the valid range)")
+    opts.add_option("-v", action="store_true", dest="verbose",
+                    help="enable debug messages")
+    options, args = opts.parse_args()
+    if len(args) != 1:
+        opts.error("Incorrect number of arguments")
+    if options.baud < 0 or options.latency < 0. or options.move_count < 1:
+        opts.error("Invalid timing option")
+    debuglevel = logging.INFO
+    if options.verbose:
+        debuglevel = logging.DEBUG
+    logging.basicConfig(level=debuglevel)
+    f = open(args[0], 'rb')
+    dictionary = f.read()
+    f.close()
+    try:
+        json.loads(dictionary)
+    except ValueError:
+        opts.error("Data dictionary is not a valid json file")
+    r = reactor.Reactor()
+    serial = SimulatedSerial(r, options.output, options.baud, options.latency)
+    sim = MCUSimulator(r, dictionary, serial, options)
+    logging.info("Simulating mcu (%s) on %s", sim.msgparser.version,
+                 options.output)
+    try:
+        r.run()
+    except KeyboardInterrupt:
+        pass
+    r.finalize()
+
+if __name__ == '__main__':
+    main()
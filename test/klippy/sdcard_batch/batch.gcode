@@ -0,0 +1,68 @@
+; Print used to test virtual_sdcard batch_lines
+; The last line only runs if every line above it was processed
+G91
+G1 E1 ; This is line 0
+G1 E1 ; This is line 1
+G1 E1 ; This is line 2
+G1 E1 ; This is line 3
+G1 E1 ; This is line 4
+G1 E1 ; This is line 5
+G1 E1 ; This is line 6
+G1 E1 ; This is line 7
+G1 E1 ; This is line 8
+G1 E1 ; This is line 9
+G1 E1 ; This is line 10
+G1 E1 ; This is line 11
+G1 E1 ; This is line 12
+G1 E1 ; This is line 13
+G1 E1 ; This is line 14
+G1 E1 ; This is line 15
+G1 E1 ; This is line 16
+G1 E1 ; This is line 17
+G1 E1 ; This is line 18
+G1 E1 ; This is line 19
+G1 Z1
+G1 E1 ; This is line 0
+G1 E1 ; This is line 1
+G1 E1 ; This is line 2
+G1 E1 ; This is line 3
+G1 E1 ; This is line 4
+G1 E1 ; This is line 5
+G1 E1 ; This is line 6
+G1 E1 ; This is line 7
+G1 E1 ; This is line 8
+G1 E1 ; This is line 9
+G1 E1 ; This is line 10
+G1 E1 ; This is line 11
+G1 E1 ; This is line 12
+G1 E1 ; This is line 13
+G1 E1 ; This is line 14
+G1 E1 ; This is line 15
+G1 E1 ; This is line 16
+G1 E1 ; This is line 17
+G1 E1 ; This is line 18
+G1 E1 ; This is line 19
+G1 Z1
+G1 E1 ; This is line 0
+G1 E1 ; This is line 1
+G1 E1 ; This is line 2
+G1 E1 ; This is line 3
+G1 E1 ; This is line 4
+G1 E1 ; This is line 5
+G1 E1 ; This is line 6
+G1 E1 ; This is line 7
+G1 E1 ; This is line 8
+G1 E1 ; This is line 9
+G1 E1 ; This is line 10
+G1 E1 ; This is line 11
+G1 E1 ; This is line 12
+G1 E1 ; This is line 13
+G1 E1 ; This is line 14
+G1 E1 ; This is line 15
+G1 E1 ; This is line 16
+G1 E1 ; This is line 17
+G1 E1 ; This is line 18
+G1 E1 ; This is line 19
+G1 Z1
+G90
+CHECK_BATCH_PRINT